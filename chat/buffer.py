@@ -0,0 +1,267 @@
+import asyncio
+import atexit
+import fcntl
+import json
+import os
+import socket
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError
+from .models import ChatMessage
+
+
+class ChatMessageBuffer:
+    """
+    Write-behind buffer for chat messages. Consumers broadcast messages right
+    away and add them here; they are persisted with bulk_create once
+    `max_size` messages are pending or `flush_interval` seconds have passed.
+
+    Pending messages are also appended to a journal file of this process in
+    `journal_dir`, which is cut back to what is still pending after every
+    flush. The process holds a lock on the journal while it runs, so if it is
+    killed (SIGKILL, OOM, a hard worker restart) the next process to buffer a
+    message replays the journal. The journal is not fsynced: a host crash or
+    power loss can still lose the last CHAT_BUFFER_FLUSH_INTERVAL of chat.
+    """
+
+    def __init__(self, max_size, flush_interval, max_pending, journal_dir=None):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.journal_dir = Path(journal_dir) if journal_dir else None
+        self.journal = None
+        self.journal_lock = None
+        self.recovered = False
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.flush_task = None
+        self.stats = {
+            "depth": 0,
+            "flushes": 0,
+            "flushed_messages": 0,
+            "failed_flushes": 0,
+            "dropped_messages": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+        }
+
+    async def add(self, message):
+        if not self.recovered:
+            self.recovered = True
+            await database_sync_to_async(self.recover)()
+
+        self.pending.append(message)
+        self.write_journal([message])
+
+        # Never grow without bound while the database is unavailable
+        overflow = len(self.pending) - self.max_pending
+        if overflow > 0:
+            del self.pending[:overflow]
+            self.stats["dropped_messages"] += overflow
+            print(f"[ERROR] Chat buffer full, dropped {overflow} unsaved message(s).")
+        self.stats["depth"] = len(self.pending)
+
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        else:
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.get_running_loop().create_task(self.delayed_flush())
+
+    async def delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+
+            start = time.perf_counter()
+            try:
+                await database_sync_to_async(ChatMessage.objects.bulk_create)(batch)
+            except IntegrityError:
+                # One bad row (e.g. a deleted stream) must not block the whole batch
+                rejected = await database_sync_to_async(self.save_each)(batch)
+                self.stats["dropped_messages"] += len(rejected)
+            except DatabaseError as e:
+                print(f"[ERROR] Could not persist {len(batch)} chat message(s), retrying: {e}")
+                self.pending[:0] = batch
+                self.stats["failed_flushes"] += 1
+                self.stats["depth"] = len(self.pending)
+                self.schedule_flush()
+                return
+            # Messages added while the batch was written are still pending
+            self.rewrite_journal()
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats["flushes"] += 1
+            self.stats["flushed_messages"] += len(batch)
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+            self.stats["depth"] = len(self.pending)
+            if settings.CHAT_BUFFER_LOG_FLUSHES:
+                print(
+                    f"[DEBUG] Flushed {len(batch)} chat message(s) in {elapsed_ms:.1f} ms "
+                    f"(depth={self.stats['depth']})."
+                )
+
+    def save_each(self, batch):
+        rejected = []
+        for message in batch:
+            try:
+                message.save()
+            except IntegrityError as e:
+                print(f"[ERROR] Dropping chat message that cannot be saved: {e}")
+                rejected.append(message)
+        return rejected
+
+    def drain(self):
+        """Synchronously persists whatever is left, used when the process exits."""
+        batch, self.pending = self.pending, []
+        if batch:
+            print(f"[INFO] Draining {len(batch)} chat message(s) before exit.")
+            try:
+                ChatMessage.objects.bulk_create(batch)
+            except DatabaseError as e:
+                # Left in the journal for the next process
+                print(f"[ERROR] Could not drain chat messages: {e}")
+                return
+        self.close_journal(delete=True)
+
+    # Journal
+
+    def journal_path(self):
+        return self.journal_dir / f"{socket.gethostname()}-{os.getpid()}.jsonl"
+
+    def open_journal(self):
+        if self.journal is not None or self.journal_dir is None:
+            return self.journal
+        path = self.journal_path()
+        try:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            # Held until the process exits, it tells recover() the journal is in use
+            self.journal_lock = open(path.with_suffix(".lock"), "w")
+            fcntl.flock(self.journal_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.journal = open(path, "a", buffering=1)
+        except OSError as e:
+            # The chat keeps working, only without crash protection
+            print(f"[ERROR] Could not open the chat journal {path}: {e}")
+            self.journal_dir = None
+        return self.journal
+
+    def close_journal(self, delete=False):
+        if self.journal is None:
+            return
+        path = Path(self.journal.name)
+        self.journal.close()
+        if delete:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".lock").unlink(missing_ok=True)
+        self.journal_lock.close()
+        self.journal = self.journal_lock = None
+
+    def write_journal(self, messages):
+        journal = self.open_journal()
+        if journal is not None:
+            # One write per call, so a killed process leaves whole lines
+            journal.write("".join(journal_entry(message) for message in messages))
+
+    def rewrite_journal(self):
+        if self.journal is None:
+            return
+        if not self.pending:
+            self.journal.truncate(0)
+            return
+        path = Path(self.journal.name)
+        fd, partial = tempfile.mkstemp(suffix=".part", dir=path.parent)
+        with os.fdopen(fd, "w") as f:
+            f.write("".join(journal_entry(message) for message in self.pending))
+        os.replace(partial, path)
+        self.journal.close()
+        self.journal = open(path, "a", buffering=1)
+
+    def recover(self):
+        """
+        Saves the messages left in the journals of processes that died. A
+        journal whose lock can be taken has no live owner. Messages that were
+        saved before the owner died are skipped.
+        """
+        if self.journal_dir is None or not self.journal_dir.exists():
+            return 0
+        recovered = 0
+        for lock_path in self.journal_dir.glob("*.lock"):
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                journal_path = lock_path.with_suffix(".jsonl")
+                if journal_path.exists():
+                    try:
+                        recovered += self.replay_journal(journal_path)
+                    except DatabaseError as e:
+                        print(f"[ERROR] Could not recover {journal_path}, keeping it: {e}")
+                        continue
+                    journal_path.unlink()
+                # Another process may have recovered it first
+                lock_path.unlink(missing_ok=True)
+        if recovered:
+            print(f"[INFO] Recovered {recovered} chat message(s) from the journal.")
+        return recovered
+
+    def replay_journal(self, path):
+        messages = []
+        for line in path.read_text().splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Cut short when the process was killed
+            messages.append(ChatMessage(
+                streaming_id=entry["streaming_id"],
+                user_id=entry["user_id"],
+                content=entry["content"],
+                timestamp=datetime.fromisoformat(entry["timestamp"]),
+            ))
+        if not messages:
+            return 0
+        saved = set(
+            ChatMessage.objects.filter(
+                timestamp__in=[message.timestamp for message in messages]
+            ).values_list("streaming_id", "user_id", "timestamp")
+        )
+        messages = [
+            message for message in messages
+            if (message.streaming_id, message.user_id, message.timestamp) not in saved
+        ]
+        try:
+            ChatMessage.objects.bulk_create(messages)
+        except IntegrityError:
+            messages = [m for m in messages if m not in self.save_each(messages)]
+        return len(messages)
+
+
+def journal_entry(message):
+    return json.dumps({
+        "streaming_id": message.streaming_id,
+        "user_id": message.user_id,
+        "content": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }) + "\n"
+
+
+chat_buffer = ChatMessageBuffer(
+    max_size=settings.CHAT_BUFFER_SIZE,
+    flush_interval=settings.CHAT_BUFFER_FLUSH_INTERVAL,
+    max_pending=settings.CHAT_BUFFER_MAX_PENDING,
+    journal_dir=settings.CHAT_BUFFER_JOURNAL_DIR,
+)
+atexit.register(chat_buffer.drain)
@@ -1,16 +1,23 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
+from .buffer import chat_buffer
 from .models import ChatMessage
 from streamings.models import Streaming
-from django.contrib.auth import get_user_model
-
-User = get_user_model()
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.stream_id = self.scope['url_route']['kwargs']['stream_id']
         self.room_group_name = f'chat_{self.stream_id}'
 
+        # The user and the stream are fixed for the whole connection, so they
+        # are resolved once here instead of on every message
+        self.user = self.scope['user']
+        try:
+            self.streaming = await Streaming.objects.aget(id=self.stream_id)
+        except (Streaming.DoesNotExist, ValueError):
+            await self.close()
+            return
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -24,19 +31,21 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        # Persist pending messages before the connection goes away
+        await chat_buffer.flush()
 
     async def receive(self, text_data):
+        # Anonymous viewers can read the chat but not write to it
+        if not self.user.is_authenticated:
+            return
+
         data = json.loads(text_data)
         message = data['message']
-        username = data['username']
-        stream_id = data['stream_id']
+        username = self.user.username
 
-        # Save message in the database
-        streaming = await Streaming.objects.aget(id=stream_id)
-        user = await User.objects.aget(username=username)
-        chat_message = await ChatMessage.objects.acreate(streaming=streaming, user=user, content=message)
+        chat_message = ChatMessage(streaming=self.streaming, user=self.user, content=message)
 
-        # Send message to room group
+        # Send message to room group, it is saved later by the write-behind buffer
         await self.channel_layer.group_send(
             self.room_group_name,
             {
@@ -46,6 +55,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'timestamp': str(chat_message.timestamp)
             }
         )
+        await chat_buffer.add(chat_message)
 
     async def chat_message(self, event):
         # Send message to WebSocket
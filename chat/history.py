@@ -0,0 +1,67 @@
+"""
+Cursor pagination of the chat history of a stream.
+
+Pages are read backwards, newest first, from a (timestamp, id) cursor. The
+id breaks ties between messages stored with the same timestamp (the buffer
+writes them in batches), and the chat_history_idx index answers each page
+with a range scan, no matter how far back it is.
+"""
+import base64
+import json
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+from .models import ChatMessage
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(message):
+    value = json.dumps([message.timestamp.isoformat(), message.id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, message_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(f"Invalid history cursor: {cursor!r}.")
+
+
+def serialize_message(message):
+    # Same keys as the messages sent by ChatConsumer
+    return {
+        "id": message.id,
+        "username": message.user.username,
+        "message": message.content,
+        "timestamp": message.timestamp.isoformat(),
+    }
+
+
+def message_history(streaming_id, before=None, limit=None):
+    """
+    Returns up to `limit` messages sent before the `before` cursor (the latest
+    ones without it) in chronological order, and the cursor of the next older
+    page, None when there is nothing older.
+    """
+    if limit is None:
+        limit = settings.CHAT_HISTORY_PAGE_SIZE
+    messages = ChatMessage.objects.filter(streaming_id=streaming_id)
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        # The redundant timestamp bound lets the index seek to the cursor
+        # instead of walking past every newer message
+        messages = messages.filter(timestamp__lte=timestamp).filter(
+            Q(timestamp__lt=timestamp) | Q(id__lt=message_id)
+        )
+    # One extra row tells whether an older page exists
+    page = list(
+        messages.select_related("user").order_by("-timestamp", "-id")[:limit + 1]
+    )
+    older = page[limit] if len(page) > limit else None
+    page = page[:limit]
+    page.reverse()
+    return page, encode_cursor(page[0]) if older else None
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import path
+from chat.buffer import chat_buffer
+from chat.consumers import ChatConsumer
+from streamings.models import Streaming
+
+User = get_user_model()
+
+
+class PerMessageLookupConsumer(ChatConsumer):
+    """Reproduces the previous behaviour: both rows are looked up again for every message."""
+
+    async def receive(self, text_data):
+        self.streaming = await Streaming.objects.aget(id=self.stream_id)
+        self.user = await User.objects.aget(username=self.user.username)
+        await super().receive(text_data)
+
+
+class Command(BaseCommand):
+    help = "Measures messages/sec through a single ChatConsumer, with and without per-message lookups."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000, help="Messages sent per run.")
+
+    def handle(self, *args, **options):
+        # Run against a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            host = User.objects.create_user(username="bench_host", password="bench")
+            streaming = Streaming.objects.create(
+                title="Bench", description="Bench", host=host, is_live=True
+            )
+            for label, consumer in (
+                ("per-message lookups", PerMessageLookupConsumer),
+                ("cached identity", ChatConsumer),
+            ):
+                rate = asyncio.run(self.run(consumer, host, streaming, options["messages"]))
+                self.stdout.write(f"{label:<20} {rate:,.0f} messages/sec")
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    async def run(self, consumer, user, streaming, messages):
+        application = URLRouter([path("ws/chat/<str:stream_id>/", consumer.as_asgi())])
+        communicator = WebsocketCommunicator(application, f"/ws/chat/{streaming.id}/")
+        communicator.scope["user"] = user
+        await communicator.connect()
+
+        start = time.perf_counter()
+        for index in range(messages):
+            await communicator.send_json_to({"message": f"message {index}"})
+            await communicator.receive_json_from()
+        elapsed = time.perf_counter() - start
+
+        await communicator.disconnect()
+        await chat_buffer.flush()
+        return messages / elapsed
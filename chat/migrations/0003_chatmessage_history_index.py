@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_chatmessage_timestamp_default'),
+        ('streamings', '0010_streaming_expected_chunks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['streaming', 'timestamp', 'id'], name='chat_history_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.conf import settings
 from streamings.models import Streaming  
 
@@ -6,7 +7,14 @@ class ChatMessage(models.Model):
     streaming = models.ForeignKey(Streaming, on_delete=models.CASCADE, related_name="chat_messages")
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is received, not when the buffer writes it
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Chat history of a stream, read backwards from a (timestamp, id) cursor
+            models.Index(fields=["streaming", "timestamp", "id"], name="chat_history_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.content[:50]}"
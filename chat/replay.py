@@ -0,0 +1,88 @@
+"""
+Chat replay for recorded streams.
+
+When a stream ends its chat is written once into JSON buckets of
+CHAT_REPLAY_BUCKET_SECONDS of playback each (recorded_streams/<id>/chat/),
+plus an index.json listing the buckets that have messages. The player only
+fetches the bucket of the current position (and prefetches the next one),
+so seeking never queries the chat table.
+"""
+import json
+import shutil
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from streamings.models import StreamChunk
+from .models import ChatMessage
+
+INDEX_NAME = "index.json"
+
+
+def replay_dir(stream_id):
+    return Path(settings.MEDIA_ROOT) / "recorded_streams" / str(stream_id) / "chat"
+
+
+def bucket_path(stream_id, bucket):
+    return replay_dir(stream_id) / f"{bucket}.json"
+
+
+def recording_origin(streaming):
+    """
+    Wall clock time of second 0 of the recording. The recorder starts after
+    the stream is created, so it is estimated from the first chunk, which
+    arrives one chunk duration after recording started.
+    """
+    first_chunk = StreamChunk.objects.filter(streaming=streaming).order_by("index").first()
+    if first_chunk is None:
+        return streaming.start_time
+    return first_chunk.received_at - timedelta(seconds=settings.VIDEO_CHUNK_DURATION)
+
+
+def build_replay(streaming):
+    """
+    Writes the replay buckets of a stream and returns its index. The chat is
+    read once in (timestamp, id) order and a bucket is written as soon as
+    the next one starts, so memory is bounded by the busiest bucket.
+    """
+    bucket_seconds = settings.CHAT_REPLAY_BUCKET_SECONDS
+    origin = recording_origin(streaming)
+    output_dir = replay_dir(streaming.id)
+    building_dir = output_dir.with_name(f"{output_dir.name}.building")
+    shutil.rmtree(building_dir, ignore_errors=True)
+    building_dir.mkdir(parents=True)
+
+    buckets, current, entries, total = [], None, [], 0
+
+    def write_bucket():
+        (building_dir / f"{current}.json").write_text(json.dumps(entries, separators=(",", ":")))
+        buckets.append(current)
+
+    messages = (
+        ChatMessage.objects.filter(streaming=streaming)
+        .order_by("timestamp", "id")
+        .values_list("timestamp", "user__username", "content")
+    )
+    for timestamp, username, content in messages.iterator(chunk_size=2000):
+        # Messages sent before the recorder started are shown at its start
+        offset = max(0.0, (timestamp - origin).total_seconds())
+        bucket = int(offset // bucket_seconds)
+        if bucket != current:
+            if entries:
+                write_bucket()
+            current, entries = bucket, []
+        entries.append({"t": round(offset, 1), "username": username, "message": content})
+        total += 1
+    if entries:
+        write_bucket()
+
+    index = {
+        "bucket_seconds": bucket_seconds,
+        "buckets": buckets,
+        "messages": total,
+        "origin": origin.isoformat(),
+    }
+    (building_dir / INDEX_NAME).write_text(json.dumps(index))
+    # Readers never see a half written replay
+    shutil.rmtree(output_dir, ignore_errors=True)
+    building_dir.rename(output_dir)
+    return index
@@ -26,6 +26,71 @@ document.addEventListener('DOMContentLoaded', () => {
     const messageInput = document.getElementById('chat-message-input');
     const messageSubmit = document.getElementById('chat-message-submit');
 
+    // Chat history: the page shows the latest messages, older pages are
+    // fetched from the history API with the cursor of the oldest one shown
+    const historyURL = container.getAttribute("data-history-url");
+    let historyCursor = container.getAttribute("data-history-cursor") || null;
+    const loadOlderButton = document.createElement('button');
+    loadOlderButton.className = 'btn btn-link btn-sm w-100 d-none';
+    loadOlderButton.textContent = 'Load older messages';
+    chatBox.prepend(loadOlderButton);
+
+    function renderMessage(data) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('chat-message');
+        const author = document.createElement('strong');
+        author.textContent = data.username;
+        messageElement.append(author, `: ${data.message}`);
+        return messageElement;
+    }
+
+    function updateLoadOlderButton() {
+        loadOlderButton.classList.toggle('d-none', !historyCursor);
+    }
+
+    async function loadHistory(before) {
+        const params = new URLSearchParams();
+        if (before) {
+            params.set('before', before);
+        }
+        const response = await fetch(`${historyURL}?${params}`);
+        if (!response.ok) {
+            console.error("[ERROR] No se pudo cargar el historial del chat:", response.status);
+            return;
+        }
+        const page = await response.json();
+        historyCursor = page.next;
+        updateLoadOlderButton();
+        return page.messages;
+    }
+
+    loadOlderButton.addEventListener('click', async () => {
+        loadOlderButton.disabled = true;
+        const messages = await loadHistory(historyCursor);
+        loadOlderButton.disabled = false;
+        if (!messages) {
+            return;
+        }
+        // Keep the messages being read in place while older ones are inserted above
+        const previousHeight = chatBox.scrollHeight;
+        loadOlderButton.after(...messages.map(renderMessage));
+        chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+    });
+
+    if (historyURL) {
+        if (chatBox.querySelector('.chat-message')) {
+            // Rendered by the server (chat room page)
+            updateLoadOlderButton();
+        } else {
+            loadHistory().then((messages) => {
+                if (messages) {
+                    loadOlderButton.after(...messages.map(renderMessage));
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                }
+            });
+        }
+    }
+
     // WebSocket conection
     const chatSocket = new WebSocket(`ws://${window.location.host}/ws/chat/${streamId}/`);
 
@@ -48,10 +113,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
     chatSocket.onmessage = (e) => {
         const data = JSON.parse(e.data);
-        const messageElement = document.createElement('div');
-        messageElement.classList.add('chat-message');
-        messageElement.innerHTML = `<strong>${data.username}</strong>: ${data.message}`;
-        chatBox.appendChild(messageElement);
+        chatBox.appendChild(renderMessage(data));
         chatBox.scrollTop = chatBox.scrollHeight;
     };
 
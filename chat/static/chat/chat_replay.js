@@ -0,0 +1,79 @@
+// Chat replay of a recorded stream: shows the messages sent up to the
+// current playback position, reading only the buckets around it
+document.addEventListener('DOMContentLoaded', async () => {
+    const replay = document.getElementById('chat-replay');
+    const replayLog = document.getElementById('chat-replay-log');
+    const video = document.getElementById('recordedVideo');
+    if (!replay || !video) {
+        return;
+    }
+
+    // Messages kept on screen, from the current and the previous bucket
+    const MAX_VISIBLE = 100;
+    const indexURL = replay.getAttribute('data-index-url');
+    const buckets = new Map();
+    let index = null;
+    let renderedKey = null;
+
+    try {
+        const response = await fetch(indexURL);
+        if (!response.ok) {
+            throw new Error(response.status);
+        }
+        index = await response.json();
+    } catch (error) {
+        console.error("[ERROR] No se pudo cargar el índice del chat:", error);
+        return;
+    }
+    const available = new Set(index.buckets);
+
+    // Each bucket is fetched once, empty buckets are not requested at all
+    function loadBucket(bucket) {
+        if (!available.has(bucket)) {
+            return Promise.resolve([]);
+        }
+        if (!buckets.has(bucket)) {
+            const url = indexURL.replace(/index\.json$/, `${bucket}.json`);
+            buckets.set(bucket, fetch(url)
+                .then((response) => (response.ok ? response.json() : []))
+                .catch(() => []));
+        }
+        return buckets.get(bucket);
+    }
+
+    function renderMessage(data) {
+        const messageElement = document.createElement('div');
+        messageElement.classList.add('chat-message');
+        const author = document.createElement('strong');
+        author.textContent = data.username;
+        messageElement.append(author, `: ${data.message}`);
+        return messageElement;
+    }
+
+    async function update() {
+        const time = video.currentTime;
+        const bucket = Math.floor(time / index.bucket_seconds);
+        const [previous, current] = await Promise.all([
+            loadBucket(bucket - 1),
+            loadBucket(bucket),
+        ]);
+        // Ready before playback gets there
+        loadBucket(bucket + 1);
+
+        const shown = previous.concat(current)
+            .filter((message) => message.t <= time);
+        // The whole count, the sliced one stops changing at MAX_VISIBLE
+        const key = `${bucket}:${shown.length}`;
+        if (key === renderedKey) {
+            return;
+        }
+        renderedKey = key;
+        const visible = shown.slice(-MAX_VISIBLE);
+        replayLog.replaceChildren(...visible.map(renderMessage));
+        replayLog.scrollTop = replayLog.scrollHeight;
+    }
+
+    video.addEventListener('timeupdate', update);
+    video.addEventListener('seeked', update);
+    update();
+});
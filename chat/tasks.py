@@ -0,0 +1,19 @@
+from celery import shared_task
+from streamings.models import Streaming
+from chat.replay import build_replay
+
+
+@shared_task
+def build_chat_replay(stream_id):
+    """Precomputes the chat replay buckets of a finished stream."""
+    try:
+        streaming = Streaming.objects.get(id=stream_id)
+    except Streaming.DoesNotExist:
+        print(f"[ERROR] Stream ID={stream_id} not found, no chat replay built.")
+        return
+    index = build_replay(streaming)
+    print(
+        f"[INFO] Chat replay of stream {stream_id}: {index['messages']} messages "
+        f"in {len(index['buckets'])} buckets."
+    )
+    return {"stream_id": stream_id, "messages": index["messages"], "buckets": len(index["buckets"])}
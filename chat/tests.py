@@ -1,3 +1,200 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from streamings.models import StreamChunk, Streaming
+from users.models import CustomUser
+from .buffer import ChatMessageBuffer
+from .history import message_history
+from .models import ChatMessage
+from .replay import bucket_path, build_replay
 
-# Create your tests here.
+
+class ChatBufferTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username="viewer", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.user, is_live=True
+        )
+
+    def setUp(self):
+        self.journal_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.journal_dir)
+
+    def buffer(self):
+        buffer = ChatMessageBuffer(
+            max_size=100, flush_interval=1, max_pending=1000, journal_dir=self.journal_dir
+        )
+        self.addCleanup(buffer.close_journal)
+        return buffer
+
+    def message(self, content):
+        return ChatMessage(streaming=self.stream, user=self.user, content=content)
+
+    def buffered(self, *contents):
+        buffer = self.buffer()
+        messages = [self.message(content) for content in contents]
+        buffer.pending.extend(messages)
+        buffer.write_journal(messages)
+        return buffer
+
+    def kill(self, buffer):
+        # What the OS does for a killed process: the files stay, the lock goes
+        buffer.journal.close()
+        buffer.journal_lock.close()
+        buffer.journal = buffer.journal_lock = None
+
+    def test_journal_of_a_killed_process_is_recovered(self):
+        self.kill(self.buffered("first", "second"))
+
+        self.assertEqual(self.buffer().recover(), 2)
+        self.assertEqual(
+            list(ChatMessage.objects.values_list("content", flat=True).order_by("id")),
+            ["first", "second"],
+        )
+        self.assertEqual(list(self.journal_dir.iterdir()), [])
+
+    def test_messages_saved_before_the_kill_are_not_recovered_twice(self):
+        buffer = self.buffered("saved", "unsaved")
+        buffer.pending[0].save()
+        self.kill(buffer)
+
+        self.assertEqual(self.buffer().recover(), 1)
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+    def test_journal_of_a_running_process_is_left_alone(self):
+        self.buffered("pending")
+
+        self.assertEqual(self.buffer().recover(), 0)
+        self.assertFalse(ChatMessage.objects.exists())
+
+    def test_flush_cuts_the_journal_back(self):
+        buffer = self.buffered("first")
+
+        async_to_sync(buffer.flush)()
+
+        self.assertTrue(ChatMessage.objects.filter(content="first").exists())
+        self.assertEqual(Path(buffer.journal.name).read_text(), "")
+
+    def test_drain_saves_pending_messages_and_removes_the_journal(self):
+        buffer = self.buffered("last")
+
+        buffer.drain()
+
+        self.assertTrue(ChatMessage.objects.filter(content="last").exists())
+        self.assertEqual(list(self.journal_dir.iterdir()), [])
+
+
+@override_settings(CHAT_HISTORY_PAGE_SIZE=2)
+class ChatHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username="viewer", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.user, is_live=True
+        )
+        start = timezone.now()
+        # The last three share a timestamp, as messages written in one batch can
+        cls.messages = ChatMessage.objects.bulk_create(
+            ChatMessage(
+                streaming=cls.stream, user=cls.user, content=f"message {index}",
+                timestamp=start + timedelta(seconds=min(index, 2)),
+            )
+            for index in range(5)
+        )
+
+    def history(self, **params):
+        return self.client.get(reverse("chat_history", args=[self.stream.id]), params)
+
+    def test_pages_walk_back_without_gaps_or_repeats(self):
+        contents, cursor = [], None
+        while True:
+            page = self.history(**({"before": cursor} if cursor else {})).json()
+            contents = [message["message"] for message in page["messages"]] + contents
+            cursor = page["next"]
+            if cursor is None:
+                break
+
+        self.assertEqual(contents, [f"message {index}" for index in range(5)])
+
+    def test_latest_page_is_in_chronological_order(self):
+        page, cursor = message_history(self.stream.id)
+
+        self.assertEqual([message.content for message in page], ["message 3", "message 4"])
+        self.assertIsNotNone(cursor)
+
+    def test_invalid_cursor_and_limit_are_rejected(self):
+        self.assertEqual(self.history(before="not-a-cursor").status_code, 400)
+        self.assertEqual(self.history(limit="many").status_code, 400)
+
+    def test_chat_room_renders_only_the_latest_page(self):
+        response = self.client.get(reverse("chat_room", args=[self.stream.id]))
+
+        self.assertContains(response, "message 4")
+        self.assertNotContains(response, "message 2")
+        self.assertTrue(response.context["history_cursor"])
+
+
+@override_settings(CHAT_REPLAY_BUCKET_SECONDS=10, VIDEO_CHUNK_DURATION=4)
+class ChatReplayTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username="viewer", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Ended", host=cls.user, has_ended=True
+        )
+        # The first chunk arrives one chunk duration after recording started
+        cls.origin = timezone.now()
+        StreamChunk.objects.create(
+            streaming=cls.stream, index=0, size=1, sha256="0" * 64,
+            received_at=cls.origin + timedelta(seconds=4),
+        )
+        ChatMessage.objects.bulk_create(
+            ChatMessage(
+                streaming=cls.stream, user=cls.user, content=f"at {offset}",
+                timestamp=cls.origin + timedelta(seconds=offset),
+            )
+            for offset in (-5, 3, 12, 12.5, 45)
+        )
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings_override = override_settings(MEDIA_ROOT=Path(self.temp_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_messages_are_bucketed_by_playback_position(self):
+        index = build_replay(self.stream)
+
+        self.assertEqual(index["buckets"], [0, 1, 4])
+        self.assertEqual(index["messages"], 5)
+        first = json.loads(bucket_path(self.stream.id, 0).read_text())
+        # Sent before the recording started, shown at its start
+        self.assertEqual([(m["t"], m["message"]) for m in first], [(0.0, "at -5"), (3.0, "at 3")])
+        second = json.loads(bucket_path(self.stream.id, 1).read_text())
+        self.assertEqual([m["t"] for m in second], [12.0, 12.5])
+
+    def get_json(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(b"".join(response.streaming_content))
+
+    def test_replay_files_are_served(self):
+        build_replay(self.stream)
+        index_url = reverse("chat_replay_index", args=[self.stream.id])
+        self.assertEqual(self.client.get(index_url).status_code, 302)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.get_json(index_url)["buckets"], [0, 1, 4])
+        bucket = self.get_json(reverse("chat_replay_bucket", args=[self.stream.id, 4]))
+        self.assertEqual(bucket[0]["message"], "at 45")
+        self.assertEqual(
+            self.client.get(reverse("chat_replay_bucket", args=[self.stream.id, 2])).status_code, 404
+        )
@@ -3,4 +3,7 @@ from . import views
 
 urlpatterns = [
     path('room/<str:stream_id>/', views.chat_room, name='chat_room'),
+    path('history/<int:stream_id>/', views.chat_history, name='chat_history'),
+    path('replay/<int:stream_id>/index.json', views.chat_replay, name='chat_replay_index'),
+    path('replay/<int:stream_id>/<int:bucket>.json', views.chat_replay, name='chat_replay_bucket'),
 ]
\ No newline at end of file
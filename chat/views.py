@@ -1,13 +1,52 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from streamings.models import Streaming
-from .models import ChatMessage
+from streamings.responses import ranged_file_response
+from .history import InvalidCursor, message_history, serialize_message
+from .replay import INDEX_NAME, bucket_path, replay_dir
 
 def chat_room(request, stream_id):
     streaming = get_object_or_404(Streaming, id=stream_id, is_live=True)
 
-    chat_messages = ChatMessage.objects.filter(streaming=streaming).order_by('timestamp')
+    # Only the latest page, older messages are fetched from chat_history
+    chat_messages, history_cursor = message_history(streaming.id)
 
     return render(request, 'chat/chat_room.html', {
         'streaming': streaming,
         'chat_messages': chat_messages,
-    })
\ No newline at end of file
+        'history_cursor': history_cursor,
+    })
+
+# History API: ?before=<cursor> returns the page older than the cursor
+def chat_history(request, stream_id):
+    streaming = get_object_or_404(Streaming, id=stream_id)
+    try:
+        limit = int(request.GET.get('limit', settings.CHAT_HISTORY_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid limit.'}, status=400)
+    limit = max(1, min(limit, settings.CHAT_HISTORY_MAX_PAGE_SIZE))
+
+    try:
+        chat_messages, next_cursor = message_history(
+            streaming.id, before=request.GET.get('before'), limit=limit
+        )
+    except InvalidCursor as error:
+        return JsonResponse({'status': 'error', 'message': str(error)}, status=400)
+
+    return JsonResponse({
+        'messages': [serialize_message(message) for message in chat_messages],
+        'next': next_cursor,
+    })
+
+# Chat replay files of a recorded stream: the index, or the bucket of a
+# position. They only change if the replay is rebuilt, so the ETag is enough
+@login_required
+def chat_replay(request, stream_id, bucket=None):
+    path = replay_dir(stream_id) / INDEX_NAME if bucket is None else bucket_path(stream_id, bucket)
+    if not path.is_file():
+        raise Http404('Chat replay not available.')
+    response = ranged_file_response(request, path, 'application/json')
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -82,12 +83,53 @@ WSGI_APPLICATION = 'streaming_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite only takes one writer at a time, so chat and vote writes from every
+# consumer queue up behind each other. Set POSTGRES_DB (and the other
+# POSTGRES_* variables) to run on PostgreSQL; SQLite stays for development.
+POSTGRES_DB = os.environ.get("POSTGRES_DB")
+if POSTGRES_DB:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': POSTGRES_DB,
+            'USER': os.environ.get("POSTGRES_USER", "postgres"),
+            'PASSWORD': os.environ.get("POSTGRES_PASSWORD", ""),
+            'HOST': os.environ.get("POSTGRES_HOST", "localhost"),
+            'PORT': os.environ.get("POSTGRES_PORT", "5432"),
+            # Drop connections that died while idle instead of failing the request
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+    if os.environ.get("POSTGRES_POOL", "true") == "true":
+        # psycopg 3 connection pool (requires psycopg[pool]). ASGI and Celery
+        # threads borrow a connection per query batch instead of opening one
+        # each, and persistent connections must stay off when pooling.
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get("POSTGRES_POOL_MIN_SIZE", 2)),
+                'max_size': int(os.environ.get("POSTGRES_POOL_MAX_SIZE", 20)),
+                'timeout': 10,  # seconds waiting for a free connection
+            },
+        }
+    else:
+        # Keep each thread's connection open between requests
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get("POSTGRES_CONN_MAX_AGE", 60))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # WAL lets readers run while a write is in progress
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+                # Take the write lock when the transaction starts, so concurrent
+                # writers wait on the busy timeout instead of failing on upgrade
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,  # busy_timeout, in seconds
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -144,15 +186,108 @@ LOGIN_REDIRECT_URL = '/streamings/'
 LOGOUT_REDIRECT_URL = '/users/login/'
 ASGI_APPLICATION = 'streaming_project.asgi.application'
 CORS_ALLOW_ALL_ORIGINS = True
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-    },
-}
-
+# Channel layer
+# The in-memory layer only delivers group messages inside one process. Set
+# CHANNEL_REDIS_HOSTS (comma separated redis:// URLs) to run several ASGI
+# workers; channels_redis shards channels and groups across those hosts.
+CHANNEL_REDIS_HOSTS = [
+    host.strip() for host in os.environ.get("CHANNEL_REDIS_HOSTS", "").split(",") if host.strip()
+]
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                'hosts': CHANNEL_REDIS_HOSTS,
+                'prefix': 'streaming',
+                # Messages waiting in a single channel before new ones are dropped
+                'capacity': 1000,
+                # Consumer channels receive every chat, signaling and survey
+                # group message, so they get a tighter bound than the default
+                'channel_capacity': {
+                    'specific.*': 300,
+                    'http.request': 200,
+                },
+                # Undelivered messages are useless for live chat/votes after a few seconds
+                'expiry': 10,
+                # Sockets that died without disconnecting leave their groups after 1 hour
+                'group_expiry': 3600,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
 
-import os
-from pathlib import Path
+# WebRTC media path
+# "mesh": the host's browser sends its media to every viewer itself.
+# "relay": the host publishes once to a relay in the ASGI process (aiortc,
+# streamings/relay.py) that forwards the tracks to the viewers.
+# The relay lives in the process of the host's socket; viewers connected to
+# other processes reach it through the channel layer, so with more than one
+# ASGI process CHANNEL_REDIS_HOSTS is required. If that process restarts, the
+# relay is gone until the host reloads its page.
+STREAMING_RELAY_MODE = os.environ.get("STREAMING_RELAY_MODE", "mesh")
+# Each track is encoded once for all viewers (about 30% of a core at 640x480),
+# a viewer only adds packetizing and encryption (a few % each, see bench_relay).
+# Viewers past this limit watch the live HLS
+STREAMING_RELAY_MAX_VIEWERS = int(os.environ.get("STREAMING_RELAY_MAX_VIEWERS", 50))
+
+# Cache
+# Local memory by default. Set CACHE_REDIS_URL so every worker shares the live
+# stream directory and the survey counters.
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+# Safety net for changes that bypass the model signals (e.g. queryset.update())
+LIVE_STREAMS_CACHE_TIMEOUT = 60  # seconds
+
+# Chat messages are persisted in batches by chat.buffer.ChatMessageBuffer
+CHAT_BUFFER_SIZE = 100  # flush once this many messages are pending
+CHAT_BUFFER_FLUSH_INTERVAL = 1.0  # seconds
+CHAT_BUFFER_MAX_PENDING = 10000  # oldest messages are dropped beyond this
+# Unsaved messages are journaled here, so a killed process does not lose them
+CHAT_BUFFER_JOURNAL_DIR = Path(os.environ.get("CHAT_BUFFER_JOURNAL_DIR", BASE_DIR / "chat_journal"))
+CHAT_BUFFER_LOG_FLUSHES = False  # print a [DEBUG] line for every flush
+# Chat history pages, see chat.history
+CHAT_HISTORY_PAGE_SIZE = 50  # messages rendered with the page and per "load older"
+CHAT_HISTORY_MAX_PAGE_SIZE = 200  # upper bound for ?limit= on the history API
+# Chat replay of recorded streams, see chat.replay
+CHAT_REPLAY_BUCKET_SECONDS = 10  # seconds of playback per replay file
+# Seconds after finalize before the replay is built, so the buffer has flushed
+CHAT_REPLAY_DELAY = 10
+
+# Survey vote counters live in the cache, see surveys.tally
+SURVEY_TALLY_TIMEOUT = 60 * 60 * 24  # seconds
+# Seconds without votes before the counters are rebuilt from the Vote table,
+# so every pending vote write has landed
+SURVEY_RECONCILE_DELAY = 5
+# A stream without an active survey is re-checked after this many seconds
+SURVEY_NO_ACTIVE_TIMEOUT = 5
+# The connected viewer count used to pick the tick expires this long after
+# the last join, like the channel layer's group_expiry
+SURVEY_AUDIENCE_TIMEOUT = 60 * 60  # seconds
+# Result frames are coalesced per survey: (minimum audience, seconds per tick)
+SURVEY_BROADCAST_TICKS = [
+    (0, 0.1),
+    (100, 0.25),
+    (1000, 0.5),
+    (10000, 1.0),
+]
 
 MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_URL = "/media/"
@@ -166,6 +301,95 @@ MEDIA_TEMP_STREAMS.mkdir(parents=True, exist_ok=True)
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
+# FFmpeg jobs go to their own "media" queue so a burst of recordings cannot
+# starve votes and cleanups. Run one worker per queue:
+#   celery -A streaming_project worker -Q media
+#   celery -A streaming_project worker -Q default
+# (a single development worker can take both with -Q default,media)
+CELERY_TASK_DEFAULT_QUEUE = "default"
+CELERY_TASK_ROUTES = {
+    "streamings.tasks.process_video": {"queue": "media"},
+    "streamings.tasks.package_stream": {"queue": "media"},
+    "streamings.tasks.package_live_segment": {"queue": "media"},
+    "streamings.tasks.repair_stream_chunk": {"queue": "media"},
+}
+# Each worker process reserves one task at a time. Media tasks run for minutes
+# to hours and are acknowledged late, so prefetched ones would wait behind
+# the running one instead of going to an idle worker
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+# Limits for the short tasks, media tasks set their own (see streamings.tasks)
+CELERY_TASK_SOFT_TIME_LIMIT = 60  # seconds
+CELERY_TASK_TIME_LIMIT = 90  # seconds
+# Redis emulates priorities with one list per step, 0 is served first
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "queue_order_strategy": "priority",
+    "priority_steps": list(range(10)),
+    # acks_late tasks are redelivered if not acknowledged within this time,
+    # so it has to be longer than the slowest task (VIDEO_PROCESSING_MAX_TIME)
+    "visibility_timeout": 12 * 60 * 60,
+}
+
+# Number of FFmpeg processes used to repair the chunks of a single recording
+VIDEO_PROCESSING_WORKERS = int(os.environ.get("VIDEO_PROCESSING_WORKERS", os.cpu_count() or 1))
+
+# Adaptive bitrate ladder used to package recordings as DASH
+VIDEO_RENDITIONS = [
+    {"name": "240p", "height": 240, "bitrate": "400k"},
+    {"name": "480p", "height": 480, "bitrate": "1000k"},
+    {"name": "720p", "height": 720, "bitrate": "2500k"},
+]
+VIDEO_SEGMENT_DURATION = 4  # seconds
+
+# Third party players, loaded from a CDN at a pinned version. The integrity
+# values are the Subresource Integrity hashes of those exact files, print them
+# with `python manage.py player_script_integrity` when changing a version.
+# `check --deploy` fails while a hash is missing (streamings.E002)
+PLAYER_SCRIPTS = {
+    "dashjs": {
+        "url": "https://cdn.jsdelivr.net/npm/dashjs@4.7.4/dist/dash.all.min.js",
+        "integrity": os.environ.get("DASHJS_INTEGRITY", ""),
+    },
+    # Loaded by the live viewer only when it falls back to HLS
+    "hlsjs": {
+        "url": "https://cdn.jsdelivr.net/npm/hls.js@1.5.17/dist/hls.min.js",
+        "integrity": os.environ.get("HLSJS_INTEGRITY", ""),
+    },
+}
+
+# Uploaded recording chunks, see streamings.uploads
+VIDEO_CHUNK_DURATION = 4  # seconds, CHUNK_INTERVAL_MS in stream_recorder.js
+VIDEO_CHUNK_MAX_SIZE = 50 * 1024 * 1024  # bytes
+VIDEO_CHUNK_MAX_INDEX = 100_000  # over 4 days of 4 s chunks
+# "off" leaves flushing to the OS, "chunk" fsyncs every chunk before it becomes
+# visible, "full" also fsyncs the directory so the rename survives a crash
+VIDEO_CHUNK_FSYNC = os.environ.get("VIDEO_CHUNK_FSYNC", "chunk")
+# process_video retries with backoff (1, 2, 4... s) while announced chunks are missing
+VIDEO_FINALIZE_RETRIES = 6
+# Chunks uploaded this long after an assembly still trigger a new one
+VIDEO_LATE_CHUNK_WINDOW = 10 * 60  # seconds
+# Cleanup waits this long between tries while an assembly holds the lock
+VIDEO_CLEANUP_RETRY_DELAY = 60  # seconds
+# process_video time limit: a base plus a realtime re-encode of every chunk
+# and its share of the per-chunk fallback, up to a cap (2 h of recording
+# get about 3 h)
+VIDEO_PROCESSING_BASE_TIME = 10 * 60  # seconds
+VIDEO_PROCESSING_TIME_PER_CHUNK = 6  # seconds
+# package_stream encodes every chunk once per DASH rendition (realtime VP9)
+VIDEO_PACKAGING_TIME_PER_CHUNK = 12  # seconds
+VIDEO_PROCESSING_MAX_TIME = 10 * 60 * 60  # seconds
+# Media task priority grows by one step every this many chunks (5 minutes),
+# so short recordings are assembled before long ones
+VIDEO_PRIORITY_STEP_CHUNKS = 75
+
+# Live HLS for viewers that cannot use WebRTC, see streamings.hls. Every
+# chunk is encoded once more while the stream is live
+LIVE_HLS_ENABLED = os.environ.get("LIVE_HLS_ENABLED", "true") == "true"
+LIVE_HLS_PLAYLIST_SIZE = 6  # segments in the rolling playlist
+# Later segments waiting before a missing chunk is skipped
+LIVE_HLS_GAP_SEGMENTS = 2
+# Retries of a segment whose playlist stayed locked, one second apart
+LIVE_HLS_PUBLISH_RETRIES = 5
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -197,6 +421,11 @@ LOGGING = {
             "level": "DEBUG",
             "propagate": True,
         },
+        "surveys": {
+            "handlers": ["console"],
+            "level": "INFO",
+            "propagate": True,
+        },
     },
 }
 
@@ -1,6 +1,11 @@
 from django.contrib import admin
-from .models import Streaming
+from .models import StreamChunk, Streaming
 
 @admin.register(Streaming)
 class StreamingAdmin(admin.ModelAdmin):
     list_display = ('id', 'title', 'description', 'host', 'is_live', 'has_ended', 'video_file', 'recorded_date')
+
+@admin.register(StreamChunk)
+class StreamChunkAdmin(admin.ModelAdmin):
+    list_display = ('streaming', 'index', 'size', 'sha256', 'received_at')
+    list_filter = ('streaming',)
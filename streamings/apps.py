@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.core import checks
 
 
 class StreamingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'streamings'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .checks import check_player_script_integrity, check_player_scripts
+        from .relay import load_aiortc, relay_enabled
+
+        if relay_enabled():
+            # Fail on startup rather than on the first host connection
+            load_aiortc()
+        checks.register(check_player_scripts, checks.Tags.security)
+        checks.register(check_player_script_integrity, checks.Tags.security, deploy=True)
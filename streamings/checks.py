@@ -0,0 +1,41 @@
+import re
+from django.conf import settings
+from django.core import checks
+
+# "@1.5.17/" in a CDN URL; "@1", "@1.5" or "@latest" follow new releases
+EXACT_VERSION = re.compile(r"@\d+\.\d+\.\d+(/|$)")
+
+
+def check_player_scripts(app_configs=None, **kwargs):
+    """Third party player scripts must be pinned and carry an integrity hash."""
+    errors = []
+    for name, script in settings.PLAYER_SCRIPTS.items():
+        if not EXACT_VERSION.search(script["url"]):
+            errors.append(checks.Error(
+                f"PLAYER_SCRIPTS['{name}'] does not pin a version: {script['url']}",
+                id="streamings.E001",
+            ))
+        if not script.get("integrity"):
+            errors.append(checks.Warning(
+                f"PLAYER_SCRIPTS['{name}'] has no integrity hash, the browser will "
+                "run whatever the CDN serves.",
+                hint="Run `python manage.py player_script_integrity` and copy the hash.",
+                id="streamings.W001",
+            ))
+    return errors
+
+
+def check_player_script_integrity(app_configs=None, **kwargs):
+    """`check --deploy` fails while a player script has no integrity hash."""
+    return [
+        checks.Error(
+            f"PLAYER_SCRIPTS['{name}'] has no integrity hash.",
+            hint=(
+                "Run `python manage.py player_script_integrity` and set the hash in "
+                "settings or in the script's *_INTEGRITY environment variable."
+            ),
+            id="streamings.E002",
+        )
+        for name, script in settings.PLAYER_SCRIPTS.items()
+        if not script.get("integrity")
+    ]
@@ -1,52 +1,200 @@
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.core.cache import cache
+from .models import Streaming
+from .relay import RELAY_PEER_ID, RelayFull, close_relay, get_relay, relay_enabled, relays
+
+# Messages a viewer can send; they always go to the host
+VIEWER_SIGNALS = {"ready", "answer", "ice"}
+# Messages the host sends to one viewer, named by its peer id in "target"
+HOST_SIGNALS = {"offer", "ice"}
+
+
+def host_presence_key(stream_id):
+    """Channel name of the host connection of a stream, while it is connected."""
+    return f"stream_host:{stream_id}"
+
+
+def set_host_present(stream_id, channel_name):
+    cache.set(host_presence_key(stream_id), channel_name, None)
+
+
+def clear_host_present(stream_id, channel_name):
+    # A newer host connection (a reload) may have replaced this one already
+    if cache.get(host_presence_key(stream_id)) == channel_name:
+        cache.delete(host_presence_key(stream_id))
+
+
+def host_present(stream_id):
+    return cache.get(host_presence_key(stream_id)) is not None
+
 
 class StreamingConsumer(AsyncWebsocketConsumer):
+    """
+    WebRTC signaling between the host and each viewer. Every connection is
+    a peer identified by its channel name. Viewer messages are delivered to
+    the host group only and host messages to the one viewer they target, so
+    a join costs a constant number of frames instead of one per viewer.
+    In relay mode both sides negotiate with the stream's relay instead of
+    each other (see relay.py). The relay lives in the process of the host's
+    socket, so viewers signal it through the host group like in mesh mode
+    and the host's consumer answers them on its behalf.
+    """
+
     async def connect(self):
         self.stream_id = self.scope["url_route"]["kwargs"]["stream_id"]
         self.group_name = f"stream_{self.stream_id}"
+        self.host_group_name = f"stream_{self.stream_id}_host"
+
+        try:
+            streaming = await Streaming.objects.aget(id=self.stream_id)
+        except (Streaming.DoesNotExist, ValueError):
+            await self.close()
+            return
+        user = self.scope.get("user")
+        self.streaming_id = streaming.id
+        self.is_host = bool(user and user.is_authenticated and user.id == streaming.host_id)
+        # Viewers that announced themselves to this host connection
+        self.peers = set()
+        self.relay_mode = relay_enabled()
+        # Whether this host connection published the relay of its process
+        self.publishing = False
 
         # Add to WebSocket Group
         await self.channel_layer.group_add(self.group_name, self.channel_name)
+        if self.is_host:
+            await self.channel_layer.group_add(self.host_group_name, self.channel_name)
+            await database_sync_to_async(set_host_present)(self.streaming_id, self.channel_name)
         await self.accept()
+        # Viewers only give up on WebRTC when a live host does not answer them
+        await self.send(
+            text_data=json.dumps({
+                "type": "welcome",
+                "peer_id": self.channel_name,
+                "mode": "relay" if self.relay_mode else "mesh",
+                "live": streaming.is_live,
+                "host_present": await database_sync_to_async(host_present)(self.streaming_id),
+            })
+        )
+
+        if self.is_host:
+            # Viewers that were waiting announce themselves again
+            await self.channel_layer.group_send(self.group_name, {"type": "host_joined"})
 
     async def disconnect(self, close_code):
+        if not hasattr(self, "is_host"):
+            return
         # Remove from WebSocket group
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if self.relay_mode and self.publishing:
+            await close_relay(self.streaming_id)
+        if self.is_host:
+            await self.channel_layer.group_discard(self.host_group_name, self.channel_name)
+            await database_sync_to_async(clear_host_present)(self.streaming_id, self.channel_name)
+            await self.channel_layer.group_send(self.group_name, {"type": "host_left"})
+        else:
+            await self.channel_layer.group_send(
+                self.host_group_name,
+                {
+                    "type": "relay_signal" if self.relay_mode else "signal",
+                    "signal": "leave",
+                    "from": self.channel_name,
+                },
+            )
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_type = text_data_json.get("type", None)
+        data = text_data_json.get("data", None)
 
-        if message_type == "ready":
+        if self.relay_mode:
+            await self.receive_relay(message_type, data)
+        elif self.is_host:
+            if message_type in HOST_SIGNALS:
+                target = text_data_json.get("target")
+                if target not in self.peers:
+                    print(f"[WARNING] Signal for unknown peer {target} on stream {self.stream_id}.")
+                    return
+                await self.channel_layer.send(
+                    target,
+                    {"type": "signal", "signal": message_type, "from": self.channel_name, "data": data},
+                )
+            elif message_type == "screen_share_ended":
+                # Every viewer has to update its layout, this one is a broadcast
+                await self.channel_layer.group_send(self.group_name, {"type": "screen_share_ended"})
+        elif message_type in VIEWER_SIGNALS:
             await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "viewer_ready", "data": text_data_json.get("data", None)},
+                self.host_group_name,
+                {"type": "signal", "signal": message_type, "from": self.channel_name, "data": data},
             )
-        elif message_type == "offer":
-            await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "send_offer", "data": text_data_json.get("data", None)},
-            )
-        elif message_type == "answer":
-            await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "send_answer", "data": text_data_json.get("data", None)},
-            )
-        elif message_type == "ice":
+
+    async def receive_relay(self, message_type, data):
+        # The descriptions carry their ICE candidates, "ice" messages are not needed
+        if self.is_host:
+            if message_type == "offer":
+                answer = await get_relay(self.streaming_id).publish(data)
+                self.publishing = True
+                await self.send_signal("answer", RELAY_PEER_ID, answer)
+                # The relay's tracks changed, viewers subscribe again
+                await self.channel_layer.group_send(self.group_name, {"type": "host_joined"})
+            elif message_type == "screen_share_ended":
+                await self.channel_layer.group_send(self.group_name, {"type": "screen_share_ended"})
+        elif message_type in {"ready", "answer"}:
+            # To the host's consumer, in the process that holds the relay
             await self.channel_layer.group_send(
-                self.group_name,
-                {"type": "send_ice_candidate", "data": text_data_json.get("data", None)},
+                self.host_group_name,
+                {"type": "relay_signal", "signal": message_type, "from": self.channel_name, "data": data},
             )
 
-    async def viewer_ready(self, event):
-        await self.send(text_data=json.dumps({"type": "ready", "data": event["data"]}))
+    async def relay_signal(self, event):
+        """A viewer's signal for the relay, handled by the host connection that published it."""
+        if not self.publishing or self.streaming_id not in relays:
+            # The host has not published yet, viewers wait for host_joined
+            return
+        relay = relays[self.streaming_id]
+        viewer = event["from"]
+        if event["signal"] == "ready":
+            try:
+                offer = await relay.subscribe(viewer)
+            except RelayFull:
+                print(f"[INFO] Relay of stream {self.stream_id} is full, viewer sent to HLS.")
+                await self.channel_layer.send(viewer, {"type": "relay_full"})
+                return
+            if offer is not None:
+                await self.channel_layer.send(
+                    viewer, {"type": "signal", "signal": "offer", "from": RELAY_PEER_ID, "data": offer}
+                )
+        elif event["signal"] == "answer":
+            await relay.answer(viewer, event.get("data"))
+        elif event["signal"] == "leave":
+            await relay.unsubscribe(viewer)
+
+    async def relay_full(self, event):
+        await self.send(text_data=json.dumps({"type": "relay_full"}))
+
+    async def send_signal(self, signal, sender, data):
+        await self.send(text_data=json.dumps({"type": signal, "from": sender, "data": data}))
+
+    async def signal(self, event):
+        if self.is_host:
+            # Only peers that announced themselves can be addressed
+            if event["signal"] == "ready":
+                self.peers.add(event["from"])
+            elif event["signal"] == "leave":
+                self.peers.discard(event["from"])
+            elif event["from"] not in self.peers:
+                return
+        await self.send_signal(event["signal"], event["from"], event.get("data"))
 
-    async def send_offer(self, event):
-        await self.send(text_data=json.dumps({"type": "offer", "data": event["data"]}))
+    async def host_joined(self, event):
+        if not self.is_host:
+            await self.send(text_data=json.dumps({"type": "host_joined"}))
 
-    async def send_answer(self, event):
-        await self.send(text_data=json.dumps({"type": "answer", "data": event["data"]}))
+    async def host_left(self, event):
+        if not self.is_host:
+            await self.send(text_data=json.dumps({"type": "host_left"}))
 
-    async def send_ice_candidate(self, event):
-        await self.send(text_data=json.dumps({"type": "ice", "data": event["data"]}))
+    async def screen_share_ended(self, event):
+        if not self.is_host:
+            await self.send(text_data=json.dumps({"type": "screen_share_ended"}))
@@ -0,0 +1,151 @@
+"""
+Live HLS for viewers that cannot use WebRTC.
+
+Every chunk uploaded while a stream is live is converted into an MPEG-TS
+segment on the media queue (tasks.package_live_segment) and published to a
+rolling playlist. Segments never change once written, so a CDN can cache
+them for good; only the playlist is refreshed. Chunks are packaged in
+parallel and may finish out of order, so the playlist only grows with
+consecutive segments. A missing chunk is skipped (with a discontinuity)
+once LIVE_HLS_GAP_SEGMENTS later segments are waiting behind it.
+"""
+import fcntl
+import json
+import math
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from .media import hls_dir
+
+PLAYLIST_NAME = "live.m3u8"
+# Seconds a task waits for another one to finish updating the playlist
+PLAYLIST_LOCK_WAIT = 10
+
+
+def playlist_lock_path(stream_id):
+    return hls_dir(stream_id) / "playlist.lock"
+
+
+def playlist_path(stream_id):
+    return hls_dir(stream_id) / PLAYLIST_NAME
+
+
+def state_path(stream_id):
+    return hls_dir(stream_id) / "segments.json"
+
+
+def load_state(stream_id):
+    """
+    Published segments in playlist order, packaged segments waiting for an
+    earlier one ({index: duration}) and whether the stream has ended.
+    """
+    path = state_path(stream_id)
+    if path.exists():
+        state = json.loads(path.read_text())
+        state["ready"] = {int(index): duration for index, duration in state["ready"].items()}
+        return state
+    return {"published": [], "ready": {}, "ended": False}
+
+
+def write_atomic(path, text):
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=path.parent)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(partial, path)
+
+
+@contextmanager
+def playlist_lock(stream_id):
+    """
+    Serializes the playlist updates of a stream across every worker process.
+    A file lock next to the playlist, since the segments are shared through
+    that directory anyway and the cache may be local to each process. The
+    kernel releases it if the worker dies.
+    """
+    deadline = time.monotonic() + PLAYLIST_LOCK_WAIT
+    with open(playlist_lock_path(stream_id), "a") as lock_file:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"The live playlist of stream {stream_id} is locked.")
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def advance(state, flush=False):
+    """
+    Moves ready segments to the published list in index order. With `flush`
+    (the stream ended) every hole is skipped, since no more chunks will come.
+    """
+    published, ready = state["published"], state["ready"]
+    next_index = published[-1]["index"] + 1 if published else 0
+    while ready:
+        discontinuity = False
+        if next_index not in ready:
+            later = sorted(index for index in ready if index > next_index)
+            if not later or (not flush and len(later) < settings.LIVE_HLS_GAP_SEGMENTS):
+                break
+            next_index = later[0]
+            discontinuity = bool(published)
+        published.append({
+            "index": next_index,
+            "duration": ready.pop(next_index),
+            "discontinuity": discontinuity,
+        })
+        next_index += 1
+    # Segments behind a skipped hole arrived too late for the live playlist
+    state["ready"] = {index: duration for index, duration in ready.items() if index >= next_index}
+
+
+def render_playlist(state, size=None):
+    if size is None:
+        size = settings.LIVE_HLS_PLAYLIST_SIZE
+    published = state["published"]
+    first = max(0, len(published) - size)
+    segments = published[first:]
+    target = max(
+        [settings.VIDEO_CHUNK_DURATION] + [math.ceil(segment["duration"]) for segment in segments]
+    )
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{target}",
+        f"#EXT-X-MEDIA-SEQUENCE:{first}",
+        f"#EXT-X-DISCONTINUITY-SEQUENCE:{sum(1 for s in published[:first] if s['discontinuity'])}",
+    ]
+    for segment in segments:
+        if segment["discontinuity"]:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXTINF:{segment['duration']:.3f},")
+        lines.append(f"segment_{segment['index']}.ts")
+    if state["ended"]:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def publish_segment(stream_id, chunk_index=None, duration=None, ended=False):
+    """
+    Records a packaged segment and rewrites the playlist. With `ended` the
+    remaining segments are published and the playlist is closed; segments
+    packaged after that are left out.
+    """
+    hls_dir(stream_id).mkdir(parents=True, exist_ok=True)
+    with playlist_lock(stream_id):
+        state = load_state(stream_id)
+        if state["ended"]:
+            return state
+        if chunk_index is not None:
+            state["ready"][chunk_index] = duration
+        advance(state, flush=ended)
+        state["ended"] = ended
+        write_atomic(state_path(stream_id), json.dumps(state))
+        write_atomic(playlist_path(stream_id), render_playlist(state))
+        return state
@@ -0,0 +1,62 @@
+"""
+Cached directory of the streams that are live right now. The set only
+changes when a stream goes live or ends, so it is rebuilt lazily after the
+signals in streamings/signals.py invalidate it.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from .models import Streaming
+
+LIVE_STREAMS_CACHE_KEY = "live_streams"
+# Only what the stream lists render is cached, never whole model instances:
+# those would put the hosts' password hashes and emails in a shared cache.
+# is_live and has_ended are read by the post_init signal.
+LIVE_STREAM_FIELDS = [
+    field.attname for field in Streaming._meta.concrete_fields
+    if field.attname in {"id", "title", "description", "start_time", "is_live", "has_ended", "host_id"}
+]
+
+
+def load_live_streams():
+    return list(
+        Streaming.objects.filter(is_live=True, has_ended=False)
+        .order_by("-start_time")
+        .values_list(*LIVE_STREAM_FIELDS, "host__username")
+    )
+
+
+def hydrate(row):
+    """Streaming with only the cached fields loaded and its host's id and username."""
+    *values, username = row
+    stream = Streaming.from_db(None, LIVE_STREAM_FIELDS, values)
+    host_model = Streaming._meta.get_field("host").related_model
+    stream.host = host_model.from_db(None, ["id", "username"], [stream.host_id, username])
+    return stream
+
+
+def get_live_streams():
+    """Live streams with their host, newest first."""
+    rows = cache.get(LIVE_STREAMS_CACHE_KEY)
+    if rows is None:
+        rows = load_live_streams()
+        cache.set(LIVE_STREAMS_CACHE_KEY, rows, settings.LIVE_STREAMS_CACHE_TIMEOUT)
+    return [hydrate(row) for row in rows]
+
+
+def get_live_streams_by_host():
+    """Newest live stream of every host that is streaming."""
+    by_host = {}
+    for stream in get_live_streams():
+        by_host.setdefault(stream.host_id, stream)
+    return by_host
+
+
+def get_following_live_streams(user, following_ids=None):
+    """Live streams of the users `user` follows, from the cached directory."""
+    if following_ids is None:
+        following_ids = set(user.following.values_list("id", flat=True))
+    return [stream for stream in get_live_streams() if stream.host_id in following_ids]
+
+
+def invalidate_live_streams():
+    cache.delete(LIVE_STREAMS_CACHE_KEY)
@@ -0,0 +1,112 @@
+import time
+from celery import Celery
+from celery.contrib.testing.worker import start_worker
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# The stand-ins are routed like these project tasks
+MEDIA_TASK = "streamings.tasks.process_video"
+FAST_TASK = "surveys.tasks.record_vote"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def make_app(waits, routed):
+    """
+    A Celery app on the in-memory broker with a slow media task and a fast one.
+    The in-memory broker and the task registry outlive the app, so every
+    scenario names its tasks on its own: otherwise the workers of a later
+    scenario run the tasks of the first one, which append to its `waits`.
+    """
+    prefix = f"bench.{'routed' if routed else 'shared'}"
+    app = Celery("bench_celery_queues", broker="memory://")
+    app.conf.broker_transport_options = {"polling_interval": 0.005}
+    app.conf.worker_hijack_root_logger = False
+    if routed:
+        app.conf.task_default_queue = settings.CELERY_TASK_DEFAULT_QUEUE
+        app.conf.task_routes = {
+            f"{prefix}.media": settings.CELERY_TASK_ROUTES.get(MEDIA_TASK, {}),
+            f"{prefix}.fast": settings.CELERY_TASK_ROUTES.get(FAST_TASK, {}),
+        }
+
+    @app.task(name=f"{prefix}.media", acks_late=routed)
+    def media(duration):
+        time.sleep(duration)
+
+    @app.task(name=f"{prefix}.fast")
+    def fast(sent_at):
+        waits.append(time.time() - sent_at)
+
+    return app, media, fast
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates a burst of long media jobs mixed with short tasks on the in-memory "
+        "broker, once with a single shared queue and once with the project's queue routing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--media-tasks", type=int, default=40, help="Long jobs in the burst.")
+        parser.add_argument("--media-duration", type=float, default=0.25, help="Seconds per long job.")
+        parser.add_argument("--fast-tasks", type=int, default=200, help="Short tasks sent during the burst.")
+        parser.add_argument("--fast-interval", type=float, default=0.01, help="Seconds between short tasks.")
+        parser.add_argument("--media-concurrency", type=int, default=4, help="Media worker threads.")
+        parser.add_argument("--default-concurrency", type=int, default=2, help="Default worker threads.")
+        parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the short tasks.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['media_tasks']} media jobs of {options['media_duration']}s, "
+            f"{options['fast_tasks']} short tasks"
+        )
+        self.stdout.write(
+            f"{'setup':<14} {'done':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'total s':>8}"
+        )
+        for label, routed in (("shared queue", False), ("split queues", True)):
+            self.run_scenario(label, routed, options)
+
+    def run_scenario(self, label, routed, options):
+        waits = []
+        app, media, fast = make_app(waits, routed)
+        if routed:
+            media_queue = settings.CELERY_TASK_ROUTES[MEDIA_TASK]["queue"]
+            default_queue = settings.CELERY_TASK_DEFAULT_QUEUE
+            media_worker = {
+                "queues": [media_queue],
+                "prefetch_multiplier": settings.CELERY_WORKER_PREFETCH_MULTIPLIER,
+            }
+            default_worker = {"queues": [default_queue]}
+        else:
+            # Same number of threads, but every worker takes from one queue
+            media_worker = default_worker = {"queues": [app.conf.task_default_queue]}
+
+        start = time.perf_counter()
+        with start_worker(
+            app, pool="threads", concurrency=options["media_concurrency"],
+            perform_ping_check=False, **media_worker,
+        ), start_worker(
+            app, pool="threads", concurrency=options["default_concurrency"],
+            perform_ping_check=False, **default_worker,
+        ):
+            for _ in range(options["media_tasks"]):
+                media.delay(options["media_duration"])
+            for _ in range(options["fast_tasks"]):
+                fast.delay(time.time())
+                time.sleep(options["fast_interval"])
+
+            deadline = time.perf_counter() + options["timeout"]
+            while len(waits) < options["fast_tasks"] and time.perf_counter() < deadline:
+                time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{label:<14} {len(waits):>4}/{options['fast_tasks']:<4} "
+            f"{percentile(waits, 50) * 1000:>9.1f} {percentile(waits, 95) * 1000:>9.1f} "
+            f"{max(waits, default=0) * 1000:>9.1f} {elapsed:>8.1f}"
+        )
@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import statistics
+import time
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+GROUP_NAME = "bench_fanout"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def receive_messages(layer, channel, messages, timeout):
+    latencies = []
+    for _ in range(messages):
+        try:
+            message = await asyncio.wait_for(layer.receive(channel), timeout)
+        except asyncio.TimeoutError:
+            break
+        latencies.append(time.time() - message["sent_at"])
+    return latencies
+
+
+async def run_worker(sockets, messages, timeout, ready, results):
+    # Each process builds its own layer, the same way an ASGI worker does
+    layer = get_channel_layer()
+    channels = [await layer.new_channel() for _ in range(sockets)]
+    for channel in channels:
+        await layer.group_add(GROUP_NAME, channel)
+    ready.release()
+
+    received = await asyncio.gather(
+        *(receive_messages(layer, channel, messages, timeout) for channel in channels)
+    )
+    for channel in channels:
+        await layer.group_discard(GROUP_NAME, channel)
+    results.put([latency for latencies in received for latency in latencies])
+
+
+def worker_main(sockets, messages, timeout, ready, results):
+    asyncio.run(run_worker(sockets, messages, timeout, ready, results))
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures group_send fan-out latency to many sockets spread over several "
+        "processes. Requires CHANNEL_REDIS_HOSTS to point at a local Redis."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Number of simulated ASGI workers.")
+        parser.add_argument("--sockets", type=int, default=10000, help="Total sockets across all workers.")
+        parser.add_argument("--messages", type=int, default=20, help="Group messages to send.")
+        parser.add_argument("--interval", type=float, default=0.1, help="Seconds between messages.")
+        parser.add_argument("--timeout", type=float, default=10.0, help="Receive timeout per message.")
+
+    def handle(self, *args, **options):
+        if not settings.CHANNEL_REDIS_HOSTS:
+            raise CommandError(
+                "The in-memory channel layer cannot deliver across processes. "
+                "Set CHANNEL_REDIS_HOSTS, e.g. CHANNEL_REDIS_HOSTS=redis://localhost:6379/1"
+            )
+
+        workers = options["workers"]
+        per_worker = max(1, options["sockets"] // workers)
+        messages = options["messages"]
+
+        context = multiprocessing.get_context("fork")
+        ready = context.Semaphore(0)
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=worker_main,
+                args=(per_worker, messages, options["timeout"], ready, results),
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.acquire()
+
+        self.stdout.write(
+            f"{workers} workers x {per_worker} sockets subscribed, sending {messages} messages..."
+        )
+        start = time.perf_counter()
+        asyncio.run(self.send_messages(messages, options["interval"]))
+
+        latencies = []
+        for _ in processes:
+            latencies.extend(results.get())
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        expected = per_worker * workers * messages
+        self.stdout.write(f"delivered={len(latencies)}/{expected} elapsed={elapsed:.2f}s")
+        if latencies:
+            self.stdout.write(
+                "latency ms: "
+                f"mean={statistics.mean(latencies) * 1000:.1f} "
+                f"p50={percentile(latencies, 50) * 1000:.1f} "
+                f"p95={percentile(latencies, 95) * 1000:.1f} "
+                f"p99={percentile(latencies, 99) * 1000:.1f} "
+                f"max={max(latencies) * 1000:.1f}"
+            )
+
+    async def send_messages(self, messages, interval):
+        layer = get_channel_layer()
+        for _ in range(messages):
+            await layer.group_send(GROUP_NAME, {"type": "bench.message", "sent_at": time.time()})
+            await asyncio.sleep(interval)
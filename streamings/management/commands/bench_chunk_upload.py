@@ -0,0 +1,138 @@
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from streamings.models import Streaming
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates concurrent hosts uploading recording chunks and compares the raw "
+        "streaming endpoint with the multipart one (throughput, latency, peak memory)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hosts", type=int, default=20, help="Concurrent hosts uploading.")
+        parser.add_argument("--chunks", type=int, default=15, help="Chunks uploaded per host.")
+        parser.add_argument(
+            "--chunk-size", type=int, default=2 * 1024 * 1024,
+            help="Bytes per chunk (a 4 s VP9 chunk is roughly 1-3 MB).",
+        )
+
+    def handle(self, *args, **options):
+        # SQL debug logging would dominate the timings
+        logging.getLogger("django.db.backends").setLevel(logging.WARNING)
+        temp_dir = tempfile.TemporaryDirectory()
+        if connection.vendor == "sqlite":
+            # Threads sharing the in-memory test database fail on table locks
+            # instead of waiting, a file database honours the busy timeout
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(temp_dir.name, "bench.sqlite3")
+
+        # Run against a throwaway test database and media directory
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with override_settings(MEDIA_TEMP_STREAMS=Path(temp_dir.name)), \
+                    mock.patch("streamings.views.repair_stream_chunk.apply_async"), \
+                    mock.patch("streamings.views.package_live_segment.apply_async"):
+                streams = self.populate(options["hosts"])
+                chunk = os.urandom(options["chunk_size"])
+                self.stdout.write(
+                    f"{options['hosts']} hosts x {options['chunks']} chunks of "
+                    f"{options['chunk_size'] / 1024 / 1024:.1f} MB"
+                )
+                self.stdout.write(
+                    f"{'endpoint':<10} {'MB/s':>8} {'p50 ms':>9} {'p95 ms':>9} "
+                    f"{'peak MB':>9} {'errors':>7}"
+                )
+                for label, upload in (("multipart", self.upload_multipart), ("raw", self.upload_raw)):
+                    self.run_mode(label, upload, streams, chunk, options["chunks"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            temp_dir.cleanup()
+
+    def populate(self, hosts):
+        streams = []
+        for index in range(hosts):
+            host = User.objects.create_user(username=f"bench_host_{index}", password="bench")
+            streams.append(
+                Streaming.objects.create(title="Bench", description="Bench", host=host, is_live=True)
+            )
+        return streams
+
+    def run_mode(self, label, upload, streams, chunk, chunks):
+        # The peak includes the request bodies built by the simulated hosts,
+        # so only the difference between endpoints is meaningful
+        tracemalloc.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(len(streams)) as executor:
+            results = list(executor.map(
+                lambda stream: self.run_host(upload, stream, chunk, chunks), streams
+            ))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        latencies = [latency for host_latencies, _ in results for latency in host_latencies]
+        errors = sum(host_errors for _, host_errors in results)
+        uploaded_mb = len(latencies) * len(chunk) / 1024 / 1024
+        self.stdout.write(
+            f"{label:<10} {uploaded_mb / elapsed:>8.1f} "
+            f"{statistics.median(latencies) if latencies else 0:>9.1f} "
+            f"{percentile(latencies, 95):>9.1f} {peak / 1024 / 1024:>9.1f} {errors:>7}"
+        )
+
+    def run_host(self, upload, stream, chunk, chunks):
+        client = Client()
+        client.force_login(stream.host)
+        latencies = []
+        errors = 0
+        try:
+            for index in range(chunks):
+                start = time.perf_counter()
+                response = upload(client, stream, index, chunk)
+                if response.status_code != 200:
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+        return latencies, errors
+
+    def upload_multipart(self, client, stream, index, chunk):
+        return client.post(
+            reverse("upload_chunk", args=[stream.id]),
+            {
+                "chunk_index": index,
+                "video_chunk": SimpleUploadedFile("blob", chunk, "video/webm"),
+            },
+        )
+
+    def upload_raw(self, client, stream, index, chunk):
+        return client.put(
+            reverse("receive_chunk", args=[stream.id, index]),
+            chunk,
+            content_type="application/octet-stream",
+        )
@@ -0,0 +1,125 @@
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from chat.models import ChatMessage
+from streamings.models import Streaming
+from surveys.models import Option, Survey
+from surveys.tasks import record_vote
+
+User = get_user_model()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures concurrent chat inserts and vote writes against the configured "
+        "database. Run it once on SQLite and once with POSTGRES_DB set to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16, help="Concurrent writers.")
+        parser.add_argument("--operations", type=int, default=200, help="Writes per thread.")
+        parser.add_argument(
+            "--batch", type=int, default=1,
+            help="Chat messages per insert (1 = one row per message, like an unbuffered consumer).",
+        )
+        parser.add_argument("--voters", type=int, default=1000, help="Distinct users casting votes.")
+
+    def handle(self, *args, **options):
+        # SQL debug logging would dominate the timings
+        logging.getLogger("django.db.backends").setLevel(logging.WARNING)
+        temp_dir = None
+        if connection.vendor == "sqlite":
+            # The default in-memory test database never hits the file lock,
+            # which is exactly what this benchmark has to measure
+            temp_dir = tempfile.TemporaryDirectory()
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(temp_dir.name, "bench.sqlite3")
+
+        # Run against a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            streaming, users, option_ids, survey_id = self.populate(options["voters"])
+            self.stdout.write(
+                f"{connection.vendor}: {options['threads']} threads x {options['operations']} writes"
+            )
+            self.stdout.write(
+                f"{'workload':<10} {'ops/sec':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+            )
+            batch = options["batch"]
+            self.report("chat", options, lambda: ChatMessage.objects.bulk_create(
+                ChatMessage(streaming=streaming, user=random.choice(users), content="bench")
+                for _ in range(batch)
+            ))
+            self.report("votes", options, lambda: record_vote(
+                survey_id, random.choice(users).id, random.choice(option_ids)
+            ))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if temp_dir:
+                temp_dir.cleanup()
+
+    def populate(self, voters):
+        users = User.objects.bulk_create(
+            User(username=f"bench_{index}", password="!") for index in range(voters)
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            users = list(User.objects.filter(username__startswith="bench_"))
+        streaming = Streaming.objects.create(
+            title="Bench", description="Bench", host=users[0], is_live=True
+        )
+        survey = Survey.objects.create(stream=streaming, question="Bench?", created_by=users[0])
+        option_ids = [
+            Option.objects.create(survey=survey, text=f"Option {index}").id for index in range(4)
+        ]
+        return streaming, users, option_ids, survey.id
+
+    def report(self, label, options, write):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options["threads"]) as executor:
+            results = list(executor.map(
+                lambda _: self.run_writer(write, options["operations"]),
+                range(options["threads"]),
+            ))
+        elapsed = time.perf_counter() - start
+
+        latencies = [latency for thread_latencies, _ in results for latency in thread_latencies]
+        errors = sum(thread_errors for _, thread_errors in results)
+        self.stdout.write(
+            f"{label:<10} {len(latencies) / elapsed:>10,.0f} "
+            f"{statistics.median(latencies) if latencies else 0:>9.1f} "
+            f"{percentile(latencies, 95):>9.1f} {percentile(latencies, 99):>9.1f} {errors:>7}"
+        )
+
+    def run_writer(self, write, operations):
+        latencies = []
+        errors = 0
+        try:
+            for _ in range(operations):
+                start = time.perf_counter()
+                try:
+                    write()
+                except OperationalError:
+                    # "database is locked" once the busy timeout runs out
+                    errors += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            # Every thread opened its own connection (or borrowed one from the pool)
+            connection.close()
+        return latencies, errors
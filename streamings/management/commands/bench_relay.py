@@ -0,0 +1,162 @@
+import asyncio
+import multiprocessing
+import time
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from streamings.relay import StreamRelay, description_dict, load_aiortc
+
+
+def pattern_frames(width, height):
+    """Blocks of gradient twice the frame height, read through a moving window."""
+    return bytes(
+        ((x // 8) * 7 + (y // 8) * 13) & 255 for y in range(height * 2) for x in range(width)
+    )
+
+
+async def count_frames(track, counter):
+    from aiortc.mediastreams import MediaStreamError
+
+    try:
+        while True:
+            await track.recv()
+            counter[0] += 1
+    except MediaStreamError:
+        pass
+
+
+async def run_peers(conn, viewers, width, height):
+    """The host and the viewers, in another process so their CPU is not measured."""
+    import av
+    from aiortc import RTCPeerConnection, RTCSessionDescription, VideoStreamTrack
+
+    class PatternTrack(VideoStreamTrack):
+        def __init__(self):
+            super().__init__()
+            self.pattern = pattern_frames(width, height)
+            self.row = 0
+
+        async def recv(self):
+            pts, time_base = await self.next_timestamp()
+            frame = av.VideoFrame(width, height, "yuv420p")
+            start = self.row * width
+            frame.planes[0].update(self.pattern[start:start + width * height])
+            for plane in frame.planes[1:]:
+                plane.update(bytes([128]) * plane.buffer_size)
+            frame.pts = pts
+            frame.time_base = time_base
+            self.row = (self.row + 4) % height
+            return frame
+
+    loop = asyncio.get_running_loop()
+
+    def receive():
+        return loop.run_in_executor(None, conn.recv)
+
+    publisher = RTCPeerConnection()
+    publisher.addTrack(PatternTrack())
+    await publisher.setLocalDescription(await publisher.createOffer())
+    conn.send(description_dict(publisher.localDescription))
+    await publisher.setRemoteDescription(RTCSessionDescription(**await receive()))
+
+    connections, counters, readers = [publisher], [], []
+    for _ in range(viewers):
+        connection = RTCPeerConnection()
+        counter = [0]
+
+        @connection.on("track")
+        def on_track(track, counter=counter):
+            readers.append(asyncio.ensure_future(count_frames(track, counter)))
+
+        await connection.setRemoteDescription(RTCSessionDescription(**await receive()))
+        await connection.setLocalDescription(await connection.createAnswer())
+        conn.send(description_dict(connection.localDescription))
+        connections.append(connection)
+        counters.append(counter)
+
+    await receive()  # measurement starts
+    for counter in counters:
+        counter[0] = 0
+    await receive()  # measurement ends
+    conn.send([counter[0] for counter in counters])
+
+    for reader in readers:
+        reader.cancel()
+    for connection in connections:
+        await connection.close()
+
+
+def peers_process(conn, viewers, width, height):
+    asyncio.run(run_peers(conn, viewers, width, height))
+
+
+class Command(BaseCommand):
+    help = (
+        "Publishes a synthetic camera track to a StreamRelay and subscribes N viewers, "
+        "all over local aiortc connections, and reports the relay's CPU per viewer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--viewers", type=int, nargs="+", default=[0, 1, 5, 10, 20],
+            help="Viewer counts to measure (0 is the cost of receiving the host alone).",
+        )
+        parser.add_argument("--width", type=int, default=640)
+        parser.add_argument("--height", type=int, default=480)
+        parser.add_argument("--warmup", type=float, default=3.0, help="Seconds before measuring.")
+        parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured.")
+
+    def handle(self, *args, **options):
+        try:
+            load_aiortc()
+        except ImproperlyConfigured as error:
+            raise CommandError(str(error))
+
+        self.stdout.write(
+            f"{options['width']}x{options['height']}, {options['duration']}s per run"
+        )
+        self.stdout.write(f"{'viewers':>8} {'relay CPU %':>12} {'CPU %/viewer':>13} {'fps/viewer':>11}")
+        baseline = None
+        for viewers in options["viewers"]:
+            # Measures past the configured limit too
+            with override_settings(STREAMING_RELAY_MAX_VIEWERS=max(viewers, 1)):
+                cpu, fps = asyncio.run(self.measure(viewers, options))
+            if viewers == 0:
+                baseline = cpu
+            per_viewer = (cpu - (baseline or 0)) / viewers if viewers else 0
+            self.stdout.write(f"{viewers:>8} {cpu:>12.1f} {per_viewer:>13.1f} {fps:>11.1f}")
+
+    async def measure(self, viewers, options):
+        context = multiprocessing.get_context("spawn")
+        conn, child_conn = context.Pipe()
+        process = context.Process(
+            target=peers_process,
+            args=(child_conn, viewers, options["width"], options["height"]),
+        )
+        process.start()
+        loop = asyncio.get_running_loop()
+
+        def receive():
+            return loop.run_in_executor(None, conn.recv)
+
+        relay = StreamRelay("bench")
+        try:
+            conn.send(await relay.publish(await receive()))
+            for index in range(viewers):
+                conn.send(await relay.subscribe(index))
+                await relay.answer(index, await receive())
+            await asyncio.sleep(options["warmup"])
+
+            conn.send("start")
+            cpu, wall = time.process_time(), time.perf_counter()
+            await asyncio.sleep(options["duration"])
+            cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+            conn.send("stop")
+            frames = await receive()
+        finally:
+            await relay.close()
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        fps = sum(frames) / len(frames) / wall if frames else 0
+        return cpu / wall * 100, fps
@@ -0,0 +1,74 @@
+import logging
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from users.models import CustomUser
+from streamings.search import search_users
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "to", "ne", "su", "vi", "do", "pe", "ja", "ri", "zu", "ba"]
+
+
+def random_username(index):
+    name = "".join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4)))
+    return f"{name}_{index}"
+
+
+class Command(BaseCommand):
+    help = "Compares the indexed user search against icontains on a large synthetic user table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1_000_000, help="Number of synthetic users.")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per query.")
+        parser.add_argument(
+            "--queries", nargs="+", default=["ka", "mira", "tone", "zuba", "lo_12"],
+            help="Search terms to time.",
+        )
+
+    def handle(self, *args, **options):
+        # SQL debug logging would dominate the timings
+        logging.getLogger("django.db.backends").setLevel(logging.WARNING)
+        # Run against a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            self.populate(options["users"])
+            self.stdout.write(f"{'query':<8} {'icontains ms':>14} {'indexed ms':>12} {'results':>9}")
+            for query in options["queries"]:
+                scan = self.time_page(
+                    lambda: CustomUser.objects.filter(username__icontains=query).order_by("username"),
+                    options["repeat"],
+                )
+                indexed = self.time_page(lambda: search_users(query), options["repeat"])
+                self.stdout.write(
+                    f"{query:<8} {scan[0]:>14.1f} {indexed[0]:>12.1f} {indexed[1]:>9}"
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def populate(self, total, batch_size=10_000):
+        self.stdout.write(f"Creating {total:,} users ({connection.vendor})...")
+        random.seed(42)
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            CustomUser.objects.bulk_create(
+                CustomUser(username=random_username(index), password="!")
+                for index in range(offset, min(offset + batch_size, total))
+            )
+        self.stdout.write(f"Created in {time.perf_counter() - start:.1f}s")
+
+    def time_page(self, make_queryset, repeat):
+        """Times what stream_list does: a count and the first page."""
+        timings = []
+        count = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            page = Paginator(make_queryset(), 20).get_page(1)
+            list(page)
+            count = page.paginator.count
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), count
@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import time
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import re_path
+from streamings.consumers import StreamingConsumer
+from streamings.models import Streaming
+
+User = get_user_model()
+
+
+class BroadcastConsumer(AsyncWebsocketConsumer):
+    """Reproduces the previous behaviour: every signal is sent to the whole stream group."""
+
+    async def connect(self):
+        self.group_name = f"stream_{self.scope['url_route']['kwargs']['stream_id']}"
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        message = json.loads(text_data)
+        await self.channel_layer.group_send(
+            self.group_name, {"type": "broadcast", "signal": message["type"], "data": message.get("data")}
+        )
+
+    async def broadcast(self, event):
+        await self.send(text_data=json.dumps({"type": event["signal"], "data": event["data"]}))
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates a viewer joining a stream that already has N viewers and counts the "
+        "WebSocket frames the signaling exchange produces, broadcast vs targeted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--viewers", type=int, nargs="+", default=[100, 1000],
+            help="Viewers already connected when the new one joins.",
+        )
+        parser.add_argument("--candidates", type=int, default=4, help="ICE candidates sent by each side.")
+
+    def handle(self, *args, **options):
+        # SQL debug logging would dominate the timings
+        logging.getLogger("django.db.backends").setLevel(logging.WARNING)
+        # Run against a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        # The in-memory layer drops messages past its capacity, the broadcast run needs room
+        layers = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": 100_000}}}
+        try:
+            host = User.objects.create_user(username="bench_host", password="bench")
+            streaming = Streaming.objects.create(
+                title="Bench", description="Bench", host=host, is_live=True
+            )
+            self.stdout.write(f"{'consumer':<10} {'viewers':>8} {'frames':>8} {'to others':>10} {'ms':>8}")
+            with override_settings(CHANNEL_LAYERS=layers):
+                for viewers in options["viewers"]:
+                    for label, consumer in (("broadcast", BroadcastConsumer), ("targeted", StreamingConsumer)):
+                        frames, to_others, elapsed = asyncio.run(
+                            self.run(consumer, host, streaming, viewers, options["candidates"])
+                        )
+                        self.stdout.write(
+                            f"{label:<10} {viewers:>8} {frames:>8} {to_others:>10} {elapsed * 1000:>8.1f}"
+                        )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    async def open(self, application, streaming, user=None):
+        communicator = WebsocketCommunicator(application, f"/ws/stream/{streaming.id}/")
+        if user is not None:
+            communicator.scope["user"] = user
+        await communicator.connect()
+        return communicator
+
+    async def receive_type(self, communicator, message_type):
+        while True:
+            message = await communicator.receive_json_from(timeout=10)
+            self.frames_read += 1
+            if message["type"] == message_type:
+                return message
+
+    async def run(self, consumer, host, streaming, viewers, candidates):
+        application = URLRouter([re_path(r"ws/stream/(?P<stream_id>\d+)/$", consumer.as_asgi())])
+        host_socket = await self.open(application, streaming, host)
+        audience = [await self.open(application, streaming) for _ in range(viewers)]
+        everyone = [host_socket] + audience
+        await self.settle(everyone)
+        for communicator in everyone:
+            self.drain(communicator)
+
+        # ready -> offer -> answer and the ICE candidates of both sides
+        self.frames_read = 0
+        start = time.perf_counter()
+        joining = await self.open(application, streaming)
+        await joining.send_json_to({"type": "ready"})
+        ready = await self.receive_type(host_socket, "ready")
+        target = {"target": ready["from"]} if "from" in ready else {}
+        await host_socket.send_json_to({"type": "offer", "data": {"sdp": "offer"}, **target})
+        for index in range(candidates):
+            await host_socket.send_json_to({"type": "ice", "data": {"candidate": index}, **target})
+        await self.receive_type(joining, "offer")
+        await joining.send_json_to({"type": "answer", "data": {"sdp": "answer"}})
+        for index in range(candidates):
+            await joining.send_json_to({"type": "ice", "data": {"candidate": index}})
+        await self.receive_type(host_socket, "answer")
+        await self.settle(everyone + [joining])
+        elapsed = time.perf_counter() - start
+
+        # Frames already read by receive_type are counted back in
+        queued = sum(communicator.output_queue.qsize() for communicator in everyone + [joining])
+        to_others = sum(communicator.output_queue.qsize() for communicator in audience)
+        total = queued + self.frames_read
+        for communicator in everyone + [joining]:
+            await communicator.disconnect()
+        return total, to_others, elapsed
+
+    async def settle(self, communicators):
+        # Wait until no more frames are being delivered for a few polls in a row
+        previous, stable = -1, 0
+        while stable < 5:
+            await asyncio.sleep(0.05)
+            queued = sum(communicator.output_queue.qsize() for communicator in communicators)
+            stable = stable + 1 if queued == previous else 0
+            previous = queued
+
+    def drain(self, communicator):
+        while not communicator.output_queue.empty():
+            communicator.output_queue.get_nowait()
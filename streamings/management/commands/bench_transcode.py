@@ -0,0 +1,61 @@
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from streamings.media import repair_chunks
+
+
+class Command(BaseCommand):
+    help = "Times chunk repair with 1 worker against N workers on a synthetic chunk set."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=16, help="Number of synthetic chunks.")
+        parser.add_argument("--duration", type=int, default=5, help="Length of each chunk in seconds.")
+        parser.add_argument(
+            "--workers", type=int, nargs="+", default=[1, 4, 8],
+            help="Worker counts to compare.",
+        )
+
+    def handle(self, *args, **options):
+        if shutil.which("ffmpeg") is None:
+            raise CommandError("ffmpeg was not found in PATH.")
+
+        work_dir = Path(tempfile.mkdtemp(prefix="bench_transcode_"))
+        try:
+            chunks = self.make_chunks(work_dir, options["chunks"], options["duration"])
+            baseline = None
+            for workers in options["workers"]:
+                for fixed in work_dir.glob("fixed_*"):
+                    fixed.unlink()
+
+                start = time.perf_counter()
+                repaired = repair_chunks(chunks, workers=workers)
+                elapsed = time.perf_counter() - start
+
+                failed = sum(1 for fixed, mode in repaired if fixed is None)
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f"workers={workers:<3} chunks={len(chunks)} failed={failed} "
+                    f"time={elapsed:.2f}s speedup={baseline / elapsed:.2f}x"
+                )
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def make_chunks(self, work_dir, count, duration):
+        self.stdout.write(f"Generating {count} synthetic chunks of {duration}s in {work_dir}...")
+        chunks = []
+        for index in range(count):
+            chunk = work_dir / f"chunk_{index}.webm"
+            subprocess.run(
+                [
+                    "ffmpeg", "-f", "lavfi", "-i", f"testsrc=size=1280x720:rate=30:duration={duration}",
+                    "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+                    "-c:v", "libvpx", "-deadline", "realtime", "-c:a", "libopus",
+                    "-y", str(chunk),
+                ],
+                capture_output=True, check=True,
+            )
+            chunks.append(chunk)
+        return chunks
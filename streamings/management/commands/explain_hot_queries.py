@@ -0,0 +1,58 @@
+import re
+from django.core.management.base import BaseCommand
+from django.db import connection
+from users.models import CustomUser
+from streamings.models import Streaming
+
+
+class Command(BaseCommand):
+    help = "Runs EXPLAIN on the hot Streaming queries and reports which indexes they use."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user-id", type=int, default=None,
+            help="User used for the following/profile queries (defaults to the first user).",
+        )
+        parser.add_argument("--verbose-plan", action="store_true", help="Print the full plans.")
+        parser.add_argument(
+            "--analyze", action="store_true",
+            help="Refresh planner statistics first, plans on unanalyzed tables are not representative.",
+        )
+
+    def handle(self, *args, **options):
+        if options["analyze"]:
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+
+        user_id = options["user_id"] or CustomUser.objects.values_list("id", flat=True).first() or 0
+        following = CustomUser.objects.filter(followers__id=user_id)
+        live = Streaming.objects.filter(is_live=True, has_ended=False)
+
+        hot_queries = {
+            "stream_list": live.order_by("-start_time"),
+            "following streams": live.filter(host__in=following).order_by("-start_time"),
+            "search active streams": live.filter(host_id__in=[user_id]).order_by("-start_time"),
+            "profile recent streams": Streaming.objects.filter(
+                host_id=user_id, is_live=False
+            ).order_by("-start_time")[:5],
+        }
+        index_names = {index.name for index in Streaming._meta.indexes}
+
+        for label, queryset in hot_queries.items():
+            plan = queryset.explain()
+            used = sorted(name for name in index_names if name in plan)
+            scans_table = self.scans_whole_table(plan)
+            status = "OK" if used and not scans_table else "CHECK"
+            self.stdout.write(
+                f"[{status}] {label}: indexes={', '.join(used) or 'none'}"
+                f"{' (full table scan)' if scans_table else ''}"
+            )
+            if options["verbose_plan"] or status == "CHECK":
+                self.stdout.write(f"    {plan}".replace("\n", "\n    "))
+
+    def scans_whole_table(self, plan):
+        if connection.vendor == "sqlite":
+            return re.search(r"SCAN streamings_streaming(?! USING)", plan) is not None
+        if connection.vendor == "postgresql":
+            return "Seq Scan on streamings_streaming" in plan
+        return False
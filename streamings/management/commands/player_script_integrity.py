@@ -0,0 +1,21 @@
+import base64
+import hashlib
+from urllib.request import urlopen
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Downloads the pinned PLAYER_SCRIPTS and prints their Subresource Integrity hashes."
+
+    def handle(self, *args, **options):
+        for name, script in settings.PLAYER_SCRIPTS.items():
+            try:
+                with urlopen(script["url"], timeout=30) as response:
+                    body = response.read()
+            except OSError as error:
+                raise CommandError(f"Could not download {script['url']}: {error}")
+            digest = base64.b64encode(hashlib.sha384(body).digest()).decode()
+            integrity = f"sha384-{digest}"
+            status = "matches" if script.get("integrity") == integrity else "differs from settings"
+            self.stdout.write(f'{name}: "{integrity}" ({status})')
@@ -0,0 +1,408 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+
+EBML_HEADER = b"\x1a\x45\xdf\xa3"
+CLUSTER_ID = b"\x1f\x43\xb6\x75"
+
+# Codecs that can be copied as-is. They match what the transcode path produces,
+# so copied and transcoded chunks can still be concatenated with "-c copy".
+COPY_VIDEO_CODECS = {"vp9"}
+COPY_AUDIO_CODECS = {"opus"}
+# Realtime VP9: the single pass assembly re-encodes a whole recording in one
+# process when it cannot be copied, so it has to keep up with the recording
+# length; row-mt spreads each frame over the cores
+TRANSCODE_ARGS = [
+    "-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "5", "-row-mt", "1",
+    "-b:v", "1M", "-c:a", "libopus",
+]
+
+# Live HLS segments are H.264/AAC, the codecs every HLS player can decode
+HLS_ARGS = [
+    "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency",
+    "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "128k", "-ac", "2",
+]
+
+# Packets read by probe_chunk to find the first video frame
+PROBE_PACKETS = 16
+
+CHUNK_NAME = re.compile(r"^chunk_(\d+)\.webm$")
+
+
+def dash_dir(stream_id):
+    return Path(settings.MEDIA_ROOT) / "recorded_streams" / str(stream_id) / "dash"
+
+
+def hls_dir(stream_id):
+    return Path(settings.MEDIA_ROOT) / "live_streams" / str(stream_id)
+
+
+def hls_segment_path(stream_id, chunk_index):
+    return hls_dir(stream_id) / f"segment_{chunk_index}.ts"
+
+
+def gap_map_path(stream_id):
+    return Path(settings.MEDIA_ROOT) / "recorded_streams" / str(stream_id) / "gaps.json"
+
+
+def chunk_index(path):
+    """Numeric index of a chunk_<n>.webm file, None for any other file."""
+    match = CHUNK_NAME.match(Path(path).name)
+    return int(match.group(1)) if match else None
+
+
+def fixed_chunk_path(chunk):
+    return chunk.parent / f"fixed_{chunk.name}"
+
+
+def init_segment(first_chunk):
+    """
+    Returns the WebM header (EBML, Segment info and Tracks) of the first chunk
+    of a recording, i.e. every byte before its first Cluster.
+    """
+    data = first_chunk.read_bytes()
+    cluster_start = data.find(CLUSTER_ID)
+    return data[:cluster_start] if cluster_start > 0 else None
+
+
+def chunk_input(chunk):
+    """
+    MediaRecorder only writes the WebM header in the first chunk, so later
+    chunks cannot be decoded on their own. For those, a temporary file with the
+    header of chunk_0 prepended is returned. The second value tells whether the
+    returned path is temporary and must be deleted by the caller.
+    """
+    with open(chunk, "rb") as f:
+        if f.read(4) == EBML_HEADER:
+            return chunk, False
+
+    first_chunk = chunk.parent / "chunk_0.webm"
+    header = init_segment(first_chunk) if first_chunk.exists() else None
+    if header is None:
+        return chunk, False
+
+    fd, path = tempfile.mkstemp(suffix=".webm", dir=chunk.parent)
+    with os.fdopen(fd, "wb") as f:
+        f.write(header)
+        f.write(chunk.read_bytes())
+    return path, True
+
+
+def probe_chunk(path):
+    """
+    Inspects the container, codecs and first packets of a chunk with ffprobe.
+    Returns the parsed ffprobe output, or None if the chunk cannot be read.
+    """
+    result = subprocess.run(
+        [
+            "ffprobe", "-v", "error",
+            "-show_entries",
+            "format=format_name,duration:stream=codec_type,codec_name,height:packet=codec_type,flags",
+            # Enough packets to reach the first video frame, not the whole chunk
+            "-read_intervals", f"%+#{PROBE_PACKETS}",
+            "-of", "json", str(path)
+        ],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        return None
+    try:
+        return json.loads(result.stdout)
+    except ValueError:
+        return None
+
+
+def can_stream_copy(probe):
+    """
+    Tells whether a probed chunk is a healthy WebM that can be remuxed without
+    re-encoding: VP9/Opus streams and a first video packet that is a keyframe.
+    The header duration is not checked, MediaRecorder never writes it.
+    """
+    if not probe:
+        return False
+
+    container = probe.get("format", {})
+    if "webm" not in container.get("format_name", "").split(","):
+        return False
+
+    streams = probe.get("streams", [])
+    video = [s.get("codec_name") for s in streams if s.get("codec_type") == "video"]
+    audio = [s.get("codec_name") for s in streams if s.get("codec_type") == "audio"]
+    if not video:
+        return False
+    if not (set(video) <= COPY_VIDEO_CODECS and set(audio) <= COPY_AUDIO_CODECS):
+        return False
+
+    # A stream that does not start on a keyframe cannot be decoded from its start
+    video_packets = [p for p in probe.get("packets", []) if p.get("codec_type") == "video"]
+    return bool(video_packets) and "K" in video_packets[0].get("flags", "")
+
+
+def run_ffmpeg(source, output, codec_args):
+    return subprocess.run(
+        ["ffmpeg", "-i", str(source), *codec_args, "-f", "webm", "-y", str(output)],
+        capture_output=True, text=True
+    )
+
+
+def repair_chunk(chunk):
+    """
+    Repairs a single chunk next to the original file. Chunks that are already
+    valid VP9/Opus WebM are remuxed with "-c copy"; anything else is re-encoded.
+    Returns a (path, mode) tuple where mode is "copy", "transcode" or "failed"
+    and path is None when the chunk could not be repaired.
+    """
+    fixed_chunk = fixed_chunk_path(chunk)
+    source, is_temporary = chunk_input(chunk)
+    # Write to a temporary name first so a chunk repaired twice at the same
+    # time (live task and final processing) never leaves a half-written file.
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=chunk.parent)
+    os.close(fd)
+    try:
+        if can_stream_copy(probe_chunk(source)):
+            print(f"[DEBUG] Remuxing fragment: {chunk}")
+            result = run_ffmpeg(source, partial, ["-c", "copy"])
+            if result.returncode == 0:
+                os.replace(partial, fixed_chunk)
+                return fixed_chunk, "copy"
+            print(f"[WARNING] Remux failed for {chunk}, falling back to transcoding.")
+
+        print(f"[DEBUG] Transcoding fragment: {chunk}")
+        result = run_ffmpeg(source, partial, TRANSCODE_ARGS)
+        if result.returncode != 0:
+            print(f"[ERROR] FFmpeg failed to process {chunk}: {result.stderr}")
+            return None, "failed"
+        os.replace(partial, fixed_chunk)
+        return fixed_chunk, "transcode"
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        if is_temporary:
+            os.unlink(source)
+
+
+def repair_chunks(chunks, workers=None):
+    """
+    Repairs the given chunks in parallel using a bounded worker pool.
+    Each FFmpeg call runs in its own process, so threads are enough to keep
+    every core busy. Results are (path, mode) tuples returned in the same
+    order as `chunks`, see repair_chunk. Chunks that were already repaired
+    while the stream was live are reused with the "cached" mode.
+    """
+    if workers is None:
+        workers = settings.VIDEO_PROCESSING_WORKERS
+    workers = max(1, min(workers, len(chunks) or 1))
+
+    def repair(chunk):
+        fixed_chunk = fixed_chunk_path(chunk)
+        if fixed_chunk.exists():
+            return fixed_chunk, "cached"
+        return repair_chunk(chunk)
+
+    if workers == 1:
+        return [repair(chunk) for chunk in chunks]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(repair, chunks))
+
+
+def gap_map(indexes, chunk_duration=None):
+    """
+    Timeline of the chunks missing up to the last received index, as a list
+    of {"chunks": [first, last], "start": s, "end": e} entries. Times are
+    seconds from the start of the recording. The single pass assembly keeps
+    the original timestamps, so they also match the assembled file.
+    """
+    if chunk_duration is None:
+        chunk_duration = settings.VIDEO_CHUNK_DURATION
+    gaps = []
+    indexes = [-1] + sorted(indexes)
+    for previous, current in zip(indexes, indexes[1:]):
+        if current - previous > 1:
+            gaps.append({
+                "chunks": [previous + 1, current - 1],
+                "start": (previous + 1) * chunk_duration,
+                "end": current * chunk_duration,
+            })
+    return gaps
+
+
+def assemble_chunks(chunks, output):
+    """
+    Joins the original chunks into `output` with a single FFmpeg process.
+    MediaRecorder chunks are consecutive pieces of one WebM stream, so they
+    are written back to back into FFmpeg's stdin and remuxed with "-c copy"
+    (or re-encoded once when the codecs cannot be copied). No per-chunk
+    intermediate files are needed. Returns "copy", "transcode" or "failed".
+    """
+    copy = can_stream_copy(probe_chunk(chunks[0]))
+    codec_args = ["-c", "copy"] if copy else TRANSCODE_ARGS
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=output.parent)
+    os.close(fd)
+    try:
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(
+                [
+                    "ffmpeg", "-loglevel", "error", "-f", "matroska", "-i", "pipe:0",
+                    *codec_args, "-f", "webm", "-y", partial,
+                ],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr,
+            )
+            try:
+                try:
+                    for chunk in chunks:
+                        with open(chunk, "rb") as chunk_file:
+                            shutil.copyfileobj(chunk_file, process.stdin, 1024 * 1024)
+                except BrokenPipeError:
+                    pass  # FFmpeg exited early, its return code tells why
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                returncode = process.wait()
+            except BaseException:
+                # e.g. the task's soft time limit, do not leave FFmpeg running
+                process.kill()
+                process.wait()
+                raise
+            if returncode != 0:
+                stderr.seek(0)
+                print(f"[ERROR] FFmpeg failed to assemble {len(chunks)} chunks: "
+                      f"{stderr.read().decode(errors='replace')}")
+                return "failed"
+        os.replace(partial, output)
+        return "copy" if copy else "transcode"
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+
+
+def concat_chunks(fixed_chunks, output, work_dir):
+    """Concatenates chunks that were repaired one by one. Returns True on success."""
+    if len(fixed_chunks) == 1:
+        shutil.copy(fixed_chunks[0], output)
+        return True
+
+    file_list_path = work_dir / "file_list.txt"
+    with open(file_list_path, "w") as file_list:
+        for chunk_file in fixed_chunks:
+            file_list.write(f"file '{Path(chunk_file).resolve()}'\n")
+    result = subprocess.run(
+        [
+            "ffmpeg", "-f", "concat", "-safe", "0",
+            "-i", str(file_list_path),
+            "-c", "copy", "-y", str(output)
+        ],
+        cwd=work_dir, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(f"[ERROR] FFmpeg execution failed: {result.stderr}")
+        return False
+    return True
+
+
+def chunk_progress(stream_temp_dir):
+    """Counts the chunks received and already repaired for a stream."""
+    if not stream_temp_dir.exists():
+        return {"received": 0, "repaired": 0}
+    chunks = list(stream_temp_dir.glob("chunk_*.webm"))
+    repaired = sum(1 for chunk in chunks if fixed_chunk_path(chunk).exists())
+    return {"received": len(chunks), "repaired": repaired}
+
+
+def package_dash(source, output_dir, renditions=None):
+    """
+    Packages a recording as segmented WebM DASH with one VP9 rendition per
+    entry of VIDEO_RENDITIONS (skipping those taller than the source) and a
+    single Opus audio track. Returns the path of the manifest, or None if
+    FFmpeg failed. The previous package is only replaced once the new one is
+    complete.
+    """
+    if renditions is None:
+        renditions = settings.VIDEO_RENDITIONS
+
+    probe = probe_chunk(source) or {}
+    streams = probe.get("streams", [])
+    heights = [s.get("height") or 0 for s in streams if s.get("codec_type") == "video"]
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    if not heights:
+        print(f"[ERROR] No video stream found in {source}.")
+        return None
+
+    source_height = max(heights)
+    ladder = [r for r in renditions if r["height"] <= source_height] or renditions[:1]
+
+    command = ["ffmpeg", "-i", str(source)]
+    for _ in ladder:
+        command += ["-map", "0:v:0"]
+    if has_audio:
+        command += ["-map", "0:a:0", "-c:a", "libopus", "-b:a", "96k"]
+    command += ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-row-mt", "1", "-g", "60"]
+    for index, rendition in enumerate(ladder):
+        command += [
+            f"-filter:v:{index}", f"scale=-2:{rendition['height']}",
+            f"-b:v:{index}", rendition["bitrate"],
+        ]
+    adaptation_sets = "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v"
+
+    building_dir = output_dir.with_name(f"{output_dir.name}.building")
+    shutil.rmtree(building_dir, ignore_errors=True)
+    building_dir.mkdir(parents=True)
+    command += [
+        "-f", "dash",
+        "-dash_segment_type", "webm",
+        "-seg_duration", str(settings.VIDEO_SEGMENT_DURATION),
+        "-adaptation_sets", adaptation_sets,
+        "-y", str(building_dir / "manifest.mpd"),
+    ]
+
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"[ERROR] FFmpeg failed to package {source}: {result.stderr}")
+        shutil.rmtree(building_dir, ignore_errors=True)
+        return None
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    building_dir.rename(output_dir)
+    return output_dir / "manifest.mpd"
+
+
+def package_hls_segment(chunk, output, start):
+    """
+    Converts one recording chunk into an MPEG-TS segment that starts `start`
+    seconds into the stream, so consecutive segments share one timeline.
+    Each segment is encoded on its own and carries its own codec headers.
+    Returns the segment duration in seconds, or None if FFmpeg failed.
+    """
+    source, is_temporary = chunk_input(chunk)
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=output.parent)
+    os.close(fd)
+    try:
+        result = subprocess.run(
+            [
+                "ffmpeg", "-loglevel", "error", "-i", str(source), *HLS_ARGS,
+                "-output_ts_offset", str(start), "-f", "mpegts", "-y", partial,
+            ],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print(f"[ERROR] FFmpeg failed to package {chunk} for HLS: {result.stderr}")
+            return None
+        probe = probe_chunk(partial) or {}
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+        if is_temporary:
+            os.unlink(source)
+    try:
+        return float(probe.get("format", {}).get("duration"))
+    except (TypeError, ValueError):
+        return float(settings.VIDEO_CHUNK_DURATION)
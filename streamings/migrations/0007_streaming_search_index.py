@@ -0,0 +1,77 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE streamings_streaming_fts USING fts5(
+        title, description, content='streamings_streaming', content_rowid='id', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER streamings_streaming_fts_insert AFTER INSERT ON streamings_streaming BEGIN
+        INSERT INTO streamings_streaming_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER streamings_streaming_fts_delete AFTER DELETE ON streamings_streaming BEGIN
+        INSERT INTO streamings_streaming_fts(streamings_streaming_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER streamings_streaming_fts_update
+    AFTER UPDATE OF title, description ON streamings_streaming BEGIN
+        INSERT INTO streamings_streaming_fts(streamings_streaming_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO streamings_streaming_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END
+    """,
+    "INSERT INTO streamings_streaming_fts(streamings_streaming_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS streamings_streaming_fts_insert",
+    "DROP TRIGGER IF EXISTS streamings_streaming_fts_delete",
+    "DROP TRIGGER IF EXISTS streamings_streaming_fts_update",
+    "DROP TABLE IF EXISTS streamings_streaming_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Same expression as STREAM_TSVECTOR in streamings/search.py
+    """
+    CREATE INDEX IF NOT EXISTS streamings_streaming_search_tsv
+    ON streamings_streaming USING gin ((
+        to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))
+    ))
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS streamings_streaming_search_tsv",
+]
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {"sqlite": sqlite, "postgresql": postgresql}.get(
+            schema_editor.connection.vendor, []
+        )
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamings', '0006_alter_streaming_video_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_BACKWARD, POSTGRES_BACKWARD),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamings', '0007_streaming_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='streaming',
+            index=models.Index(condition=models.Q(('has_ended', False), ('is_live', True)), fields=['-start_time'], name='streaming_live_now_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streaming',
+            index=models.Index(condition=models.Q(('has_ended', False), ('is_live', True)), fields=['host', '-start_time'], name='streaming_live_host_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='streaming',
+            index=models.Index(condition=models.Q(('is_live', False)), fields=['host', '-start_time'], name='streaming_host_recent_idx'),
+        ),
+    ]
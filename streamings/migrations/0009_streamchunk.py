@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamings', '0008_streaming_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('size', models.PositiveBigIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('received_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('streaming', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='streamings.streaming')),
+            ],
+            options={
+                'ordering': ['index'],
+                'constraints': [models.UniqueConstraint(fields=('streaming', 'index'), name='stream_chunk_unique_index')],
+            },
+        ),
+    ]
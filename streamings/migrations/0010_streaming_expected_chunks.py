@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streamings', '0009_streamchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='streaming',
+            name='expected_chunks',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class Streaming(models.Model):
     title = models.CharField(max_length=100)
@@ -10,7 +11,49 @@ class Streaming(models.Model):
     has_ended = models.BooleanField(default=False)
     video_file = models.FileField(upload_to="recorded_streams/", null=True, blank=True) # Campo BLOB
     recorded_date = models.DateTimeField(null=True, blank=True)
+    # Number of chunks the recorder produced, sent when the stream is finalized
+    expected_chunks = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Currently live streams, newest first (stream_list, following feed)
+            models.Index(
+                fields=["-start_time"],
+                condition=models.Q(is_live=True, has_ended=False),
+                name="streaming_live_now_idx",
+            ),
+            # Live stream of given hosts (following filter, user search)
+            models.Index(
+                fields=["host", "-start_time"],
+                condition=models.Q(is_live=True, has_ended=False),
+                name="streaming_live_host_idx",
+            ),
+            # Recent past streams of a host (profile_view)
+            models.Index(
+                fields=["host", "-start_time"],
+                condition=models.Q(is_live=False),
+                name="streaming_host_recent_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+
+
+class StreamChunk(models.Model):
+    """Manifest entry of a recording chunk received from the host."""
+    streaming = models.ForeignKey(Streaming, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    received_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["index"]
+        constraints = [
+            models.UniqueConstraint(fields=["streaming", "index"], name="stream_chunk_unique_index"),
+        ]
+
+    def __str__(self):
+        return f"{self.streaming_id}/chunk_{self.index}"
@@ -0,0 +1,149 @@
+"""
+Server side media relay, used when STREAMING_RELAY_MODE is "relay".
+
+In the default "mesh" mode the host's browser keeps one peer connection per
+viewer, so its uplink and CPU grow with the audience. In relay mode the host
+publishes its tracks once to a StreamRelay and every viewer negotiates with
+the relay instead. Built on aiortc, an optional dependency that is only
+imported when relay mode is enabled.
+
+aiortc does not trickle ICE: its candidates travel inside the SDP, and the
+browsers finish gathering before they send a description to the relay.
+aiortc decodes what it receives; each track is encoded again once and the
+packets are shared by every viewer (relay_media.py), so a viewer costs
+packetizing and encryption only (see bench_relay). A relay takes at most
+STREAMING_RELAY_MAX_VIEWERS viewers, the rest are sent to the live HLS.
+
+A relay lives in the memory of the ASGI process of the host's socket.
+Viewer sockets on any other process reach it through the channel layer:
+the consumer hands their signaling to the host's socket (see consumers.py).
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Peer ID the relay uses in signaling messages, in place of a channel name
+RELAY_PEER_ID = "relay"
+
+# StreamRelay of every stream being relayed by this process
+relays = {}
+
+
+def relay_enabled():
+    return settings.STREAMING_RELAY_MODE == "relay"
+
+
+def load_aiortc():
+    try:
+        import aiortc
+        from . import relay_media
+    except ImportError as error:
+        raise ImproperlyConfigured(
+            "STREAMING_RELAY_MODE is 'relay' but aiortc is not installed."
+        ) from error
+    return aiortc, relay_media
+
+
+class RelayFull(Exception):
+    """The relay already serves as many viewers as it can encode for."""
+
+
+def description_dict(description):
+    return {"type": description.type, "sdp": description.sdp}
+
+
+class StreamRelay:
+    """Receives the host's tracks once and forwards them, encoded once, to every viewer."""
+
+    def __init__(self, stream_id):
+        self.aiortc, self.media = load_aiortc()
+        self.stream_id = stream_id
+        self.publisher = None
+        # SharedEncoder of every track the host publishes
+        self.tracks = []
+        # Peer connection of every viewer, keyed by its peer ID
+        self.viewers = {}
+
+    async def publish(self, offer):
+        """
+        Accepts the host's offer and returns the relay's answer. A new offer
+        on the same connection (e.g. a screen share track) renegotiates it.
+        """
+        if self.publisher is None or self.publisher.connectionState == "closed":
+            self.stop_tracks()
+            self.publisher = self.aiortc.RTCPeerConnection()
+            self.publisher.on("track", self.add_track)
+        await self.publisher.setRemoteDescription(self.aiortc.RTCSessionDescription(**offer))
+        await self.publisher.setLocalDescription(await self.publisher.createAnswer())
+        return description_dict(self.publisher.localDescription)
+
+    def add_track(self, track):
+        print(f"[INFO] Relay of stream {self.stream_id} received a {track.kind} track.")
+        encoder = self.media.SharedEncoder(track)
+        self.tracks.append(encoder)
+
+        @track.on("ended")
+        def remove_track():
+            if encoder in self.tracks:
+                self.tracks.remove(encoder)
+                encoder.stop()
+
+    def stop_tracks(self):
+        for encoder in self.tracks:
+            encoder.stop()
+        self.tracks = []
+
+    async def subscribe(self, peer_id):
+        """
+        Creates the viewer's peer connection with every published track and
+        returns the relay's offer, or None while the host has not published.
+        Raises RelayFull when a new viewer would exceed the viewer limit.
+        """
+        if not self.tracks:
+            return None
+        if peer_id not in self.viewers and len(self.viewers) >= settings.STREAMING_RELAY_MAX_VIEWERS:
+            raise RelayFull(peer_id)
+        await self.unsubscribe(peer_id)
+        connection = self.aiortc.RTCPeerConnection()
+        self.viewers[peer_id] = connection
+        for encoder in self.tracks:
+            transceiver = connection.addTransceiver(encoder.subscribe(), direction="sendonly")
+            self.media.set_codec(transceiver)
+        await connection.setLocalDescription(await connection.createOffer())
+        return description_dict(connection.localDescription)
+
+    async def answer(self, peer_id, answer):
+        connection = self.viewers.get(peer_id)
+        if connection is None:
+            return False
+        await connection.setRemoteDescription(self.aiortc.RTCSessionDescription(**answer))
+        return True
+
+    async def unsubscribe(self, peer_id):
+        connection = self.viewers.pop(peer_id, None)
+        if connection is not None:
+            # Closing the connection leaves the tracks subscribed to the encoders
+            for sender in connection.getSenders():
+                if sender.track is not None:
+                    sender.track.stop()
+            await connection.close()
+
+    async def close(self):
+        for peer_id in list(self.viewers):
+            await self.unsubscribe(peer_id)
+        if self.publisher is not None:
+            await self.publisher.close()
+            self.publisher = None
+        self.stop_tracks()
+
+
+def get_relay(stream_id):
+    relay = relays.get(stream_id)
+    if relay is None:
+        relay = relays[stream_id] = StreamRelay(stream_id)
+    return relay
+
+
+async def close_relay(stream_id):
+    relay = relays.pop(stream_id, None)
+    if relay is not None:
+        await relay.close()
@@ -0,0 +1,191 @@
+"""
+Encodes each track the host publishes to a relay once, for every viewer.
+
+aiortc decodes what it receives, and an RTCRtpSender given decoded frames
+encodes them itself, once per viewer. Given encoded packets it only splits
+them into RTP payloads instead. SharedEncoder reads the decoded track of the
+host, encodes it once (VP8 video, Opus audio, the codecs aiortc can
+packetize) and hands the same packets to an EncodedTrack per viewer. A
+viewer then costs packetizing and encrypting, not an encode.
+
+The price is one bitrate for everyone: the senders cannot adapt the encode
+to one viewer's bandwidth, and keyframe requests of a viewer are answered by
+the next periodic keyframe (KEYFRAME_INTERVAL) instead of right away.
+"""
+import asyncio
+import fractions
+import multiprocessing
+import av
+from aiortc import MediaStreamTrack, RTCRtpSender
+from aiortc.mediastreams import MediaStreamError
+
+VIDEO_BITRATE = 1_000_000  # bits per second, aiortc's default for one viewer
+AUDIO_BITRATE = 96_000
+# Seconds between keyframes, the longest a new or lagging viewer waits for a picture
+KEYFRAME_INTERVAL = 2
+# Packets a viewer may fall behind before it skips to the next keyframe
+VIEWER_QUEUE_SIZE = 30
+
+AUDIO_RATE = 48000
+AUDIO_TIME_BASE = fractions.Fraction(1, AUDIO_RATE)
+# The codec every viewer connection negotiates, the one the packets are in
+CODECS = {"video": "video/VP8", "audio": "audio/opus"}
+
+
+def set_codec(transceiver):
+    """Limits a viewer's transceiver to the codec of the shared packets."""
+    kind = transceiver.kind
+    codecs = [
+        codec for codec in RTCRtpSender.getCapabilities(kind).codecs
+        if codec.mimeType.lower() == CODECS[kind].lower()
+    ]
+    transceiver.setCodecPreferences(codecs)
+
+
+class EncodedTrack(MediaStreamTrack):
+    """The packets of a SharedEncoder for one viewer."""
+
+    def __init__(self, encoder):
+        super().__init__()
+        self.kind = encoder.kind
+        self.encoder = encoder
+        self.queue = asyncio.Queue(VIEWER_QUEUE_SIZE)
+        # Video can only be decoded from a keyframe on
+        self.needs_keyframe = self.kind == "video"
+
+    def put(self, packet):
+        if packet is None:
+            # The host's track ended
+            if self.queue.full():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return
+        if self.needs_keyframe:
+            if not packet.is_keyframe:
+                return
+            self.needs_keyframe = False
+        if self.queue.full():
+            # A slow viewer skips ahead instead of queueing
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.kind == "video":
+                self.needs_keyframe = True
+                self.encoder.force_keyframe = True
+                return
+        self.queue.put_nowait(packet)
+
+    async def recv(self):
+        if self.readyState != "live":
+            raise MediaStreamError
+        packet = await self.queue.get()
+        if packet is None:
+            self.stop()
+            raise MediaStreamError
+        return packet
+
+    def stop(self):
+        super().stop()
+        self.encoder.unsubscribe(self)
+
+
+class SharedEncoder:
+    """Encodes one track of the host once and feeds every viewer's EncodedTrack."""
+
+    def __init__(self, track):
+        self.track = track
+        self.kind = track.kind
+        self.subscribers = set()
+        self.task = None
+        self.codec = None
+        self.resampler = None
+        self.force_keyframe = False
+        self.last_keyframe = None
+        self.first_pts = None
+
+    def subscribe(self):
+        track = EncodedTrack(self)
+        self.subscribers.add(track)
+        # The new viewer starts at the next keyframe
+        self.force_keyframe = True
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return track
+
+    def unsubscribe(self, track):
+        self.subscribers.discard(track)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        encode = self.encode_video if self.kind == "video" else self.encode_audio
+        while True:
+            try:
+                frame = await self.track.recv()
+            except MediaStreamError:
+                break
+            if not self.subscribers:
+                # Keep reading, the frames would pile up in the receiver
+                continue
+            packets = await loop.run_in_executor(None, encode, frame)
+            for packet in packets:
+                for subscriber in list(self.subscribers):
+                    subscriber.put(packet)
+        for subscriber in list(self.subscribers):
+            subscriber.put(None)
+
+    def encode_video(self, frame):
+        if frame.format.name != "yuv420p":
+            frame = frame.reformat(format="yuv420p")
+        if self.codec is None or (frame.width, frame.height) != (self.codec.width, self.codec.height):
+            self.codec = av.CodecContext.create("libvpx", "w")
+            self.codec.width = frame.width
+            self.codec.height = frame.height
+            self.codec.pix_fmt = "yuv420p"
+            self.codec.time_base = frame.time_base
+            self.codec.bit_rate = VIDEO_BITRATE
+            # Keyframes are placed by hand, see below
+            self.codec.gop_size = 3000
+            self.codec.options = {
+                "deadline": "realtime",
+                "cpu-used": "-6",
+                "lag-in-frames": "0",
+                "minrate": str(VIDEO_BITRATE),
+                "maxrate": str(VIDEO_BITRATE),
+                "bufsize": str(VIDEO_BITRATE),
+            }
+            self.codec.thread_count = min(4, multiprocessing.cpu_count())
+            self.force_keyframe = True
+
+        now = float(frame.pts * frame.time_base)
+        if self.force_keyframe or self.last_keyframe is None or now - self.last_keyframe >= KEYFRAME_INTERVAL:
+            frame.pict_type = av.video.frame.PictureType.I
+            self.force_keyframe = False
+            self.last_keyframe = now
+        return self.codec.encode(frame)
+
+    def encode_audio(self, frame):
+        if self.codec is None:
+            self.codec = av.CodecContext.create("libopus", "w")
+            self.codec.bit_rate = AUDIO_BITRATE
+            self.codec.format = "s16"
+            self.codec.layout = "stereo"
+            self.codec.sample_rate = AUDIO_RATE
+            self.codec.time_base = AUDIO_TIME_BASE
+            self.codec.options = {"application": "voip"}
+            self.resampler = av.AudioResampler(
+                format="s16", layout="stereo", rate=AUDIO_RATE, frame_size=960
+            )
+        packets = []
+        for resampled in self.resampler.resample(frame):
+            packets += self.codec.encode(resampled)
+        for packet in packets:
+            # libopus starts at a negative pts (its pre-skip)
+            if self.first_pts is None:
+                self.first_pts = packet.pts
+            packet.pts -= self.first_pts
+        return packets
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        for subscriber in list(self.subscribers):
+            subscriber.stop()
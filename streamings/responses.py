@@ -0,0 +1,103 @@
+import os
+import re
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parses a single "bytes=start-end" Range header against a file of `size` bytes.
+    Returns an inclusive (start, end) tuple, or None when the header should be
+    ignored and the whole file served (missing, malformed or multiple ranges).
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        # Suffix range: the last N bytes of the file
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def if_range_matches(request, etag, last_modified):
+    """A Range request is only honoured if the If-Range validator still matches the file."""
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/"')):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+
+def read_file_range(path, start, length, block_size=STREAM_BLOCK_SIZE):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def ranged_file_response(request, path, content_type, filename=None):
+    """
+    Serves a file from disk in fixed-size blocks, so memory per request stays
+    flat regardless of the file size. Supports single byte ranges (206 Partial
+    Content) and conditional requests with ETag / Last-Modified.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(f"{stat.st_mtime_ns:x}-{size:x}")
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            byte_range = None
+            if if_range_matches(request, etag, last_modified):
+                byte_range = parse_range(request.headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        if byte_range is None:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+            response.block_size = STREAM_BLOCK_SIZE
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = StreamingHttpResponse(
+                read_file_range(path, start, length), status=206, content_type=content_type
+            )
+            response["Content-Length"] = str(length)
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        if filename:
+            response["Content-Disposition"] = f'inline; filename="{filename}"'
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    return response
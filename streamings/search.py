@@ -0,0 +1,130 @@
+"""
+Indexed search over usernames and stream titles/descriptions.
+
+The backend is chosen from the database engine:
+- SQLite uses the FTS5 tables created by users/0003 and streamings/0007.
+- PostgreSQL uses the pg_trgm and tsvector GIN indexes created by the same
+  migrations.
+- Any other engine falls back to a plain icontains scan.
+"""
+import re
+from django.db import connection
+from django.db.models import BooleanField, Case, FloatField, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+from users.models import CustomUser
+from .models import Streaming
+
+# FTS5 results are ranked in SQL and capped, the page is then loaded by id
+SEARCH_MAX_RESULTS = 500
+
+STREAM_TSVECTOR = (
+    "to_tsvector('simple', coalesce(streamings_streaming.title, '') || ' ' || "
+    "coalesce(streamings_streaming.description, ''))"
+)
+
+
+def search_terms(query):
+    return re.findall(r"\w+", query or "")
+
+
+def fts5_query(terms):
+    # Every term is quoted and prefix-matched, so "jo do" finds "john_doe"
+    return " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+
+def tsquery(terms):
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def ranked_by_ids(queryset, ids):
+    """
+    Keeps the ranking computed by the FTS5 query. The position of each id in a
+    ",1,5,3," string is much cheaper to evaluate in SQLite than a CASE with
+    one branch per result.
+    """
+    if not ids:
+        return queryset.none()
+    table = queryset.model._meta.db_table
+    positions = "," + ",".join(str(pk) for pk in ids) + ","
+    ranking = RawSQL(
+        f"instr(%s, ',' || {table}.id || ',')", [positions], output_field=IntegerField()
+    )
+    return queryset.filter(pk__in=ids).order_by(ranking)
+
+
+def fts5_ids(table, match):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {table} WHERE {table} MATCH %s ORDER BY rank LIMIT %s",
+            [match, SEARCH_MAX_RESULTS],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_users(query):
+    """Users whose username matches `query`, best matches first."""
+    terms = search_terms(query)
+    if not terms:
+        return CustomUser.objects.none()
+
+    if connection.vendor == "sqlite":
+        return ranked_by_ids(
+            CustomUser.objects.all(), fts5_ids("users_customuser_fts", fts5_query(terms))
+        )
+
+    if connection.vendor == "postgresql":
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        # icontains compiles to UPPER(username) LIKE UPPER(...), which is the
+        # expression covered by the trigram index
+        return (
+            CustomUser.objects.filter(username__icontains=query)
+            .annotate(
+                is_prefix=Case(
+                    When(username__istartswith=query, then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField(),
+                ),
+                rank=TrigramSimilarity("username", query),
+            )
+            .order_by("-is_prefix", "-rank", "username")
+        )
+
+    return CustomUser.objects.filter(username__icontains=query).order_by("username")
+
+
+def search_streams(query):
+    """Streams whose title or description matches `query`, best matches first."""
+    terms = search_terms(query)
+    if not terms:
+        return Streaming.objects.none()
+
+    if connection.vendor == "sqlite":
+        return ranked_by_ids(
+            Streaming.objects.all(), fts5_ids("streamings_streaming_fts", fts5_query(terms))
+        )
+
+    if connection.vendor == "postgresql":
+        ts_query = tsquery(terms)
+        return (
+            Streaming.objects.filter(
+                RawSQL(
+                    f"{STREAM_TSVECTOR} @@ to_tsquery('simple', %s)",
+                    [ts_query],
+                    output_field=BooleanField(),
+                )
+            )
+            .annotate(
+                rank=RawSQL(
+                    f"ts_rank({STREAM_TSVECTOR}, to_tsquery('simple', %s))",
+                    [ts_query],
+                    output_field=FloatField(),
+                )
+            )
+            .order_by("-rank", "-start_time")
+        )
+
+    return (
+        Streaming.objects.filter(title__icontains=query)
+        | Streaming.objects.filter(description__icontains=query)
+    ).order_by("-start_time")
@@ -0,0 +1,28 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from .live import invalidate_live_streams
+from .models import Streaming
+
+
+def is_listed(streaming):
+    return streaming.is_live and not streaming.has_ended
+
+
+@receiver(post_init, sender=Streaming)
+def remember_live_state(sender, instance, **kwargs):
+    instance._was_listed = is_listed(instance)
+
+
+@receiver(post_save, sender=Streaming)
+def update_live_directory(sender, instance, **kwargs):
+    # Streams entering or leaving the live set (start_stream_live,
+    # finalize_stream) and edits to a live stream invalidate the directory
+    if instance._was_listed or is_listed(instance):
+        invalidate_live_streams()
+    instance._was_listed = is_listed(instance)
+
+
+@receiver(post_delete, sender=Streaming)
+def remove_from_live_directory(sender, instance, **kwargs):
+    if instance._was_listed:
+        invalidate_live_streams()
@@ -0,0 +1,123 @@
+// Live HLS playback, for viewers that cannot receive the WebRTC stream
+let hls = null;
+// Pending load of hls.js, it is only fetched when a viewer falls back to HLS
+let hlsScriptLoad = null;
+// Seconds between attempts to load a playlist that does not exist yet
+const MANIFEST_RETRY_DELAY_MS = 2000;
+let retryTimer = null;
+
+/**
+ * Loads hls.js from its pinned URL, once per page.
+ * @param {{url: string, integrity: string}} script URL and SRI hash of hls.js.
+ * @returns {Promise<void>} Resolves when window.Hls is available.
+ */
+function loadHlsJs(script) {
+  if (window.Hls) {
+    return Promise.resolve();
+  }
+  if (!hlsScriptLoad) {
+    hlsScriptLoad = new Promise((resolve, reject) => {
+      const tag = document.createElement("script");
+      tag.src = script.url;
+      if (script.integrity) {
+        tag.integrity = script.integrity;
+      }
+      tag.crossOrigin = "anonymous";
+      tag.onload = () => resolve();
+      tag.onerror = () => {
+        // A later fallback can try again
+        hlsScriptLoad = null;
+        tag.remove();
+        reject(new Error(`Could not load ${script.url}`));
+      };
+      document.head.appendChild(tag);
+    });
+  }
+  return hlsScriptLoad;
+}
+
+/**
+ * Plays the live HLS playlist in a video element, natively where the browser
+ * supports HLS (Safari, iOS) and with hls.js everywhere else. The playlist
+ * only exists once the first chunk has been packaged, so loading it is
+ * retried until playback stops.
+ * @param {HTMLVideoElement} video The video element to play in.
+ * @param {string} playlistURL URL of the live playlist.
+ * @param {{url: string, integrity: string}} script URL and SRI hash of hls.js.
+ * @returns {Promise<boolean>} Whether playback could be started.
+ */
+async function startHlsPlayback(video, playlistURL, script) {
+  if (video.canPlayType("application/vnd.apple.mpegurl")) {
+    console.log("[INFO] Playing live HLS natively.");
+    video.srcObject = null;
+    video.onerror = () => {
+      clearTimeout(retryTimer);
+      retryTimer = setTimeout(() => {
+        video.src = playlistURL;
+      }, MANIFEST_RETRY_DELAY_MS);
+    };
+    video.src = playlistURL;
+    return true;
+  }
+
+  try {
+    await loadHlsJs(script);
+  } catch (err) {
+    console.error("[ERROR] Could not load hls.js:", err);
+    return false;
+  }
+  if (!window.Hls.isSupported()) {
+    console.error("[ERROR] HLS playback is not supported in this browser.");
+    return false;
+  }
+
+  console.log("[INFO] Playing live HLS with hls.js.");
+  stopHlsPlayback(video);
+  hls = new window.Hls({
+    // Stay two segments behind the live edge
+    liveSyncDurationCount: 2,
+    manifestLoadingMaxRetry: 10,
+    manifestLoadingRetryDelay: MANIFEST_RETRY_DELAY_MS,
+  });
+  const player = hls;
+  video.srcObject = null;
+  player.loadSource(playlistURL);
+  player.attachMedia(video);
+  player.on(window.Hls.Events.ERROR, (event, data) => {
+    if (!data.fatal) {
+      return;
+    }
+    console.error("[ERROR] Fatal HLS error:", data.details);
+    if (data.type === window.Hls.ErrorTypes.MEDIA_ERROR) {
+      player.recoverMediaError();
+    } else if (data.type === window.Hls.ErrorTypes.NETWORK_ERROR) {
+      // Keep asking for the playlist, the stream may not have published it yet
+      clearTimeout(retryTimer);
+      retryTimer = setTimeout(() => {
+        if (hls === player) {
+          player.loadSource(playlistURL);
+        }
+      }, MANIFEST_RETRY_DELAY_MS);
+    }
+  });
+  return true;
+}
+
+/**
+ * Stops live HLS playback so the element can show the WebRTC stream again.
+ * @param {HTMLVideoElement} video The video element HLS was playing in.
+ */
+function stopHlsPlayback(video) {
+  clearTimeout(retryTimer);
+  if (hls) {
+    hls.destroy();
+    hls = null;
+  }
+  if (video && video.getAttribute("src")) {
+    video.onerror = null;
+    video.removeAttribute("src");
+    video.load();
+  }
+}
+
+export { startHlsPlayback, stopHlsPlayback };
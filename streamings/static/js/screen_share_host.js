@@ -14,8 +14,6 @@ async function startScreenShare() {
     const screenTrack = screenStream.getVideoTracks()[0];
     screenTrack.contentHint = "screen";
 
-    // Agregar el track con un transceiver específico
-    window.WebRTC.peerConnection.addTrack(screenTrack, screenStream);
     window.WebRTC.screenStream = screenStream;
     window.WebRTC.isScreenSharing = true;
 
@@ -30,20 +28,23 @@ async function startScreenShare() {
     localVideo.classList.add("video-small");
     localVideo.classList.remove("video-large");
 
-    // Crear y enviar nueva oferta
-    const newOffer = await window.WebRTC.peerConnection.createOffer();
-    await window.WebRTC.peerConnection.setLocalDescription(newOffer);
-    window.WebRTC.websocket.send(
-      JSON.stringify({
-        type: "offer",
-        data: newOffer,
-        screenShare: true, // Indicador para el viewer
-      })
-    );
+    // Agregar el track a cada viewer y renegociar con una oferta dirigida a él
+    for (const [peerID, peerConnection] of window.WebRTC.peerConnections) {
+      peerConnection.addTrack(screenTrack, screenStream);
+      const newOffer = await peerConnection.createOffer();
+      await peerConnection.setLocalDescription(newOffer);
+      window.WebRTC.websocket.send(
+        JSON.stringify({
+          type: "offer",
+          target: peerID,
+          data: peerConnection.localDescription,
+        })
+      );
+    }
 
     // Manejar fin de compartir pantalla
     screenTrack.onended = () => {
-      stopScreenShare(window.WebRTC.peerConnection, sharedScreen);
+      stopScreenShare(sharedScreen);
       window.WebRTC.isScreenSharing = false;
       window.WebRTC.screenStream = null;
       console.log("[INFO] Screen sharing stopped.");
@@ -57,16 +58,19 @@ async function startScreenShare() {
 }
 
 // Function to stop the screen share
-function stopScreenShare(peerConnection, sharedScreen) {
+function stopScreenShare(sharedScreen) {
   try {
     if (!window.WebRTC.isScreenSharing) {
       console.warn("[INFO] No hay screen share activo para detener.");
       return;
     }
 
-    if (window.WebRTC.screenSender) {
-      peerConnection.removeTrack(window.WebRTC.screenSender);
-      window.WebRTC.screenSender = null;
+    for (const peerConnection of window.WebRTC.peerConnections.values()) {
+      peerConnection.getSenders().forEach((sender) => {
+        if (sender.track && sender.track.contentHint === "screen") {
+          peerConnection.removeTrack(sender);
+        }
+      });
     }
 
     if (sharedScreen.srcObject) {
@@ -98,7 +102,7 @@ async function initializeScreenSharing() {
   // console.log("sharedScreen: ", sharedScreen);
 
   if (window.WebRTC.isScreenSharing) {
-    stopScreenShare();
+    stopScreenShare(document.getElementById("sharedScreen"));
   } else {
     await startScreenShare();
   }
@@ -1,6 +1,15 @@
 let mediaRecorder;
 let isRecording = false;
-let recordedChunks = [];
+let chunkIndex = 0;
+let pendingUploads = Promise.resolve();
+// Chunks the server has not acknowledged yet, kept so they can be re-sent
+const unsentChunks = new Map();
+const MAX_RESEND_ROUNDS = 3;
+
+// Chunks are uploaded while the stream is live so the server repairs each one
+// as it arrives (repair_stream_chunk) and serves them as live HLS, instead of
+// waiting for the stream to end.
+const CHUNK_INTERVAL_MS = 4000;
 
 import { getCSRFToken } from "./utils.js";
 
@@ -23,24 +32,24 @@ export function startRecording(stream, streamID) {
 
     mediaRecorder.ondataavailable = (event) => {
       if (event.data.size > 0) {
-        recordedChunks.push(event.data);
         console.log("[INFO] Chunk recorded:", event.data);
+        queueChunkUpload(event.data, streamID);
       }
     };
 
     mediaRecorder.onstop = async () => {
-      console.log("[INFO] MediaRecorder has stopped. Uploading chunks...");
-      if (recordedChunks.length > 0) {
-        await uploadAllChunks(streamID);
-      } else {
+      console.log("[INFO] MediaRecorder has stopped. Waiting for pending uploads...");
+      await pendingUploads;
+      if (chunkIndex === 0) {
         console.warn("[WARNING] No recorded chunks found to upload.");
       }
+      await resendMissingChunks(streamID);
 
       console.log("[INFO] Notifying backend to finalize stream...");
       await notifyBackendToFinalize(streamID);
     };
 
-    mediaRecorder.start();
+    mediaRecorder.start(CHUNK_INTERVAL_MS);
     isRecording = true;
     console.log("[INFO] Recording started successfully.");
   } catch (error) {
@@ -64,46 +73,111 @@ export async function stopRecordingAndSave(streamID) {
 }
 
 /**
- * Uploads all recorded video chunks to the server sequentially.
+ * Queues a recorded chunk for upload, keeping uploads sequential and in order.
+ * @param {Blob} chunk - Chunk of video produced by the MediaRecorder.
  * @param {string} streamID - ID of the stream to associate with.
  */
-async function uploadAllChunks(streamID) {
-  for (let i = 0; i < recordedChunks.length; i++) {
-    const chunk = recordedChunks[i];
-    await uploadVideoChunk(chunk, streamID, i);
+function queueChunkUpload(chunk, streamID) {
+  const index = chunkIndex++;
+  unsentChunks.set(index, chunk);
+  pendingUploads = pendingUploads.then(async () => {
+    if (await uploadVideoChunk(chunk, streamID, index)) {
+      unsentChunks.delete(index);
+    }
+  });
+}
+
+/**
+ * Asks the server which chunks are not in its manifest and re-sends them,
+ * so the recording is complete before the stream is finalized.
+ * @param {string} streamID - ID of the stream.
+ */
+async function resendMissingChunks(streamID) {
+  for (let round = 0; round < MAX_RESEND_ROUNDS; round++) {
+    let missing;
+    try {
+      const response = await fetch(
+        `/streamings/chunk/${streamID}/missing/?expected=${chunkIndex}`
+      );
+      if (!response.ok) {
+        console.error("[ERROR] Could not fetch the missing chunks:", response.status);
+        return;
+      }
+      missing = (await response.json()).missing;
+    } catch (error) {
+      console.error("[ERROR] Error fetching the missing chunks:", error);
+      return;
+    }
+
+    if (missing.length === 0) {
+      return;
+    }
+    console.warn(`[WARNING] Server is missing chunks ${missing.join(", ")}, re-sending...`);
+    for (const index of missing) {
+      const chunk = unsentChunks.get(index);
+      if (!chunk) {
+        console.error(`[ERROR] Chunk ${index} is no longer available to re-send.`);
+        continue;
+      }
+      if (await uploadVideoChunk(chunk, streamID, index)) {
+        unsentChunks.delete(index);
+      }
+    }
+  }
+}
+
+/**
+ * SHA-256 of a chunk as a hex string, sent so the server can reject corrupted
+ * uploads. crypto.subtle only exists on secure origins; elsewhere the
+ * checksum is skipped.
+ * @param {Blob} blob - Chunk of video.
+ * @returns {Promise<string|null>}
+ */
+async function sha256Hex(blob) {
+  if (!window.crypto || !window.crypto.subtle) {
+    return null;
   }
-  recordedChunks = []; // Clear buffer after upload
-  console.log("[INFO] All chunks uploaded successfully.");
+  const digest = await window.crypto.subtle.digest("SHA-256", await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
 }
 
 /**
- * Uploads a single video chunk to the backend.
+ * Uploads a single video chunk to the backend. The chunk is sent as the raw
+ * request body so the server can write it to disk as it arrives.
  * @param {Blob} videoBlob - Chunk of video in Blob format.
  * @param {string} streamID - ID of the stream.
  * @param {number} chunkIndex - Index of the chunk being uploaded.
+ * @returns {Promise<boolean>} Whether the server stored the chunk.
  */
 async function uploadVideoChunk(videoBlob, streamID, chunkIndex) {
-  const formData = new FormData();
-  formData.append("video_chunk", videoBlob);
-  formData.append("chunk_index", chunkIndex);
+  const headers = {
+    "X-CSRFToken": getCSRFToken(),
+    "Content-Type": "application/octet-stream",
+  };
 
   try {
-    const response = await fetch(`/streamings/save_video/${streamID}/`, {
-      method: "POST",
-      headers: {
-        "X-CSRFToken": getCSRFToken(),
-      },
-      body: formData,
+    const checksum = await sha256Hex(videoBlob);
+    if (checksum) {
+      headers["X-Chunk-SHA256"] = checksum;
+    }
+
+    const response = await fetch(`/streamings/chunk/${streamID}/${chunkIndex}/`, {
+      method: "PUT",
+      headers: headers,
+      body: videoBlob,
     });
 
     if (response.ok) {
       console.log(`[INFO] Chunk ${chunkIndex} uploaded successfully.`);
-    } else {
-      console.error(`[ERROR] Failed to upload chunk ${chunkIndex}:`, response.status);
+      return true;
     }
+    console.error(`[ERROR] Failed to upload chunk ${chunkIndex}:`, response.status);
   } catch (error) {
     console.error(`[ERROR] Error uploading chunk ${chunkIndex}:`, error);
   }
+  return false;
 }
 
 /**
@@ -119,6 +193,7 @@ async function notifyBackendToFinalize(streamID) {
         "X-CSRFToken": csrfToken,
         "Content-Type": "application/json",
       },
+      body: JSON.stringify({ chunk_count: chunkIndex }),
     });
 
     const contentType = response.headers.get("content-type");
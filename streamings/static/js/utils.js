@@ -88,3 +88,23 @@ export function handleWebSocketError(error) {
   console.error("[ERROR] WebSocket error occurred:", error);
   alert("A connection error occurred. Please try refreshing the page.");
 }
+
+/**
+ * Waits until a peer connection has gathered all its ICE candidates, so its
+ * local description can be sent to a peer that does not trickle ICE.
+ * @param {RTCPeerConnection} peerConnection The connection gathering candidates.
+ * @returns {Promise<void>} Resolves once gathering is complete.
+ */
+export function waitForIceGathering(peerConnection) {
+  if (peerConnection.iceGatheringState === "complete") {
+    return Promise.resolve();
+  }
+  return new Promise((resolve) => {
+    peerConnection.addEventListener("icegatheringstatechange", function check() {
+      if (peerConnection.iceGatheringState === "complete") {
+        peerConnection.removeEventListener("icegatheringstatechange", check);
+        resolve();
+      }
+    });
+  });
+}
@@ -1,4 +1,4 @@
-import { getCSRFToken } from "./utils.js";
+import { getCSRFToken, waitForIceGathering } from "./utils.js";
 
 document.addEventListener("DOMContentLoaded", () => {
   console.log("[INFO] Initializing WebRTC for Host...");
@@ -20,8 +20,13 @@ document.addEventListener("DOMContentLoaded", () => {
   const websocket = new WebSocket(websocketURL);
   console.log(`[INFO] WebSocket URL: ${websocketURL}`);
 
-  let peerConnection = null;
-  let pendingICECandidates = [];
+  // One RTCPeerConnection per viewer, keyed by the viewer's peer ID. In relay
+  // mode there is a single one, to the server relay
+  const RELAY_PEER_ID = "relay";
+  let relayMode = false;
+  const peerConnections = new Map();
+  const pendingICECandidates = new Map();
+  let isLive = false;
   let localStream = null;
   // let screenStream = null;
   // let screenSender = null;
@@ -91,7 +96,9 @@ document.addEventListener("DOMContentLoaded", () => {
     const stream = await initializeLocalStream();
     if (stream) {
       window.WebRTC.localStream = stream;
-      createPeerConnection(stream);
+      if (relayMode) {
+        await startStreaming(RELAY_PEER_ID);
+      }
     } else {
       console.error("[ERROR] Local stream initialization failed.");
       alert("Failed to initialize local stream. Please check your setup.");
@@ -99,22 +106,37 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   };
 
+  // Signaling messages come from a single viewer, identified by message.from
   websocket.onmessage = async (event) => {
     const message = JSON.parse(event.data);
+    const peerID = message.from;
 
-    if (message.type === "ready") {
-      console.log("[INFO] Viewer is ready, starting streaming.");
-      await startStreaming();
-    } else if (message.type === "answer" && peerConnection) {
-      console.log("[INFO] Received answer from viewer.");
-      await setRemoteAnswer(message.data);
+    if (message.type === "welcome") {
+      relayMode = message.mode === "relay";
+      console.log(`[INFO] Connected as ${message.peer_id} in ${message.mode} mode.`);
+      if (relayMode && localStream && !peerConnections.has(RELAY_PEER_ID)) {
+        await startStreaming(RELAY_PEER_ID);
+      }
+    } else if (message.type === "ready") {
+      console.log(`[INFO] Viewer ${peerID} is ready, starting streaming.`);
+      await startStreaming(peerID);
+    } else if (message.type === "answer" && peerConnections.has(peerID)) {
+      console.log(`[INFO] Received answer from viewer ${peerID}.`);
+      await setRemoteAnswer(peerID, message.data);
     } else if (message.type === "ice") {
+      const peerConnection = peerConnections.get(peerID);
       if (peerConnection && peerConnection.remoteDescription) {
-        await addIceCandidate(message.data);
+        await addIceCandidate(peerConnection, message.data);
       } else {
-        pendingICECandidates.push(message.data);
+        if (!pendingICECandidates.has(peerID)) {
+          pendingICECandidates.set(peerID, []);
+        }
+        pendingICECandidates.get(peerID).push(message.data);
         console.log("[INFO] ICE candidate queued for later.");
       }
+    } else if (message.type === "leave") {
+      console.log(`[INFO] Viewer ${peerID} left.`);
+      closePeerConnection(peerID);
     }
   };
 
@@ -126,7 +148,7 @@ document.addEventListener("DOMContentLoaded", () => {
     console.warn("[WARNING] WebSocket closed unexpectedly:", event);
   };
 
-  async function addIceCandidate(candidate) {
+  async function addIceCandidate(peerConnection, candidate) {
     console.log("[INFO] Adding ICE candidate:", candidate);
     try {
       await peerConnection.addIceCandidate(new RTCIceCandidate(candidate));
@@ -136,7 +158,8 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
-  async function setRemoteAnswer(answer) {
+  async function setRemoteAnswer(peerID, answer) {
+    const peerConnection = peerConnections.get(peerID);
     try {
       console.log("[INFO] Setting remote answer.");
       await peerConnection.setRemoteDescription(
@@ -144,36 +167,42 @@ document.addEventListener("DOMContentLoaded", () => {
       );
       console.log("[INFO] Remote answer set successfully.");
 
-      for (const candidate of pendingICECandidates) {
-        await addIceCandidate(candidate);
+      for (const candidate of pendingICECandidates.get(peerID) || []) {
+        await addIceCandidate(peerConnection, candidate);
       }
-      pendingICECandidates = [];
+      pendingICECandidates.delete(peerID);
       console.log("[INFO] ICE candidates added successfully.");
     } catch (error) {
       console.error("[ERROR] Error setting remote answer:", error);
     }
   }
 
-  function createPeerConnection(localStream) {
-    peerConnection = new RTCPeerConnection(configuration);
+  function createPeerConnection(peerID, localStream) {
+    const peerConnection = new RTCPeerConnection(configuration);
 
     localStream.getTracks().forEach((track) => {
       peerConnection.addTrack(track, localStream);
     });
+    if (window.WebRTC.isScreenSharing && window.WebRTC.screenStream) {
+      window.WebRTC.screenStream.getVideoTracks().forEach((track) => {
+        peerConnection.addTrack(track, window.WebRTC.screenStream);
+      });
+    }
 
     peerConnection.onicecandidate = (event) => {
-      if (event.candidate) {
-        console.log("[INFO] Sending ICE candidate to viewer:", event.candidate);
+      // The relay does not trickle ICE, it gets the candidates inside the offer
+      if (event.candidate && peerID !== RELAY_PEER_ID) {
+        console.log(`[INFO] Sending ICE candidate to viewer ${peerID}:`, event.candidate);
         websocket.send(
           JSON.stringify({
             type: "ice",
+            target: peerID,
             data: event.candidate,
           })
         );
       } else {
         console.log("[INFO] All ICE candidates have been sent.");
       }
-      window.WebRTC.peerConnection = peerConnection;
     };
 
     peerConnection.oniceconnectionstatechange = () => {
@@ -185,21 +214,47 @@ document.addEventListener("DOMContentLoaded", () => {
       }
     };
 
+    peerConnections.set(peerID, peerConnection);
     console.log("[INFO] PeerConnection created successfully.");
+    return peerConnection;
+  }
+
+  function closePeerConnection(peerID) {
+    const peerConnection = peerConnections.get(peerID);
+    if (peerConnection) {
+      peerConnection.close();
+      peerConnections.delete(peerID);
+    }
+    pendingICECandidates.delete(peerID);
   }
 
-  // Function to start the streaming
-  async function startStreaming() {
+  // Function to start the streaming to a viewer
+  async function startStreaming(peerID) {
     try {
       if (!localStream || !localStream.active) {
         console.error("Local stream is not active or undefined.");
         return;
       }
-      console.log("[INFO] Starting streaming.");
+      console.log(`[INFO] Starting streaming to viewer ${peerID}.`);
+      // A viewer that announces itself again starts from a fresh connection
+      closePeerConnection(peerID);
+      const peerConnection = createPeerConnection(peerID, localStream);
       const offer = await peerConnection.createOffer();
       await peerConnection.setLocalDescription(offer);
-      websocket.send(JSON.stringify({ type: "offer", data: offer }));
+      if (peerID === RELAY_PEER_ID) {
+        await waitForIceGathering(peerConnection);
+      }
+      websocket.send(
+        JSON.stringify({
+          type: "offer",
+          target: peerID,
+          data: peerConnection.localDescription,
+        })
+      );
 
+      if (isLive) {
+        return;
+      }
       // Notify backend
       console.log("[INFO] Notifying backend that stream is live.");
       const response = await fetch(
@@ -212,6 +267,7 @@ document.addEventListener("DOMContentLoaded", () => {
         }
       );
       if (response.ok) {
+        isLive = true;
         console.log("[INFO] Stream is now live on backend.");
       } else {
         console.error("[ERROR] Failed to notify backend:", response.status);
@@ -225,11 +281,11 @@ document.addEventListener("DOMContentLoaded", () => {
     console.log("[INFO] Stopping streaming...");
 
     try {
-      // Close PeerConnection
-      if (peerConnection) {
-        peerConnection.close();
-        console.log("[INFO] PeerConnection closed.");
+      // Close every PeerConnection
+      for (const peerID of Array.from(peerConnections.keys())) {
+        closePeerConnection(peerID);
       }
+      console.log("[INFO] PeerConnections closed.");
 
       // Close WebSocket
       if (websocket) {
@@ -249,7 +305,7 @@ document.addEventListener("DOMContentLoaded", () => {
     stopStreaming,
     localStream,
     streamID,
-    peerConnection,
+    peerConnections,
     websocket,
     isScreenSharing,
   };
@@ -1,4 +1,9 @@
-import { getStreamIDFromURL, handleWebSocketError } from "./utils.js";
+import {
+  getStreamIDFromURL,
+  handleWebSocketError,
+  waitForIceGathering,
+} from "./utils.js";
+import { startHlsPlayback, stopHlsPlayback } from "./hls_viewer.js";
 import {
   handleScreenShareTrack,
   stopScreenShareViewer,
@@ -18,6 +23,10 @@ document.addEventListener("DOMContentLoaded", () => {
   console.log(`[INFO] WebSocket URL: ${websocketURL}`);
 
   let peerConnection = null;
+  // Peer ID of the host connection that sent the current offer
+  let hostPeerID = null;
+  // In relay mode the viewer negotiates with the server relay, which does not trickle ICE
+  let relayMode = false;
   let remoteStream = new MediaStream();
   let messageQueue = [];
   let iceCandidateQueue = [];
@@ -29,9 +38,60 @@ document.addEventListener("DOMContentLoaded", () => {
   const remoteVideo = document.getElementById("hostVideo");
   const sharedScreen = document.getElementById("sharedScreen");
 
+  // Live HLS is used when no WebRTC connection can be made
+  const HLS_FALLBACK_DELAY_MS = 10000;
+  const hlsDataset = document.querySelector("[data-hls-url]")?.dataset ?? {};
+  const hlsURL = hlsDataset.hlsUrl;
+  // hls.js is only downloaded if this viewer ends up on HLS
+  const hlsScript = {
+    url: hlsDataset.hlsjsUrl,
+    integrity: hlsDataset.hlsjsIntegrity,
+  };
+  let hlsStarted = false;
+  // WebRTC is tried again when the host (re)joins, unless it cannot work at all
+  let retryWebRTC = true;
+  let offerTimer = null;
+  // Sent by the server on connect: the stream is live and its host is connected
+  let streamLive = false;
+  let hostPresent = false;
+
+  function fallBackToHls(reason, { retry = true } = {}) {
+    retryWebRTC = retry;
+    if (hlsStarted || !hlsURL) {
+      return;
+    }
+    console.warn(`[WARNING] ${reason}, switching to live HLS.`);
+    hlsStarted = true;
+    clearTimeout(offerTimer);
+    closeViewerPeerConnection();
+    remoteStream = new MediaStream();
+    startHlsPlayback(remoteVideo, hlsURL, hlsScript);
+  }
+
+  function stopHls() {
+    if (!hlsStarted) {
+      return;
+    }
+    console.log("[INFO] Leaving live HLS for WebRTC.");
+    hlsStarted = false;
+    stopHlsPlayback(remoteVideo);
+  }
+
+  function announceViewer() {
+    websocket.send(JSON.stringify({ type: "ready" }));
+    clearTimeout(offerTimer);
+    // A host that has not connected yet cannot answer, the viewer waits for host_joined
+    if (hlsStarted || !streamLive || !hostPresent) {
+      return;
+    }
+    offerTimer = setTimeout(
+      () => fallBackToHls("No offer received"),
+      HLS_FALLBACK_DELAY_MS
+    );
+  }
+
   websocket.onopen = () => {
     console.log("[INFO] WebSocket is connected as Viewer.");
-    websocket.send(JSON.stringify({ type: "ready" }));
   };
 
   websocket.onmessage = (message) => {
@@ -40,27 +100,81 @@ document.addEventListener("DOMContentLoaded", () => {
     processQueue();
     switch (data.type) {
       case "offer":
-        handleOffer(data.data);
+        handleOffer(data.data, data.from);
         break;
       // case "answer":
       //   handleAnswer(data.data);
       //   break;
       case "ice":
-        handleIceCandidate(data.data);
+        addIceCandidate(data.data);
         break;
-      case "ready":
-        console.log("[INFO] Viewer received ready message from host.");
+      case "welcome":
+        console.log("[INFO] Connected with peer ID:", data.peer_id);
+        relayMode = data.mode === "relay";
+        streamLive = data.live;
+        hostPresent = data.host_present;
+        if (!window.RTCPeerConnection) {
+          fallBackToHls("WebRTC is not supported", { retry: false });
+          break;
+        }
+        announceViewer();
+        break;
+      case "host_joined":
+        // The host (re)connected, it only offers to viewers that announce themselves
+        hostPresent = true;
+        if (hlsStarted && !retryWebRTC) {
+          break;
+        }
+        // Viewers on HLS keep playing it until the new offer arrives
+        console.log("[INFO] Host joined, announcing viewer again.");
+        closeViewerPeerConnection();
+        announceViewer();
+        break;
+      case "host_left":
+        hostPresent = false;
+        clearTimeout(offerTimer);
+        break;
+      case "relay_full":
+        // The relay has STREAMING_RELAY_MAX_VIEWERS viewers already, the HLS
+        // playback is kept when the host renegotiates
+        fallBackToHls("The relay is full", { retry: false });
+        break;
+      case "screen_share_ended":
+        stopScreenShareViewer();
         break;
       default:
         console.warn("[WARNING] Unhandled message type received:", data.type);
     }
   };
 
-  function handleOffer(offer) {
+  function handleOffer(offer, from) {
+    if (hlsStarted) {
+      if (!retryWebRTC) {
+        return;
+      }
+      stopHls();
+    }
+    clearTimeout(offerTimer);
     console.log("[INFO] Handling offer received from host:", offer);
+    if (peerConnection && hostPeerID === from) {
+      // Renegotiation (e.g. screen share) on the existing connection
+      answerOffer(offer);
+      return;
+    }
+    closeViewerPeerConnection();
+    hostPeerID = from;
     setupViewerPeerConnection(offer);
   }
 
+  function closeViewerPeerConnection() {
+    if (peerConnection) {
+      peerConnection.close();
+      peerConnection = null;
+    }
+    hostPeerID = null;
+    iceCandidateQueue = [];
+  }
+
   function processQueue() {
     while (messageQueue.length > 0) {
       const message = messageQueue.shift();
@@ -115,7 +229,7 @@ document.addEventListener("DOMContentLoaded", () => {
     peerConnection = new RTCPeerConnection(configuration);
 
     peerConnection.onicecandidate = (event) => {
-      if (event.candidate) {
+      if (event.candidate && !relayMode) {
         websocket.send(JSON.stringify({ type: "ice", data: event.candidate }));
       } else {
         console.log("[INFO] ICE candidate gathering complete.");
@@ -129,6 +243,7 @@ document.addEventListener("DOMContentLoaded", () => {
       );
       if (peerConnection.iceConnectionState === "failed") {
         console.error("[ERROR] ICE connection failed.");
+        fallBackToHls("ICE connection failed");
       }
     };
 
@@ -192,11 +307,16 @@ document.addEventListener("DOMContentLoaded", () => {
       console.log("[INFO] Viewer video setup completed.");
     };
 
+    await answerOffer(offer);
+  }
+
+  async function answerOffer(offer) {
     try {
       await peerConnection.setRemoteDescription(
         new RTCSessionDescription(offer)
       );
       console.log("[INFO] Remote description set successfully.");
+      processIceQueue();
 
       const answer = await peerConnection.createAnswer();
       console.log("[INFO] Answer created:", answer);
@@ -204,7 +324,13 @@ document.addEventListener("DOMContentLoaded", () => {
       await peerConnection.setLocalDescription(answer);
       console.log("[INFO] Local description set successfully:", answer);
 
-      websocket.send(JSON.stringify({ type: "answer", data: answer }));
+      if (relayMode) {
+        // The answer has to carry every candidate
+        await waitForIceGathering(peerConnection);
+      }
+      websocket.send(
+        JSON.stringify({ type: "answer", data: peerConnection.localDescription })
+      );
       console.log("[INFO] Answer sent to host.");
     } catch (err) {
       console.error("[ERROR] Error setting up PeerConnection:", err);
@@ -229,12 +355,12 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 
   // Process queue after setting remote description
-  // function processIceQueue() {
-  //   while (iceCandidateQueue.length > 0) {
-  //     const candidate = iceCandidateQueue.shift();
-  //     addIceCandidate(candidate);
-  //   }
-  // }
+  function processIceQueue() {
+    while (iceCandidateQueue.length > 0) {
+      const candidate = iceCandidateQueue.shift();
+      addIceCandidate(candidate);
+    }
+  }
 
   sharedScreen.addEventListener("click", () =>
     toggleScreenView(remoteVideo, sharedScreen)
@@ -1,14 +1,270 @@
+import fcntl
+import json
 import shutil
-import time
+from contextlib import contextmanager
 from celery import shared_task
 from pathlib import Path
 from django.conf import settings
-import subprocess
-from streamings.models import Streaming
+from streamings.models import StreamChunk, Streaming
+from streamings.media import (
+    assemble_chunks,
+    chunk_index,
+    concat_chunks,
+    dash_dir,
+    gap_map,
+    gap_map_path,
+    hls_dir,
+    hls_segment_path,
+    package_dash,
+    package_hls_segment,
+    repair_chunk,
+    repair_chunks,
+)
+from streamings.hls import publish_segment
+from streamings.uploads import chunk_path, missing_chunks
 from django.utils import timezone
 
-@shared_task
-def process_video(stream_id):
+def media_priority(chunk_count):
+    """Broker priority of a media task (0 runs first): shorter recordings go first."""
+    return min(9, (chunk_count or 0) // settings.VIDEO_PRIORITY_STEP_CHUNKS)
+
+
+def processing_time_limits(chunk_count, time_per_chunk=None):
+    """
+    (soft, hard) time limits of a media task over a recording of
+    `chunk_count` chunks; process_video's per chunk time by default.
+    """
+    if time_per_chunk is None:
+        time_per_chunk = settings.VIDEO_PROCESSING_TIME_PER_CHUNK
+    soft = min(
+        settings.VIDEO_PROCESSING_BASE_TIME + (chunk_count or 0) * time_per_chunk,
+        settings.VIDEO_PROCESSING_MAX_TIME,
+    )
+    return soft, soft + 5 * 60
+
+
+def queue_process_video(streaming):
+    """Queues the assembly of a stream with a priority and time limits sized to its recording."""
+    chunk_count = streaming.expected_chunks or streaming.chunks.count()
+    soft, hard = processing_time_limits(chunk_count)
+    return process_video.apply_async(
+        (streaming.id,),
+        priority=media_priority(chunk_count),
+        soft_time_limit=soft,
+        time_limit=hard,
+    )
+
+
+def queue_package_stream(stream_id, chunk_count):
+    """Queues the DASH packaging of a recording with time limits sized to its length."""
+    soft, hard = processing_time_limits(chunk_count, settings.VIDEO_PACKAGING_TIME_PER_CHUNK)
+    return package_stream.apply_async(
+        (stream_id,),
+        priority=media_priority(chunk_count),
+        soft_time_limit=soft,
+        time_limit=hard,
+    )
+
+
+# Media tasks are acknowledged only once done, so a worker killed in the
+# middle of an FFmpeg job does not lose it
+@shared_task(acks_late=True, reject_on_worker_lost=True, soft_time_limit=120, time_limit=150)
+def repair_stream_chunk(stream_id, chunk_index):
+    """
+    Repairs a chunk as soon as it is uploaded, so the stream is processed
+    incrementally while it is live. Recorder chunks are remuxed, which is
+    cheap; if the single pass assembly in process_video fails, the repaired
+    chunks are already there for the per-chunk fallback.
+    """
+    chunk = chunk_path(stream_id, chunk_index)
+    if not chunk.exists():
+        print(f"[WARNING] Chunk {chunk_index} of stream {stream_id} no longer exists.")
+        return
+    fixed_chunk, mode = repair_chunk(chunk)
+    if fixed_chunk is not None:
+        print(f"[INFO] Chunk {chunk_index} of stream {stream_id} repaired ({mode}).")
+    return {"chunk": chunk.name, "path": mode}
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, soft_time_limit=60, time_limit=90)
+def package_live_segment(self, stream_id, chunk_index, duration=None):
+    """
+    Converts a chunk uploaded while the stream is live into an HLS segment
+    and publishes it. If the playlist stays locked the publication is
+    retried with the `duration` of the segment, which is not packaged again.
+    """
+    segment = hls_segment_path(stream_id, chunk_index)
+    if duration is None:
+        chunk = chunk_path(stream_id, chunk_index)
+        if not chunk.exists():
+            print(f"[WARNING] Chunk {chunk_index} of stream {stream_id} no longer exists.")
+            return
+        segment.parent.mkdir(parents=True, exist_ok=True)
+        duration = package_hls_segment(chunk, segment, chunk_index * settings.VIDEO_CHUNK_DURATION)
+        if duration is None:
+            return
+    try:
+        publish_segment(stream_id, chunk_index, duration)
+    except TimeoutError as exc:
+        print(f"[WARNING] {exc} Retrying segment {chunk_index}.")
+        raise self.retry(
+            kwargs={"duration": duration},
+            countdown=1,
+            max_retries=settings.LIVE_HLS_PUBLISH_RETRIES,
+        )
+    return {"stream_id": stream_id, "segment": segment.name}
+
+
+@shared_task(bind=True)
+def end_live_playlist(self, stream_id):
+    """Publishes the last segments of a finished stream and closes its playlist."""
+    try:
+        publish_segment(stream_id, ended=True)
+    except TimeoutError as exc:
+        print(f"[WARNING] {exc} Retrying the end of the playlist.")
+        raise self.retry(countdown=1, max_retries=settings.LIVE_HLS_PUBLISH_RETRIES)
+    print(f"[INFO] Live playlist of stream {stream_id} closed.")
+
+
+def processing_lock_path(stream_id):
+    # Next to the temp directory, which cleanup_stream_chunks removes
+    return Path(settings.MEDIA_TEMP_STREAMS) / f"{stream_id}.lock"
+
+
+def processing_pending_path(stream_id):
+    return Path(settings.MEDIA_TEMP_STREAMS) / f"{stream_id}.pending"
+
+
+@contextmanager
+def processing_lock(stream_id):
+    """
+    Yields whether this process holds the processing lock of a stream, which
+    keeps assemblies and the cleanup of one stream from overlapping. A file
+    lock, so it holds across every worker process whatever the cache backend
+    is; the kernel releases it if the worker dies, so it needs no timeout.
+    """
+    path = processing_lock_path(stream_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Default limits, queue_process_video replaces them with ones sized to the recording
+@shared_task(
+    bind=True, acks_late=True, reject_on_worker_lost=True,
+    soft_time_limit=30 * 60, time_limit=35 * 60,
+)
+def process_video(self, stream_id):
+    """
+    Assembles the recording of a finished stream. Queued by finalize_stream
+    and again by every chunk that arrives after it, so nothing polls:
+    - if the manifest is still missing chunks the recorder announced, the
+      task retries with exponential backoff and finally assembles whatever
+      arrived (the holes end up in the gap map);
+    - only one assembly per stream runs at a time; chunks arriving during
+      one mark the stream as pending and it is re-queued when it finishes.
+    """
+    pending = processing_pending_path(stream_id)
+    pending.parent.mkdir(parents=True, exist_ok=True)
+    # Marked before trying the lock, so a running assembly that releases it
+    # right now still sees there is new work
+    pending.touch()
+    streaming = None
+    try:
+        with processing_lock(stream_id) as locked:
+            if not locked:
+                print(f"[INFO] Stream {stream_id} is being assembled, new chunks will be picked up next.")
+                return
+            pending.unlink(missing_ok=True)
+
+            try:
+                streaming = Streaming.objects.get(id=stream_id)
+            except Streaming.DoesNotExist:
+                print(f"[ERROR] Streaming with ID={stream_id} not found.")
+                return
+
+            missing = missing_chunks(streaming, streaming.expected_chunks)
+            if missing and self.request.retries < settings.VIDEO_FINALIZE_RETRIES:
+                countdown = 2 ** self.request.retries
+                print(f"[INFO] Stream {stream_id} is missing chunks {missing}, retrying in {countdown}s.")
+                raise self.retry(countdown=countdown, max_retries=settings.VIDEO_FINALIZE_RETRIES)
+
+            # Retries and re-queues can outlive the work they were queued for
+            last_received = (
+                streaming.chunks.order_by("-received_at").values_list("received_at", flat=True).first()
+            )
+            already_assembled = (
+                streaming.video_file
+                and streaming.recorded_date
+                and last_received
+                and last_received <= streaming.recorded_date
+            )
+            if already_assembled:
+                print(f"[INFO] Stream {stream_id} has no chunks newer than its recording.")
+                return
+            return assemble_recording(streaming)
+    finally:
+        # Only once the lock is released, so the new run can take it
+        if streaming is not None and pending.exists():
+            queue_process_video(streaming)
+
+
+@shared_task(bind=True)
+def cleanup_stream_chunks(self, stream_id):
+    """
+    Deletes the chunks of an assembled stream once late uploads are no longer
+    accepted (VIDEO_LATE_CHUNK_WINDOW after the assembly).
+    """
+    with processing_lock(stream_id) as locked:
+        if not locked:
+            # Assemblies of long recordings hold the lock for a long time,
+            # giving up would leave the chunks and the live playlist on disk
+            # for good. A worker that dies lets go of it right away.
+            raise self.retry(countdown=settings.VIDEO_CLEANUP_RETRY_DELAY, max_retries=None)
+        remove_stream_chunks(stream_id)
+
+
+def remove_stream_chunks(stream_id):
+    """Deletes the temp directory and live playlist of a stream, under its processing lock."""
+    stream_temp_dir = Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
+    if not stream_temp_dir.exists():
+        return
+    if processing_pending_path(stream_id).exists():
+        print(f"[INFO] Stream {stream_id} has new chunks, keeping its temp directory.")
+        return
+    # The recording replaces the live playlist
+    shutil.rmtree(hls_dir(stream_id), ignore_errors=True)
+
+    for file in stream_temp_dir.iterdir():
+        try:
+            print(f"[INFO] Deleting file: {file}")
+            file.unlink()
+        except Exception as e:
+            print(f"[ERROR] Could not delete {file}: {e}")
+
+    try:
+        stream_temp_dir.rmdir()
+        print(f"[INFO] Directory {stream_temp_dir} successfully deleted.")
+    except OSError:
+        print(f"[WARNING] Could not delete {stream_temp_dir}, forcing deletion.")
+        shutil.rmtree(stream_temp_dir, ignore_errors=True)
+    # A task that opened the lock file before this can only find the
+    # recording already assembled
+    processing_lock_path(stream_id).unlink(missing_ok=True)
+
+
+def assemble_recording(streaming):
+    stream_id = streaming.id
+    # Chunks received after this instant are not part of this assembly
+    started_at = timezone.now()
     print(f"[INFO] Processing video for stream ID={stream_id}.")
     stream_temp_dir = Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
     recorded_dir = Path(settings.MEDIA_ROOT) / "recorded_streams"
@@ -18,109 +274,111 @@ def process_video(stream_id):
         print(f"[ERROR] Directory {stream_temp_dir} does not exist.")
         return
 
-    # Wait until at least one chunk is found (max wait: 5 seconds)
-    max_wait_time = 5
-    wait_interval = 0.5
-    total_waited = 0
-
-    while total_waited < max_wait_time:
-        chunks = sorted(stream_temp_dir.glob("chunk_*.webm"))
-        if chunks:
-            break
-        print(f"[INFO] Waiting for video fragments... ({total_waited}s elapsed)")
-        time.sleep(wait_interval)
-        total_waited += wait_interval
-
-    chunks = sorted(stream_temp_dir.glob("chunk_*.webm"))
+    # The manifest lists every stored chunk in recording order
+    chunk_indexes = list(
+        StreamChunk.objects.filter(streaming_id=stream_id).values_list("index", flat=True)
+    )
+    if not chunk_indexes:
+        # Recordings uploaded before the manifest existed; the indexes are
+        # parsed as numbers so chunk_10 still comes after chunk_2
+        chunk_indexes = sorted(
+            index for index in map(chunk_index, stream_temp_dir.iterdir()) if index is not None
+        )
+    chunk_indexes = [index for index in chunk_indexes if chunk_path(stream_id, index).exists()]
+    chunks = [chunk_path(stream_id, index) for index in chunk_indexes]
     if not chunks:
-        print(f"[ERROR] No video fragments found in {stream_temp_dir} after waiting {max_wait_time}s.")
+        print(f"[ERROR] No video fragments recorded for stream {stream_id}.")
         return
 
     print(f"[INFO] Found {len(chunks)} fragments for stream {stream_id}.")
-
-    fixed_chunks = []
-    for chunk in chunks:
-        fixed_chunk = chunk.parent / f"fixed_{chunk.name}"
-        print(f"[DEBUG] Repairing fragment: {chunk}")
-
-        result = subprocess.run(
-            [
-                "ffmpeg", "-i", str(chunk),
-                "-c:v", "libvpx-vp9",
-                "-b:v", "1M",
-                "-c:a", "libopus",
-                "-y", str(fixed_chunk)
-            ],
-            capture_output=True, text=True
-        )
-
-        if result.returncode != 0:
-            print(f"[ERROR] FFmpeg failed to process {chunk}: {result.stderr}")
-            return
-
-        fixed_chunks.append(fixed_chunk)
-
-    print(f"[INFO] All fragments successfully repaired.")
+    gaps = gap_map(chunk_indexes)
+    if gaps:
+        print(f"[WARNING] Stream {stream_id} has missing fragments: {gaps}")
 
     output_file = recorded_dir / f"{stream_id}.webm"
 
-    if len(fixed_chunks) == 1:
-        print(f"[INFO] Only one fragment found. Copying it directly to {output_file}")
-        shutil.copy(fixed_chunks[0], output_file)
+    # One FFmpeg pass over the original chunks, a remux for the VP9/Opus
+    # chunks MediaRecorder produces. Only if that fails (e.g. a corrupted
+    # chunk) are the chunks repaired on their own (reusing those repaired
+    # while the stream was live) and concatenated; the concat demuxer closes the holes, so the gap map then
+    # refers to the original recording time.
+    mode = assemble_chunks(chunks, output_file)
+    if mode != "failed":
+        print(f"[INFO] {len(chunks)} fragments assembled in a single pass ({mode}).")
+        chunk_paths = [{"chunk": chunk.name, "path": mode} for chunk in chunks]
     else:
-        file_list_path = stream_temp_dir / "file_list.txt"
-        print(f"[INFO] Generating file_list.txt: {file_list_path}")
-        try:
-            with open(file_list_path, "w") as file_list:
-                for chunk_file in fixed_chunks:
-                    if not chunk_file.exists():
-                        print(f"[ERROR] Fragment not found: {chunk_file}")
-                        return
-                    file_list.write(f"file '{chunk_file.resolve()}'\n")
-            print(f"[INFO] file_list.txt successfully generated.")
-        except Exception as e:
-            print(f"[ERROR] Failed to generate file_list.txt: {e}")
+        print(f"[WARNING] Single pass assembly failed, repairing fragments one by one.")
+        repaired = repair_chunks(chunks)
+        fixed_chunks = [fixed for fixed, chunk_mode in repaired if fixed is not None]
+        chunk_paths = [
+            {"chunk": chunk.name, "path": chunk_mode}
+            for chunk, (fixed, chunk_mode) in zip(chunks, repaired)
+        ]
+        if not fixed_chunks:
+            print(f"[ERROR] None of the {len(chunks)} fragments could be repaired.")
             return
-
-        try:
-            print(f"[INFO] Processing final video with FFmpeg...")
-            result = subprocess.run(
-                [
-                    "ffmpeg", "-f", "concat", "-safe", "0",
-                    "-i", str(file_list_path),
-                    "-c", "copy", str(output_file)
-                ],
-                cwd=stream_temp_dir,
-                capture_output=True, text=True, check=True
-            )
-            print(f"[INFO] FFmpeg output: {result.stdout}")
-        except subprocess.CalledProcessError as e:
-            print(f"[ERROR] FFmpeg execution failed: {e.stderr}")
+        failed = len(chunks) - len(fixed_chunks)
+        if failed:
+            print(f"[WARNING] Skipping {failed} fragment(s) that could not be repaired.")
+            gaps = gap_map([
+                chunk_index(chunk)
+                for chunk, (fixed, chunk_mode) in zip(chunks, repaired)
+                if fixed is not None
+            ])
+        if not concat_chunks(fixed_chunks, output_file, stream_temp_dir):
             return
 
+    # Where the recording has holes, for the player and for reprocessing
+    gaps_file = gap_map_path(stream_id)
+    if gaps:
+        gaps_file.parent.mkdir(parents=True, exist_ok=True)
+        gaps_file.write_text(json.dumps(gaps))
+    elif gaps_file.exists():
+        gaps_file.unlink()
+
     if output_file.exists():
         print(f"[INFO] Final video saved successfully at {output_file}")
-        try:
-            streaming = Streaming.objects.get(id=stream_id)
-            streaming.video_file = f"recorded_streams/{stream_id}.webm"
-            streaming.recorded_date = timezone.now()
-            streaming.save()
-            print(f"[INFO] Updated video_file field for stream ID={stream_id}.")
-        except Streaming.DoesNotExist:
-            print(f"[ERROR] Streaming with ID={stream_id} not found.")
-
-        for file in stream_temp_dir.iterdir():
-            try:
-                print(f"[INFO] Deleting file: {file}")
-                file.unlink()
-            except Exception as e:
-                print(f"[ERROR] Could not delete {file}: {e}")
+        streaming.video_file = f"recorded_streams/{stream_id}.webm"
+        streaming.recorded_date = started_at
+        streaming.save(update_fields=["video_file", "recorded_date"])
+        print(f"[INFO] Updated video_file field for stream ID={stream_id}.")
 
-        try:
-            stream_temp_dir.rmdir()
-            print(f"[INFO] Directory {stream_temp_dir} successfully deleted.")
-        except OSError:
-            print(f"[WARNING] Could not delete {stream_temp_dir}, forcing deletion.")
-            shutil.rmtree(stream_temp_dir, ignore_errors=True)
+        # The single WebM is playable right away, the DASH ladder follows
+        queue_package_stream(stream_id, len(chunks))
+        # Late chunks can still be uploaded and trigger a new assembly
+        # until the temp directory is removed
+        cleanup_stream_chunks.apply_async(
+            (stream_id,), countdown=settings.VIDEO_LATE_CHUNK_WINDOW
+        )
+
+        return {
+            "stream_id": stream_id,
+            "video_file": f"recorded_streams/{stream_id}.webm",
+            "chunks": chunk_paths,
+            "gaps": gaps,
+        }
     else:
         print(f"[ERROR] Final video file was not saved at {output_file}")
+
+
+# Default limits, queue_package_stream replaces them with ones sized to the recording
+@shared_task(
+    acks_late=True, reject_on_worker_lost=True,
+    soft_time_limit=2 * 60 * 60, time_limit=2 * 60 * 60 + 10 * 60,
+)
+def package_stream(stream_id):
+    """
+    Packages a recorded stream as multi-bitrate DASH so players can switch
+    renditions and start playback without downloading the whole file.
+    """
+    recorded_file = Path(settings.MEDIA_ROOT) / "recorded_streams" / f"{stream_id}.webm"
+    if not recorded_file.exists():
+        print(f"[ERROR] Recording {recorded_file} does not exist.")
+        return
+
+    print(f"[INFO] Packaging stream ID={stream_id} as DASH.")
+    manifest = package_dash(recorded_file, dash_dir(stream_id))
+    if manifest is None:
+        return
+    print(f"[INFO] DASH manifest saved at {manifest}")
+    return {"stream_id": stream_id, "manifest": str(manifest.relative_to(settings.MEDIA_ROOT))}
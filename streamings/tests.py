@@ -1,3 +1,885 @@
-from django.test import TestCase
+import fcntl
+import hashlib
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from pathlib import Path
+from unittest import mock, skipUnless
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from users.models import CustomUser
+from .models import StreamChunk, Streaming
+from .live import LIVE_STREAMS_CACHE_KEY, get_following_live_streams, get_live_streams
+from .hls import playlist_lock_path, playlist_path, publish_segment
+from .relay import relays
+from .responses import RangeNotSatisfiable, parse_range, ranged_file_response
+from .checks import check_player_script_integrity, check_player_scripts
+from .media import (
+    CLUSTER_ID,
+    EBML_HEADER,
+    can_stream_copy,
+    chunk_index,
+    chunk_input,
+    chunk_progress,
+    gap_map,
+    package_dash,
+    repair_chunks,
+)
+from .routing import websocket_urlpatterns
+from .search import search_streams, search_users
+from .uploads import ChunkConflict, store_chunk
+from .tasks import (
+    assemble_recording,
+    cleanup_stream_chunks,
+    media_priority,
+    package_live_segment,
+    process_video,
+    processing_lock_path,
+    processing_pending_path,
+    processing_time_limits,
+    queue_package_stream,
+    queue_process_video,
+)
 
-# Create your tests here.
+
+class StreamListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = CustomUser.objects.create_user(username="viewer", password="secret")
+        for index in range(10):
+            host = CustomUser.objects.create_user(username=f"host{index}", password="secret")
+            Streaming.objects.create(
+                title=f"Stream {index}", description="Live", host=host, is_live=index % 2 == 0
+            )
+            host.followers.add(cls.viewer)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.viewer)
+
+    def test_stream_list_query_count_does_not_grow_with_results(self):
+        # session, user, live streams (cache miss)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse("stream_list"))
+        self.assertEqual(len(response.context["streams"]), 5)
+
+        # session, user
+        with self.assertNumQueries(2):
+            self.client.get(reverse("stream_list"))
+
+    def test_user_search_query_count_does_not_grow_with_results(self):
+        # session, user, followed user ids, live streams (cache miss), user
+        # search ids, user count, user page, stream search ids (no stream
+        # matches, so the streams are not loaded)
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse("stream_list"), {"query": "host"})
+        user_data = response.context["user_data"]
+        self.assertEqual(len(user_data), 10)
+        self.assertEqual(sum(data["has_active_stream"] for data in user_data), 5)
+        self.assertTrue(all(data["is_following"] for data in user_data))
+
+
+class LiveDirectoryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.host = CustomUser.objects.create_user(username="host", password="secret")
+        self.stream = Streaming.objects.create(title="Stream", description="Soon", host=self.host)
+
+    def test_directory_follows_live_transitions(self):
+        self.assertEqual(get_live_streams(), [])
+
+        self.stream.is_live = True
+        self.stream.save()
+        self.assertEqual(get_live_streams(), [self.stream])
+
+        self.stream.is_live = False
+        self.stream.has_ended = True
+        self.stream.save()
+        self.assertEqual(get_live_streams(), [])
+
+    def test_following_feed_intersects_live_set(self):
+        viewer = CustomUser.objects.create_user(username="viewer", password="secret")
+        other = CustomUser.objects.create_user(username="other", password="secret")
+        Streaming.objects.create(title="Other", description="Live", host=other, is_live=True)
+        self.stream.is_live = True
+        self.stream.save()
+        self.host.followers.add(viewer)
+
+        self.assertEqual(get_following_live_streams(viewer), [self.stream])
+
+    def test_cache_holds_no_user_rows(self):
+        self.stream.is_live = True
+        self.stream.save()
+        get_live_streams()
+
+        cached = repr(cache.get(LIVE_STREAMS_CACHE_KEY))
+        self.assertNotIn(self.host.password, cached)
+        self.assertNotIn("CustomUser", cached)
+        with self.assertNumQueries(0):
+            stream = get_live_streams()[0]
+            self.assertEqual((stream.title, stream.host.username), ("Stream", "host"))
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.john = CustomUser.objects.create_user(username="john_doe", password="secret")
+        cls.johanna = CustomUser.objects.create_user(username="johanna", password="secret")
+        CustomUser.objects.create_user(username="maria", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Speedrun practice", description="Trying new routes", host=cls.john
+        )
+
+    def test_search_users_matches_prefixes(self):
+        self.assertEqual(set(search_users("joh")), {self.john, self.johanna})
+        self.assertEqual(list(search_users("doe")), [self.john])
+        self.assertEqual(list(search_users("")), [])
+
+    def test_search_streams_matches_title_and_description(self):
+        self.assertEqual(list(search_streams("speed")), [self.stream])
+        self.assertEqual(list(search_streams("route")), [self.stream])
+
+    def test_search_index_follows_updates(self):
+        self.stream.title = "Cooking show"
+        self.stream.save()
+        self.assertEqual(list(search_streams("speedrun")), [])
+        self.assertEqual(list(search_streams("cook")), [self.stream])
+
+
+class ReceiveChunkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = CustomUser.objects.create_user(username="host", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.host, is_live=True
+        )
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings_override = override_settings(MEDIA_TEMP_STREAMS=Path(self.temp_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        repair_patch = mock.patch("streamings.views.repair_stream_chunk.apply_async")
+        self.repair = repair_patch.start()
+        self.addCleanup(repair_patch.stop)
+        live_patch = mock.patch("streamings.views.package_live_segment.apply_async")
+        self.package_live = live_patch.start()
+        self.addCleanup(live_patch.stop)
+        self.client.force_login(self.host)
+
+    def put_chunk(self, data, chunk_index=0, sha256=None):
+        return self.client.put(
+            reverse("receive_chunk", args=[self.stream.id, chunk_index]),
+            data,
+            content_type="application/octet-stream",
+            headers={"X-Chunk-SHA256": sha256} if sha256 else {},
+        )
+
+    def test_chunk_is_written_and_queued(self):
+        data = b"\x1a\x45\xdf\xa3" + b"x" * 200_000
+        response = self.put_chunk(data, 3, hashlib.sha256(data).hexdigest())
+
+        self.assertEqual(response.status_code, 200)
+        chunk = Path(self.temp_dir) / str(self.stream.id) / "chunk_3.webm"
+        self.assertEqual(chunk.read_bytes(), data)
+        self.assertEqual(response.json()["size"], len(data))
+        self.assertTrue(StreamChunk.objects.filter(streaming=self.stream, index=3).exists())
+        self.assertEqual(self.repair.call_args.args, ((self.stream.id, 3),))
+        self.assertEqual(self.package_live.call_args.args, ((self.stream.id, 3),))
+
+    def test_retry_is_acknowledged_once(self):
+        self.put_chunk(b"chunk", 1)
+        response = self.put_chunk(b"chunk", 1)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["duplicate"])
+        self.assertEqual(self.repair.call_count, 1)
+        self.assertEqual(self.package_live.call_count, 1)
+
+    def test_other_data_under_the_same_index_conflicts(self):
+        self.put_chunk(b"chunk", 1)
+
+        self.assertEqual(self.put_chunk(b"other", 1).status_code, 409)
+        self.assertEqual(
+            self.put_chunk(b"other", 1, hashlib.sha256(b"other").hexdigest()).status_code, 409
+        )
+
+    def test_only_the_upload_recorded_in_the_manifest_is_moved_into_place(self):
+        # Another upload of index 2 won the manifest row and has not renamed its file yet
+        StreamChunk.objects.create(
+            streaming=self.stream, index=2, size=6, sha256=hashlib.sha256(b"winner").hexdigest()
+        )
+        chunk = Path(self.temp_dir) / str(self.stream.id) / "chunk_2.webm"
+
+        with self.assertRaises(ChunkConflict):
+            store_chunk(self.stream, 2, [b"loser"])
+        self.assertFalse(chunk.exists())
+
+        stored, created = store_chunk(self.stream, 2, [b"winner"])
+        self.assertFalse(created)
+        self.assertEqual(chunk.read_bytes(), b"winner")
+        self.assertEqual([p.name for p in chunk.parent.iterdir()], ["chunk_2.webm"])
+
+    def test_missing_chunks_lists_gaps(self):
+        for index in (0, 2, 3):
+            self.put_chunk(b"chunk", index)
+        url = reverse("missing_chunks", args=[self.stream.id])
+
+        self.assertEqual(self.client.get(url).json()["missing"], [1])
+        self.assertEqual(self.client.get(url, {"expected": 6}).json()["missing"], [1, 4, 5])
+
+    def test_multipart_upload_validates_chunk_index(self):
+        response = self.client.post(
+            reverse("upload_chunk", args=[self.stream.id]),
+            {"chunk_index": "../../x", "video_chunk": SimpleUploadedFile("blob", b"chunk")},
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StreamChunk.objects.exists())
+
+    def test_checksum_mismatch_is_rejected(self):
+        response = self.put_chunk(b"chunk", sha256="0" * 64)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list((Path(self.temp_dir) / str(self.stream.id)).iterdir()), [])
+        self.package_live.assert_not_called()
+
+    def test_late_chunk_requeues_assembly(self):
+        Streaming.objects.filter(id=self.stream.id).update(is_live=False, has_ended=True)
+
+        with mock.patch("streamings.tasks.process_video.apply_async") as process:
+            self.assertEqual(self.put_chunk(b"chunk", 7).status_code, 200)
+        self.assertEqual(process.call_args.args, ((self.stream.id,),))
+        self.assertIn("soft_time_limit", process.call_args.kwargs)
+        self.package_live.assert_not_called()
+
+    def test_closed_recording_rejects_chunks(self):
+        Streaming.objects.filter(id=self.stream.id).update(
+            is_live=False, has_ended=True, video_file="recorded_streams/1.webm"
+        )
+
+        self.assertEqual(self.put_chunk(b"chunk", 7).status_code, 410)
+
+    def test_only_the_host_can_upload(self):
+        viewer = CustomUser.objects.create_user(username="viewer", password="secret")
+        self.client.force_login(viewer)
+
+        self.assertEqual(self.put_chunk(b"chunk").status_code, 404)
+
+class RangedFileResponseTests(TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        self.data = bytes(range(256)) * 4
+        self.path = Path(temp_dir) / "video.webm"
+        self.path.write_bytes(self.data)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get("/video", headers=headers)
+        response = ranged_file_response(request, self.path, "video/webm")
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range("bytes=0-99", 1024), (0, 99))
+        self.assertEqual(parse_range("bytes=1000-5000", 1024), (1000, 1023))
+        self.assertIsNone(parse_range(None, 1024))
+        self.assertIsNone(parse_range("bytes=-", 1024))
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=-0", 1024)
+
+    def test_suffix_range(self):
+        response = self.get(Range="bytes=-500")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 524-1023/1024")
+        self.assertEqual(self.body(response), self.data[-500:])
+
+    def test_open_ended_range(self):
+        response = self.get(Range="bytes=1000-")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Length"], "24")
+        self.assertEqual(self.body(response), self.data[1000:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range="bytes=2048-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_multiple_ranges_get_the_whole_file(self):
+        response = self.get(Range="bytes=0-1,5-6")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.data)
+
+    def test_stale_if_range_gets_the_whole_file(self):
+        etag = self.get()["ETag"]
+
+        self.assertEqual(self.get(Range="bytes=0-9", **{"If-Range": etag}).status_code, 206)
+        stale = self.get(Range="bytes=0-9", **{"If-Range": '"stale"'})
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(self.body(stale), self.data)
+        stale_date = self.get(Range="bytes=0-9", **{"If-Range": "Mon, 01 Jan 2001 00:00:00 GMT"})
+        self.assertEqual(stale_date.status_code, 200)
+
+    def test_if_none_match_is_not_modified(self):
+        etag = self.get()["ETag"]
+
+        response = self.get(**{"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+
+# ffprobe output for a Chrome MediaRecorder chunk ("video/webm; codecs=vp9"):
+# the WebM header has no Duration element, so ffprobe leaves it out
+RECORDER_CHUNK_PROBE = {
+    "packets": [
+        {"codec_type": "audio", "flags": "K__"},
+        {"codec_type": "video", "flags": "K__"},
+        {"codec_type": "video", "flags": "___"},
+    ],
+    "streams": [
+        {"codec_name": "vp9", "codec_type": "video", "height": 480},
+        {"codec_name": "opus", "codec_type": "audio"},
+    ],
+    "format": {"format_name": "matroska,webm"},
+}
+
+
+class ChunkAssemblyTests(TestCase):
+    def test_chunk_index_is_numeric(self):
+        names = ["chunk_10.webm", "chunk_2.webm", "fixed_chunk_1.webm", "chunk_0.webm"]
+        indexes = sorted(index for index in map(chunk_index, names) if index is not None)
+        self.assertEqual(indexes, [0, 2, 10])
+
+    def test_gap_map_lists_missing_ranges(self):
+        self.assertEqual(gap_map([0, 1, 2], chunk_duration=4), [])
+        self.assertEqual(
+            gap_map([0, 3, 4, 6], chunk_duration=4),
+            [
+                {"chunks": [1, 2], "start": 4, "end": 12},
+                {"chunks": [5, 5], "start": 20, "end": 24},
+            ],
+        )
+        self.assertEqual(gap_map([2], chunk_duration=4), [{"chunks": [0, 1], "start": 0, "end": 8}])
+
+    def test_recorder_chunks_can_be_copied(self):
+        self.assertTrue(can_stream_copy(RECORDER_CHUNK_PROBE))
+        self.assertTrue(can_stream_copy(
+            {**RECORDER_CHUNK_PROBE, "format": {"format_name": "matroska,webm", "duration": "N/A"}}
+        ))
+
+    def test_chunks_that_cannot_be_copied(self):
+        vp8 = [{"codec_name": "vp8", "codec_type": "video"}, {"codec_name": "opus", "codec_type": "audio"}]
+        no_keyframe = [{"codec_type": "video", "flags": "___"}]
+
+        self.assertFalse(can_stream_copy(None))
+        self.assertFalse(can_stream_copy({**RECORDER_CHUNK_PROBE, "streams": vp8}))
+        self.assertFalse(can_stream_copy({**RECORDER_CHUNK_PROBE, "packets": no_keyframe}))
+        self.assertFalse(can_stream_copy({**RECORDER_CHUNK_PROBE, "packets": []}))
+        self.assertFalse(can_stream_copy({**RECORDER_CHUNK_PROBE, "format": {"format_name": "mp4"}}))
+
+
+class ChunkRepairTests(TestCase):
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.chunks = [self.temp_dir / f"chunk_{index}.webm" for index in range(4)]
+
+    def test_results_keep_chunk_order_and_failures(self):
+        def repair(chunk):
+            # Later chunks finish first
+            time.sleep(0.01 * (4 - chunk_index(chunk)))
+            if chunk.name == "chunk_2.webm":
+                return None, "failed"
+            return chunk.with_name(f"fixed_{chunk.name}"), "transcode"
+
+        with mock.patch("streamings.media.repair_chunk", side_effect=repair):
+            repaired = repair_chunks(self.chunks, workers=4)
+
+        self.assertEqual(
+            [fixed.name if fixed else None for fixed, mode in repaired],
+            ["fixed_chunk_0.webm", "fixed_chunk_1.webm", None, "fixed_chunk_3.webm"],
+        )
+        self.assertEqual(repaired[2][1], "failed")
+
+    def test_pool_is_bounded_by_the_chunk_count(self):
+        with mock.patch("streamings.media.repair_chunk", return_value=(None, "failed")), \
+                mock.patch("streamings.media.ThreadPoolExecutor", wraps=ThreadPoolExecutor) as pool:
+            repair_chunks(self.chunks[:2], workers=8)
+
+        self.assertEqual(pool.call_args.kwargs["max_workers"], 2)
+
+    def test_later_chunks_get_the_header_of_the_first(self):
+        header = EBML_HEADER + b"segment info and tracks"
+        self.chunks[0].write_bytes(header + CLUSTER_ID + b"frames 0")
+        self.chunks[1].write_bytes(CLUSTER_ID + b"frames 1")
+
+        self.assertEqual(chunk_input(self.chunks[0]), (self.chunks[0], False))
+        source, is_temporary = chunk_input(self.chunks[1])
+        self.addCleanup(Path(source).unlink)
+        self.assertTrue(is_temporary)
+        self.assertEqual(Path(source).read_bytes(), header + CLUSTER_ID + b"frames 1")
+
+    def test_already_repaired_chunks_are_reused(self):
+        self.chunks[0].with_name("fixed_chunk_0.webm").write_bytes(b"fixed")
+
+        with mock.patch("streamings.media.repair_chunk", return_value=(None, "failed")) as repair:
+            repaired = repair_chunks(self.chunks[:2], workers=1)
+
+        self.assertEqual(repaired[0], (self.temp_dir / "fixed_chunk_0.webm", "cached"))
+        self.assertEqual(repair.call_args.args, (self.chunks[1],))
+
+    def test_progress_counts_chunks_repaired_live(self):
+        for chunk in self.chunks:
+            chunk.write_bytes(b"chunk")
+        self.chunks[0].with_name("fixed_chunk_0.webm").write_bytes(b"fixed")
+
+        self.assertEqual(chunk_progress(self.temp_dir), {"received": 4, "repaired": 1})
+        self.assertEqual(chunk_progress(self.temp_dir / "missing"), {"received": 0, "repaired": 0})
+
+
+class DashPackagingTests(TestCase):
+    def setUp(self):
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.output_dir = self.temp_dir / "dash"
+
+    def package(self, returncode=0):
+        def ffmpeg(command, **kwargs):
+            manifest = Path(command[-1])
+            manifest.write_text("<MPD/>")
+            return mock.Mock(returncode=returncode, stderr="")
+
+        with mock.patch("streamings.media.probe_chunk", return_value=RECORDER_CHUNK_PROBE), \
+                mock.patch("streamings.media.subprocess.run", side_effect=ffmpeg) as run:
+            manifest = package_dash(self.temp_dir / "1.webm", self.output_dir)
+        return manifest, run.call_args.args[0]
+
+    def test_ladder_stops_at_the_source_height(self):
+        manifest, command = self.package()
+
+        self.assertEqual(manifest, self.output_dir / "manifest.mpd")
+        self.assertTrue(manifest.exists())
+        self.assertIn("scale=-2:240", command)
+        self.assertIn("scale=-2:480", command)
+        self.assertNotIn("scale=-2:720", command)
+        self.assertIn("id=0,streams=v id=1,streams=a", command)
+
+    def test_failed_packaging_keeps_the_previous_package(self):
+        self.output_dir.mkdir()
+        (self.output_dir / "manifest.mpd").write_text("previous")
+
+        manifest, command = self.package(returncode=1)
+
+        self.assertIsNone(manifest)
+        self.assertEqual((self.output_dir / "manifest.mpd").read_text(), "previous")
+        self.assertFalse(self.output_dir.with_name("dash.building").exists())
+
+    def test_player_scripts_are_pinned_with_integrity(self):
+        pinned = {"url": "https://cdn.example.com/player@1.2.3/player.min.js", "integrity": "sha384-x"}
+        with self.settings(PLAYER_SCRIPTS={"player": pinned}):
+            self.assertEqual(check_player_scripts(), [])
+        with self.settings(PLAYER_SCRIPTS={"player": {**pinned, "integrity": ""}}):
+            self.assertEqual([e.id for e in check_player_scripts()], ["streamings.W001"])
+        for url in ("https://cdn.example.com/latest/player.js", "https://cdn.example.com/player@1"):
+            with self.settings(PLAYER_SCRIPTS={"player": {**pinned, "url": url}}):
+                self.assertEqual([e.id for e in check_player_scripts()], ["streamings.E001"])
+
+    def test_deploy_check_requires_every_integrity_hash(self):
+        scripts = {
+            "hashed": {"url": "https://cdn.example.com/a@1.2.3/a.js", "integrity": "sha384-x"},
+            "unhashed": {"url": "https://cdn.example.com/b@1.2.3/b.js", "integrity": ""},
+        }
+        with self.settings(PLAYER_SCRIPTS=scripts):
+            errors = check_player_script_integrity()
+        self.assertEqual([(e.id, e.msg) for e in errors], [
+            ("streamings.E002", "PLAYER_SCRIPTS['unhashed'] has no integrity hash."),
+        ])
+
+
+class ProcessVideoTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = CustomUser.objects.create_user(username="host", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Done", host=host, has_ended=True, expected_chunks=2
+        )
+        StreamChunk.objects.create(streaming=cls.stream, index=0, size=5, sha256="0" * 64)
+
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        settings_override = override_settings(MEDIA_TEMP_STREAMS=Path(temp_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        assemble_patch = mock.patch("streamings.tasks.assemble_recording")
+        self.assemble = assemble_patch.start()
+        self.addCleanup(assemble_patch.stop)
+
+    def hold_lock(self):
+        """Takes the processing lock the way another worker process would."""
+        lock_file = open(processing_lock_path(self.stream.id), "a")
+        self.addCleanup(lock_file.close)
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_missing_chunks_are_retried_before_assembling(self):
+        with mock.patch("streamings.tasks.process_video.retry", side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                process_video.apply(args=(self.stream.id,), throw=True)
+        self.assertEqual(retry.call_args.kwargs["countdown"], 1)
+        self.assemble.assert_not_called()
+        # Released for the retry
+        self.hold_lock()
+
+    def test_assembles_with_gaps_once_retries_run_out(self):
+        with self.settings(VIDEO_FINALIZE_RETRIES=0):
+            process_video.apply(args=(self.stream.id,))
+        self.assemble.assert_called_once()
+
+    def test_time_limits_grow_with_the_recording(self):
+        with self.settings(
+            VIDEO_PROCESSING_BASE_TIME=600,
+            VIDEO_PROCESSING_TIME_PER_CHUNK=6,
+            VIDEO_PROCESSING_MAX_TIME=3600,
+        ):
+            self.assertEqual(processing_time_limits(0), (600, 900))
+            self.assertEqual(processing_time_limits(300), (2400, 2700))
+            self.assertEqual(processing_time_limits(10_000), (3600, 3900))
+
+            with mock.patch("streamings.tasks.process_video.apply_async") as process:
+                queue_process_video(self.stream)
+            with self.settings(VIDEO_PACKAGING_TIME_PER_CHUNK=12), \
+                    mock.patch("streamings.tasks.package_stream.apply_async") as package:
+                queue_package_stream(self.stream.id, 200)
+        self.assertEqual(process.call_args.kwargs["soft_time_limit"], 612)
+        self.assertEqual(process.call_args.kwargs["time_limit"], 912)
+        self.assertEqual(package.call_args.kwargs["soft_time_limit"], 600 + 200 * 12)
+
+    def test_running_assembly_is_marked_pending(self):
+        Path(settings.MEDIA_TEMP_STREAMS).mkdir(exist_ok=True)
+        self.hold_lock()
+
+        process_video.apply(args=(self.stream.id,))
+
+        self.assemble.assert_not_called()
+        self.assertTrue(processing_pending_path(self.stream.id).exists())
+
+    def test_chunks_arriving_during_an_assembly_queue_another_one(self):
+        self.assemble.side_effect = lambda streaming: processing_pending_path(streaming.id).touch()
+
+        with self.settings(VIDEO_FINALIZE_RETRIES=0), \
+                mock.patch("streamings.tasks.process_video.apply_async") as requeue:
+            process_video.apply(args=(self.stream.id,))
+
+        requeue.assert_called_once()
+        self.hold_lock()
+
+    def test_cleanup_waits_for_a_running_assembly_without_giving_up(self):
+        Path(settings.MEDIA_TEMP_STREAMS).mkdir(exist_ok=True)
+        self.hold_lock()
+
+        with mock.patch("streamings.tasks.cleanup_stream_chunks.retry", side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                cleanup_stream_chunks.apply(args=(self.stream.id,), throw=True)
+        self.assertIsNone(retry.call_args.kwargs["max_retries"])
+
+    def test_short_recordings_get_higher_priority(self):
+        with self.settings(VIDEO_PRIORITY_STEP_CHUNKS=75):
+            self.assertEqual(media_priority(None), 0)
+            self.assertEqual(media_priority(74), 0)
+            self.assertEqual(media_priority(150), 2)
+            self.assertEqual(media_priority(10_000), 9)
+
+
+class AssembleRecordingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        host = CustomUser.objects.create_user(username="host", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Done", host=host, has_ended=True, expected_chunks=2
+        )
+        for index in range(2):
+            StreamChunk.objects.create(streaming=cls.stream, index=index, size=5, sha256="0" * 64)
+
+    def setUp(self):
+        temp_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, temp_dir)
+        settings_override = override_settings(
+            MEDIA_ROOT=temp_dir, MEDIA_TEMP_STREAMS=temp_dir / "temp_streams"
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.chunk_dir = temp_dir / "temp_streams" / str(self.stream.id)
+        self.chunk_dir.mkdir(parents=True)
+        for index in range(2):
+            (self.chunk_dir / f"chunk_{index}.webm").write_bytes(b"chunk")
+        for task in ("package_stream", "cleanup_stream_chunks"):
+            task_patch = mock.patch(f"streamings.tasks.{task}.apply_async")
+            task_patch.start()
+            self.addCleanup(task_patch.stop)
+
+    def assemble(self, single_pass_mode):
+        def single_pass(chunks, output):
+            if single_pass_mode != "failed":
+                output.write_bytes(b"recording")
+            return single_pass_mode
+
+        def repair(chunks):
+            return [(chunk.with_name(f"fixed_{chunk.name}"), "transcode") for chunk in chunks]
+
+        def concat(fixed_chunks, output, work_dir):
+            output.write_bytes(b"recording")
+            return True
+
+        with mock.patch("streamings.tasks.assemble_chunks", side_effect=single_pass), \
+                mock.patch("streamings.tasks.repair_chunks", side_effect=repair) as repair_chunks, \
+                mock.patch("streamings.tasks.concat_chunks", side_effect=concat):
+            result = assemble_recording(self.stream)
+        return result, repair_chunks
+
+    def test_single_pass_copy_repairs_nothing(self):
+        result, repair_chunks = self.assemble("copy")
+
+        repair_chunks.assert_not_called()
+        self.assertEqual({chunk["path"] for chunk in result["chunks"]}, {"copy"})
+        self.stream.refresh_from_db()
+        self.assertEqual(self.stream.video_file, f"recorded_streams/{self.stream.id}.webm")
+
+    def test_failed_single_pass_repairs_chunks_one_by_one(self):
+        result, repair_chunks = self.assemble("failed")
+
+        self.assertEqual(len(repair_chunks.call_args.args[0]), 2)
+        self.assertEqual({chunk["path"] for chunk in result["chunks"]}, {"transcode"})
+
+
+class LiveHlsTests(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        settings_override = override_settings(MEDIA_ROOT=Path(self.temp_dir))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def playlist(self):
+        return playlist_path(1).read_text()
+
+    def test_playlist_only_grows_with_consecutive_segments(self):
+        publish_segment(1, 1, 4.0)
+        self.assertNotIn("segment_1.ts", self.playlist())
+
+        publish_segment(1, 0, 4.0)
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:0", self.playlist())
+        self.assertLess(self.playlist().index("segment_0.ts"), self.playlist().index("segment_1.ts"))
+
+    def test_missing_chunk_is_skipped_once_later_segments_wait(self):
+        with self.settings(LIVE_HLS_GAP_SEGMENTS=2):
+            publish_segment(1, 0, 4.0)
+            publish_segment(1, 2, 4.0)
+            self.assertNotIn("segment_2.ts", self.playlist())
+
+            publish_segment(1, 3, 4.0)
+            self.assertIn("#EXT-X-DISCONTINUITY\n#EXTINF:4.000,\nsegment_2.ts", self.playlist())
+            # Too late for the live playlist
+            publish_segment(1, 1, 4.0)
+            self.assertNotIn("segment_1.ts", self.playlist())
+
+    def test_rolling_window_and_end_of_stream(self):
+        with self.settings(LIVE_HLS_PLAYLIST_SIZE=2):
+            for index in range(4):
+                publish_segment(1, index, 4.0)
+            publish_segment(1, ended=True)
+
+        playlist = self.playlist()
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:2", playlist)
+        self.assertNotIn("segment_1.ts", playlist)
+        self.assertTrue(playlist.endswith("#EXT-X-ENDLIST\n"))
+
+    def test_playlist_lock_is_held_across_processes(self):
+        playlist_lock_path(1).parent.mkdir(parents=True)
+        # A lock on another open file stands for another worker process
+        with open(playlist_lock_path(1), "a") as other_worker:
+            fcntl.flock(other_worker, fcntl.LOCK_EX)
+            with mock.patch("streamings.hls.PLAYLIST_LOCK_WAIT", 0.1):
+                with self.assertRaises(TimeoutError):
+                    publish_segment(1, 0, 4.0)
+        publish_segment(1, 0, 4.0)
+        self.assertIn("segment_0.ts", self.playlist())
+
+    def test_locked_playlist_retries_without_packaging_again(self):
+        chunk_dir = Path(self.temp_dir) / "temp_streams" / "1"
+        chunk_dir.mkdir(parents=True)
+        (chunk_dir / "chunk_0.webm").write_bytes(b"chunk")
+
+        with self.settings(MEDIA_TEMP_STREAMS=Path(self.temp_dir) / "temp_streams"), \
+                mock.patch("streamings.tasks.package_hls_segment", return_value=4.0) as package, \
+                mock.patch("streamings.tasks.publish_segment", side_effect=TimeoutError("Locked.")), \
+                mock.patch("streamings.tasks.package_live_segment.retry", side_effect=RuntimeError) as retry:
+            with self.assertRaises(RuntimeError):
+                package_live_segment.apply(args=(1, 0), throw=True)
+            package_live_segment.apply(args=(1, 1), kwargs={"duration": 4.0})
+
+        package.assert_called_once()
+        self.assertEqual(retry.call_args.kwargs["kwargs"], {"duration": 4.0})
+
+    def test_playlist_and_segments_are_cacheable(self):
+        publish_segment(1, 0, 4.0)
+        (playlist_path(1).parent / "segment_0.ts").write_bytes(b"ts")
+
+        playlist = self.client.get(reverse("get_live_hls", args=[1, "live.m3u8"]))
+        segment = self.client.get(reverse("get_live_hls", args=[1, "segment_0.ts"]))
+
+        self.assertEqual(playlist["Content-Type"], "application/vnd.apple.mpegurl")
+        self.assertIn("max-age=2", playlist["Cache-Control"])
+        self.assertIn("immutable", segment["Cache-Control"])
+        self.assertEqual(
+            self.client.get(reverse("get_live_hls", args=[1, "segments.json"])).status_code, 404
+        )
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class SignalingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = CustomUser.objects.create_user(username="host", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.host, is_live=True
+        )
+
+    async def connect(self, user=None):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/stream/{self.stream.id}/"
+        )
+        if user is not None:
+            communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        welcome = await communicator.receive_json_from()
+        self.assertEqual(welcome["type"], "welcome")
+        return communicator, welcome["peer_id"]
+
+    async def test_signals_only_reach_their_peer(self):
+        host, _ = await self.connect(self.host)
+        viewer, viewer_id = await self.connect()
+        bystander, _ = await self.connect()
+
+        await viewer.send_json_to({"type": "ready"})
+        ready = await host.receive_json_from()
+        self.assertEqual((ready["type"], ready["from"]), ("ready", viewer_id))
+
+        await host.send_json_to({"type": "offer", "target": viewer_id, "data": {"sdp": "offer"}})
+        offer = await viewer.receive_json_from()
+        self.assertEqual((offer["type"], offer["data"]), ("offer", {"sdp": "offer"}))
+        self.assertTrue(await bystander.receive_nothing())
+
+        for communicator in (host, viewer, bystander):
+            await communicator.disconnect()
+
+    async def welcome(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/stream/{self.stream.id}/"
+        )
+        await communicator.connect()
+        welcome = await communicator.receive_json_from()
+        await communicator.disconnect()
+        return welcome
+
+    async def test_viewers_know_whether_the_host_is_connected(self):
+        viewer, _ = await self.connect()
+        host, _ = await self.connect(self.host)
+        self.assertEqual((await viewer.receive_json_from())["type"], "host_joined")
+        welcome = await self.welcome()
+        self.assertEqual((welcome["live"], welcome["host_present"]), (True, True))
+
+        await host.disconnect()
+        self.assertEqual(await viewer.receive_json_from(), {"type": "host_left"})
+        self.assertFalse((await self.welcome())["host_present"])
+        await viewer.disconnect()
+
+    async def test_signal_for_unknown_peer_is_dropped(self):
+        host, _ = await self.connect(self.host)
+        viewer, viewer_id = await self.connect()
+
+        # The viewer never sent "ready", so the host cannot address it yet
+        await host.send_json_to({"type": "offer", "target": viewer_id, "data": {}})
+        self.assertTrue(await viewer.receive_nothing())
+
+        await host.disconnect()
+        await viewer.disconnect()
+
+    @skipUnless(find_spec("aiortc"), "aiortc is not installed")
+    async def test_relay_mode_negotiates_with_the_relay(self):
+        from aiortc import RTCPeerConnection, VideoStreamTrack
+
+        with self.settings(STREAMING_RELAY_MODE="relay"):
+            host, _ = await self.connect(self.host)
+            publisher = RTCPeerConnection()
+            publisher.addTrack(VideoStreamTrack())
+            await publisher.setLocalDescription(await publisher.createOffer())
+            await host.send_json_to({
+                "type": "offer",
+                "data": {"type": "offer", "sdp": publisher.localDescription.sdp},
+            })
+            answer = await host.receive_json_from(timeout=5)
+            self.assertEqual((answer["type"], answer["from"]), ("answer", "relay"))
+
+            viewer, _ = await self.connect()
+            await viewer.send_json_to({"type": "ready"})
+            offer = await viewer.receive_json_from(timeout=5)
+            self.assertEqual((offer["type"], offer["from"]), ("offer", "relay"))
+            self.assertIn("m=video", offer["data"]["sdp"])
+            # Only the codec of the shared encode is offered
+            self.assertIn("VP8/90000", offer["data"]["sdp"])
+            self.assertNotIn("H264", offer["data"]["sdp"])
+            self.assertEqual(len(relays[self.stream.id].viewers), 1)
+
+            await viewer.disconnect()
+            self.assertTrue(await host.receive_nothing())
+            self.assertEqual(relays[self.stream.id].viewers, {})
+            await host.disconnect()
+            await publisher.close()
+        self.assertNotIn(self.stream.id, relays)
+
+    @skipUnless(find_spec("aiortc"), "aiortc is not installed")
+    async def test_viewers_past_the_relay_limit_are_sent_to_hls(self):
+        from aiortc import RTCPeerConnection, VideoStreamTrack
+
+        with self.settings(STREAMING_RELAY_MODE="relay", STREAMING_RELAY_MAX_VIEWERS=1):
+            host, _ = await self.connect(self.host)
+            publisher = RTCPeerConnection()
+            publisher.addTrack(VideoStreamTrack())
+            await publisher.setLocalDescription(await publisher.createOffer())
+            await host.send_json_to({
+                "type": "offer",
+                "data": {"type": "offer", "sdp": publisher.localDescription.sdp},
+            })
+            await host.receive_json_from(timeout=5)
+
+            first, _ = await self.connect()
+            await first.send_json_to({"type": "ready"})
+            self.assertEqual((await first.receive_json_from(timeout=5))["type"], "offer")
+            second, _ = await self.connect()
+            await second.send_json_to({"type": "ready"})
+            self.assertEqual(await second.receive_json_from(timeout=5), {"type": "relay_full"})
+
+            # A viewer that is already subscribed can negotiate again
+            await first.send_json_to({"type": "ready"})
+            self.assertEqual((await first.receive_json_from(timeout=5))["type"], "offer")
+
+            for communicator in (first, second, host):
+                await communicator.disconnect()
+            await publisher.close()
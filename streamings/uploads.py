@@ -0,0 +1,176 @@
+"""
+Writes uploaded recording chunks to the stream's temp directory.
+
+Chunks are streamed to disk in blocks, hashed on the way and only renamed to
+chunk_<index>.webm once complete and recorded, so the repair tasks never pick
+up a partial file and memory use does not depend on the chunk size. Every stored chunk is
+recorded in the StreamChunk manifest, which makes retries idempotent and
+tells the recorder which chunks still have to be sent.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from django.conf import settings
+from .models import StreamChunk
+
+UPLOAD_BLOCK_SIZE = 64 * 1024
+
+
+class ChunkUploadError(Exception):
+    """The chunk was rejected and nothing was written."""
+
+
+class ChunkConflict(ChunkUploadError):
+    """A different chunk was already stored under the same index."""
+
+
+class RecordingClosed(ChunkUploadError):
+    """The stream was assembled and its chunks removed, nothing more is accepted."""
+
+
+def stream_temp_dir(stream_id):
+    return Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
+
+
+def chunk_path(stream_id, chunk_index):
+    return stream_temp_dir(stream_id) / f"chunk_{chunk_index}.webm"
+
+
+def parse_chunk_index(value):
+    try:
+        index = int(value)
+    except (TypeError, ValueError):
+        raise ChunkUploadError(f"Invalid chunk index: {value!r}.")
+    if not 0 <= index <= settings.VIDEO_CHUNK_MAX_INDEX:
+        raise ChunkUploadError(f"Chunk index out of range: {index}.")
+    return index
+
+
+def read_blocks(stream, length, block_size=UPLOAD_BLOCK_SIZE):
+    """Yields the body of a raw upload in blocks, never holding all of it."""
+    remaining = length
+    while remaining > 0:
+        block = stream.read(min(block_size, remaining))
+        if not block:
+            raise ChunkUploadError("Upload ended before Content-Length bytes were received.")
+        remaining -= len(block)
+        yield block
+
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def spool_chunk(stream_id, blocks, expected_sha256=None):
+    """
+    Writes `blocks` to a temporary file in the stream's directory and returns
+    its (path, size, sha256). Nothing is left behind if the upload is too
+    large or does not match `expected_sha256`. The file is fsynced when
+    VIDEO_CHUNK_FSYNC is "chunk" or "full".
+    """
+    directory = stream_temp_dir(stream_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    max_size = settings.VIDEO_CHUNK_MAX_SIZE
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, partial = tempfile.mkstemp(suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as chunk_file:
+            for block in blocks:
+                size += len(block)
+                if size > max_size:
+                    raise ChunkUploadError(f"Chunk is larger than {max_size} bytes.")
+                digest.update(block)
+                chunk_file.write(block)
+            if settings.VIDEO_CHUNK_FSYNC in ("chunk", "full"):
+                chunk_file.flush()
+                os.fsync(chunk_file.fileno())
+
+        sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256.lower() != sha256:
+            raise ChunkUploadError(
+                f"Checksum mismatch: expected {expected_sha256}, received {sha256}."
+            )
+    except BaseException:
+        os.unlink(partial)
+        raise
+    return partial, size, sha256
+
+
+def install_chunk(partial, destination):
+    """Moves a spooled chunk into place. With VIDEO_CHUNK_FSYNC "full" the rename survives a crash."""
+    os.replace(partial, destination)
+    if settings.VIDEO_CHUNK_FSYNC == "full":
+        fsync_directory(destination.parent)
+
+
+def hashes_match(chunk, blocks, sha256):
+    if sha256:
+        return sha256.lower() == chunk.sha256
+    # Without a client checksum the body has to be hashed to compare it
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest() == chunk.sha256
+
+
+def store_chunk(streaming, chunk_index, blocks, sha256=None):
+    """
+    Writes a chunk and records it in the manifest. Returns (chunk, created);
+    created is False when the same chunk had already been stored, in which
+    case nothing is written again. Raises ChunkConflict when the index is
+    already taken by different data.
+
+    Concurrent uploads of one index each spool their body to a temporary
+    file; the unique (streaming, index) constraint of the manifest picks the
+    winner and only its file is moved into place, so the file on disk always
+    matches the sha256 in the manifest.
+    """
+    destination = chunk_path(streaming.id, chunk_index)
+    closed = (
+        streaming.has_ended and streaming.video_file and not stream_temp_dir(streaming.id).exists()
+    )
+    existing = StreamChunk.objects.filter(streaming=streaming, index=chunk_index).first()
+    if existing is not None and (closed or destination.exists()):
+        if not hashes_match(existing, blocks, sha256):
+            raise ChunkConflict(f"Chunk {chunk_index} was already stored with other data.")
+        return existing, False
+    if closed:
+        raise RecordingClosed(f"The recording of stream {streaming.id} is closed.")
+
+    partial, size, digest = spool_chunk(streaming.id, blocks, sha256)
+    try:
+        chunk, created = existing, False
+        if chunk is None:
+            chunk, created = StreamChunk.objects.get_or_create(
+                streaming=streaming,
+                index=chunk_index,
+                defaults={"size": size, "sha256": digest},
+            )
+        if chunk.sha256 != digest:
+            raise ChunkConflict(f"Chunk {chunk_index} was already stored with other data.")
+        # A retry with the same data also restores a file that went missing
+        # after its manifest entry was recorded (e.g. a crash before the rename)
+        if created or not destination.exists():
+            install_chunk(partial, destination)
+        return chunk, created
+    finally:
+        if os.path.exists(partial):
+            os.unlink(partial)
+
+
+def missing_chunks(streaming, expected=None):
+    """
+    Indexes not in the manifest. Without `expected` (the number of chunks the
+    recorder produced) only the gaps below the highest received index are known.
+    """
+    received = set(streaming.chunks.values_list("index", flat=True))
+    if expected is None:
+        expected = max(received) + 1 if received else 0
+    return [index for index in range(expected) if index not in received]
@@ -7,9 +7,14 @@ from .views import (
     start_stream_live,
     view_recorded_stream,
     get_stream_video,
+    get_stream_dash,
+    get_live_hls,
     upload_chunk,
+    receive_chunk,
+    missing_chunks_view,
     finalize_stream,
     save_video,
+    check_video_status,
 )
 
 urlpatterns = [
@@ -31,8 +36,33 @@ urlpatterns = [
     path(
         "get_stream_video/<int:stream_id>/", get_stream_video, name="get_stream_video"
     ),
+    path(
+        "dash/<int:stream_id>/<str:filename>",
+        get_stream_dash,
+        name="get_stream_dash",
+    ),
+    path(
+        "live/<int:stream_id>/<str:filename>",
+        get_live_hls,
+        name="get_live_hls",
+    ),
     # Video upload and processing
     path("upload_chunk/<int:stream_id>/", upload_chunk, name="upload_chunk"),
+    path(
+        "chunk/<int:stream_id>/<int:chunk_index>/",
+        receive_chunk,
+        name="receive_chunk",
+    ),
+    path(
+        "chunk/<int:stream_id>/missing/",
+        missing_chunks_view,
+        name="missing_chunks",
+    ),
     path("stream/end/<int:stream_id>/", finalize_stream, name="finalize_stream"),
     path("save_video/<int:stream_id>/", save_video, name="save_video"),
+    path(
+        "check_video_status/<int:stream_id>/",
+        check_video_status,
+        name="check_video_status",
+    ),
 ]
@@ -1,20 +1,39 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_http_methods, require_POST
 from .forms import StreamingForm
 from .models import Streaming
-from users.models import CustomUser
 from django.http import Http404, JsonResponse, HttpResponse
-from django.utils import timezone
+from django.core.paginator import Paginator
+import json
 import os
 from django.conf import settings
-import subprocess
-from django.http import JsonResponse
 from datetime import datetime, timedelta
 import shutil
-import subprocess
 from pathlib import Path
-from .tasks import process_video
+from .tasks import (
+    end_live_playlist,
+    package_live_segment,
+    queue_process_video,
+    repair_stream_chunk,
+)
+from .media import chunk_progress, dash_dir, gap_map_path, hls_dir
+from .hls import PLAYLIST_NAME
+from chat.replay import INDEX_NAME as CHAT_REPLAY_INDEX, replay_dir
+from chat.tasks import build_chat_replay
+from .responses import ranged_file_response
+from .search import search_streams, search_users
+from .live import get_following_live_streams, get_live_streams, get_live_streams_by_host
+from .uploads import (
+    UPLOAD_BLOCK_SIZE,
+    ChunkConflict,
+    ChunkUploadError,
+    RecordingClosed,
+    missing_chunks,
+    parse_chunk_index,
+    read_blocks,
+    store_chunk,
+)
 
 
 # start stream view
@@ -52,49 +71,61 @@ def start_stream_live(request, stream_id):
     )
     return JsonResponse({"status": "error", "message": "Unable to start the stream."})
 
+STREAMS_PER_PAGE = 20
+USERS_PER_PAGE = 20
+MATCHING_STREAMS_LIMIT = 10
+
 # stream list
 @login_required
 def stream_list(request):
     print("Accediendo a la vista 'stream_list'.")
     current_user = request.user
-    # Filter streams that are live and have not ended
-    streams = Streaming.objects.filter(is_live=True, has_ended=False)
     following_filter = request.GET.get("following") == "true"
-    # Filter streams that the user is following
+    query = request.GET.get("query")
+
+    following_ids = None
+    if following_filter or query:
+        following_ids = set(current_user.following.values_list("id", flat=True))
+
+    # Live streams come from the cached directory
     if following_filter:
-        streams = streams.filter(host__in=current_user.following.all())
-        no_following_streams = not streams.exists()
+        streams = get_following_live_streams(current_user, following_ids)
     else:
-        no_following_streams = False
-
-    query = request.GET.get("query")
-    user_data = []
+        streams = get_live_streams()
+    streams_page = Paginator(streams, STREAMS_PER_PAGE).get_page(request.GET.get("page"))
+    no_active_streams = streams_page.paginator.count == 0
+    no_following_streams = following_filter and no_active_streams
+
+    user_data = None
+    users_page = None
+    matching_streams = None
+    no_user_found = False
     if query:
-        user_results = CustomUser.objects.filter(username__icontains=query)
-        for user in user_results:
-            has_active_stream = user.streams.filter(
-                is_live=True, has_ended=False
-            ).exists()
-            user_data.append(
-                {
-                    "user": user,
-                    "has_active_stream": has_active_stream,
-                    "active_stream": (
-                        user.streams.filter(is_live=True, has_ended=False).first()
-                        if has_active_stream
-                        else None
-                    ),
-                }
-            )
+        users_page = Paginator(search_users(query), USERS_PER_PAGE).get_page(
+            request.GET.get("user_page")
+        )
+        live_by_host = get_live_streams_by_host()
+        user_data = [
+            {
+                "user": user,
+                "has_active_stream": user.id in live_by_host,
+                "active_stream": live_by_host.get(user.id),
+                "is_following": user.id in following_ids,
+            }
+            for user in users_page
+        ]
         no_user_found = not user_data
-    else:
-        user_data = None
-        no_user_found = False
+        matching_streams = list(
+            search_streams(query)
+            .filter(is_live=True, has_ended=False)
+            .select_related("host")[:MATCHING_STREAMS_LIMIT]
+        )
 
-    no_active_streams = not streams.exists()
     context = {
-        "streams": streams,
+        "streams": streams_page,
         "user_data": user_data,
+        "users_page": users_page,
+        "matching_streams": matching_streams,
         "query": query,
         "following_filter": following_filter,
         "no_active_streams": no_active_streams,
@@ -125,30 +156,113 @@ def streaming_viewer_view(request, stream_id):
         "is_host": False,
         "username": request.user.username,
         "hostname": stream.host.username,
+        "hlsjs": settings.PLAYER_SCRIPTS["hlsjs"],
     }
     return render(request, "streamings/streaming_viewer_view.html", context)
 
 @login_required
 def following_streams(request):
-    following_users = request.user.following.all()
-    streams = Streaming.objects.filter(is_live=True, host__in=following_users)
+    streams = get_following_live_streams(request.user)
     return render(request, "streamings/following_streams.html", {"streams": streams})
 
+# Write an uploaded chunk and start repairing it right away. Retries of a
+# chunk that is already in the manifest are acknowledged without rewriting it.
+def save_chunk(streaming, chunk_index, uploaded_file, sha256=None):
+    chunk_index = parse_chunk_index(chunk_index)
+    chunk, created = store_chunk(
+        streaming, chunk_index, uploaded_file.chunks(UPLOAD_BLOCK_SIZE), sha256
+    )
+    if created:
+        chunk_stored(streaming, chunk_index)
+    return chunk, created
+
+def chunk_stored(streaming, chunk_index):
+    # Live repairs only matter if the single pass assembly fails, so they
+    # yield to every other media job
+    repair_stream_chunk.apply_async((streaming.id, chunk_index), priority=9)
+    # Live HLS segments are only useful while viewers are watching live
+    if settings.LIVE_HLS_ENABLED and streaming.is_live and not streaming.has_ended:
+        package_live_segment.apply_async((streaming.id, chunk_index), priority=0)
+    # A chunk arriving after finalize (a retry, a slow upload) re-queues the
+    # assembly, which picks it up or waits for the running one to finish
+    if streaming.has_ended:
+        queue_process_video(streaming)
+
+def chunk_error_response(stream_id, error):
+    print(f"[WARNING] Chunk upload for stream {stream_id} rejected: {error}")
+    if isinstance(error, ChunkConflict):
+        status = 409
+    elif isinstance(error, RecordingClosed):
+        status = 410
+    else:
+        status = 400
+    return JsonResponse({"status": "error", "message": str(error)}, status=status)
+
+# Raw chunk upload: the body is the chunk itself, so it is written to disk
+# block by block instead of going through the multipart parser
+@login_required
+@require_http_methods(["PUT"])
+def receive_chunk(request, stream_id, chunk_index):
+    streaming = get_object_or_404(Streaming, id=stream_id, host=request.user)
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length <= 0:
+        return JsonResponse(
+            {"status": "error", "message": "Content-Length is required."}, status=411
+        )
+    if length > settings.VIDEO_CHUNK_MAX_SIZE:
+        return JsonResponse({"status": "error", "message": "Chunk too large."}, status=413)
+
+    try:
+        chunk_index = parse_chunk_index(chunk_index)
+        chunk, created = store_chunk(
+            streaming,
+            chunk_index,
+            read_blocks(request, length),
+            request.headers.get("X-Chunk-SHA256"),
+        )
+    except ChunkUploadError as error:
+        return chunk_error_response(stream_id, error)
+
+    if created:
+        chunk_stored(streaming, chunk_index)
+    return JsonResponse(
+        {
+            "status": "success",
+            "chunk_index": chunk.index,
+            "size": chunk.size,
+            "sha256": chunk.sha256,
+            "duplicate": not created,
+        }
+    )
+
+# Chunks the recorder still has to send, from the manifest
+@login_required
+def missing_chunks_view(request, stream_id):
+    streaming = get_object_or_404(Streaming, id=stream_id, host=request.user)
+    expected = request.GET.get("expected")
+    try:
+        expected = int(expected) if expected is not None else None
+    except ValueError:
+        return JsonResponse({"status": "error", "message": "Invalid expected count."}, status=400)
+    return JsonResponse(
+        {"status": "success", "missing": missing_chunks(streaming, expected)}
+    )
+
 # Save the chunks
 def save_video_chunk(request, stream_id):
     if request.method == "POST" and request.FILES.get("video_chunk"):
         streaming = get_object_or_404(Streaming, id=stream_id)
 
-        # Create temporary directory for stream if it doesn't exist
-        stream_temp_dir = Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
-        stream_temp_dir.mkdir(parents=True, exist_ok=True)
-
-        # Save the chunk to a file
         chunk_index = request.POST.get("chunk_index")
-        chunk_file_path = stream_temp_dir / f"chunk_{chunk_index}.webm"
-        with open(chunk_file_path, "wb") as chunk_file:
-            for chunk in request.FILES["video_chunk"].chunks():
-                chunk_file.write(chunk)
+        try:
+            save_chunk(
+                streaming, chunk_index, request.FILES["video_chunk"], request.POST.get("sha256")
+            )
+        except ChunkUploadError as error:
+            return chunk_error_response(stream_id, error)
         return JsonResponse({"status": "success"}, status=200)
     return JsonResponse(
         {"status": "error", "message": "No video chunk found"}, status=400
@@ -167,35 +281,84 @@ def view_recorded_stream(request, stream_id):
     if not recorded_file.exists():
         return render(request, "streamings/waiting.html", {"stream_id": stream_id})
 
-    return render(request, "streamings/view_recorded_stream.html", {"stream": stream})
+    has_dash = (dash_dir(stream_id) / "manifest.mpd").exists()
+    gaps_file = gap_map_path(stream_id)
+    gaps = json.loads(gaps_file.read_text()) if gaps_file.exists() else []
+    has_chat_replay = (replay_dir(stream_id) / CHAT_REPLAY_INDEX).exists()
+    return render(
+        request,
+        "streamings/view_recorded_stream.html",
+        {
+            "stream": stream,
+            "has_dash": has_dash,
+            "dashjs": settings.PLAYER_SCRIPTS["dashjs"],
+            "gaps": gaps,
+            "has_chat_replay": has_chat_replay,
+        },
+    )
 
 @login_required
 def get_stream_video(request, stream_id):
     try:
         stream = Streaming.objects.get(id=stream_id)
-        video_content = stream.video_file
-        response = HttpResponse(video_content, content_type="video/webm")
-        response["Content-Disposition"] = (
-            f'inline; filename="stream_video_{stream_id}.webm"'
-        )
-        return response
     except Streaming.DoesNotExist:
         print(f"Stream ID={stream_id} no encontrado.")
         raise Http404("Stream not found.")
 
+    recorded_file = Path(settings.MEDIA_ROOT) / str(stream.video_file) if stream.video_file else None
+    if recorded_file is None or not recorded_file.exists():
+        raise Http404("Recording not available.")
+
+    return ranged_file_response(
+        request, recorded_file, "video/webm", filename=f"stream_video_{stream_id}.webm"
+    )
+
+DASH_CONTENT_TYPES = {
+    ".mpd": "application/dash+xml",
+    ".webm": "video/webm",
+}
+
+# Serve the DASH manifest and segments of a recorded stream
+@login_required
+def get_stream_dash(request, stream_id, filename):
+    content_type = DASH_CONTENT_TYPES.get(Path(filename).suffix)
+    dash_file = dash_dir(stream_id) / filename
+    if content_type is None or not dash_file.is_file():
+        raise Http404("DASH file not found.")
+    return ranged_file_response(request, dash_file, content_type)
+
+# Serve the live HLS playlist and segments. They are public like the viewer
+# page, so a CDN can cache them: segments never change, the playlist is
+# refreshed every half segment
+def get_live_hls(request, stream_id, filename):
+    if filename == PLAYLIST_NAME:
+        playlist = hls_dir(stream_id) / PLAYLIST_NAME
+        if not playlist.is_file():
+            raise Http404("Live playlist not available.")
+        response = HttpResponse(playlist.read_text(), content_type="application/vnd.apple.mpegurl")
+        response["Cache-Control"] = f"public, max-age={max(1, settings.VIDEO_CHUNK_DURATION // 2)}"
+        return response
+
+    segment = hls_dir(stream_id) / filename
+    if Path(filename).suffix != ".ts" or not segment.is_file():
+        raise Http404("Live segment not found.")
+    response = ranged_file_response(request, segment, "video/mp2t")
+    response["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
 # Upload the chunks
 @login_required
 def upload_chunk(request, stream_id):
     if request.method == "POST" and request.FILES.get("video_chunk"):
-        stream_temp_dir = Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
-        stream_temp_dir.mkdir(parents=True, exist_ok=True)
+        streaming = get_object_or_404(Streaming, id=stream_id)
 
         chunk_index = request.POST.get("chunk_index", "0")
-        chunk_path = stream_temp_dir / f"chunk_{chunk_index}.webm"
-
-        with open(chunk_path, "wb") as f:
-            for chunk in request.FILES["video_chunk"].chunks():
-                f.write(chunk)
+        try:
+            save_chunk(
+                streaming, chunk_index, request.FILES["video_chunk"], request.POST.get("sha256")
+            )
+        except ChunkUploadError as error:
+            return chunk_error_response(stream_id, error)
 
         return JsonResponse(
             {"status": "success", "message": f"Chunk {chunk_index} uploaded."}
@@ -214,13 +377,30 @@ def finalize_stream(request, stream_id):
             status=400,
         )
 
+    # The recorder sends how many chunks it produced, so the assembly knows
+    # whether to wait for uploads still in flight
+    try:
+        chunk_count = json.loads(request.body or "{}").get("chunk_count")
+    except (ValueError, AttributeError):
+        chunk_count = None
+    if not isinstance(chunk_count, int) or chunk_count < 0:
+        chunk_count = None
+
     # End the stream in the database
     stream = Streaming.objects.get(id=stream_id)
     stream.is_live = False
     stream.has_ended = True
+    stream.expected_chunks = chunk_count
     stream.save()
-    # Start background task
-    process_video.delay(stream_id)
+    # Start background task, short recordings are assembled first
+    queue_process_video(stream)
+    # The chat replay is built once the chat buffer has written the last messages
+    build_chat_replay.apply_async((stream_id,), countdown=settings.CHAT_REPLAY_DELAY)
+    if settings.LIVE_HLS_ENABLED:
+        # Leave time for the last chunks to be packaged before closing the playlist
+        end_live_playlist.apply_async(
+            (stream_id,), countdown=2 * settings.VIDEO_CHUNK_DURATION
+        )
 
     return JsonResponse(
         {
@@ -247,8 +427,13 @@ def clean_temp_files():
 def save_video_file(request, stream_id):
     if request.method == "POST" and request.FILES.get("video"):
         streaming = get_object_or_404(Streaming, id=stream_id)
-        video_file = request.FILES["video"].read()
-        streaming.video_file = video_file
+        # Copy the upload in blocks, read() would load the whole recording in memory
+        recorded_dir = Path(settings.MEDIA_ROOT) / "recorded_streams"
+        recorded_dir.mkdir(parents=True, exist_ok=True)
+        with open(recorded_dir / f"{stream_id}.webm", "wb") as video_file:
+            for block in request.FILES["video"].chunks(UPLOAD_BLOCK_SIZE):
+                video_file.write(block)
+        streaming.video_file = f"recorded_streams/{stream_id}.webm"
         streaming.has_ended = True
         streaming.save()
         return JsonResponse({"status": "success"}, status=200)
@@ -273,11 +458,12 @@ def save_video(request, stream_id):
             {"status": "error", "message": "No video file provided"}, status=400
         )
 
+    streaming = get_object_or_404(Streaming, id=stream_id)
     chunk_index = request.POST.get("chunk_index", "0")
-    chunk_path = stream_temp_dir / f"chunk_{chunk_index}.webm"
-    with open(chunk_path, "wb") as chunk_file:
-        for chunk in video_chunk.chunks():
-            chunk_file.write(chunk)
+    try:
+        save_chunk(streaming, chunk_index, video_chunk, request.POST.get("sha256"))
+    except ChunkUploadError as error:
+        return chunk_error_response(stream_id, error)
 
     return JsonResponse(
         {"status": "success", "message": "Video chunk saved successfully"}
@@ -287,4 +473,5 @@ def check_video_status(request, stream_id):
     recorded_file = Path(settings.MEDIA_ROOT) / "recorded_streams" / f"{stream_id}.webm"
     if recorded_file.exists():
         return JsonResponse({"status": "available"})
-    return JsonResponse({"status": "processing"})
\ No newline at end of file
+    stream_temp_dir = Path(settings.MEDIA_TEMP_STREAMS) / str(stream_id)
+    return JsonResponse({"status": "processing", "chunks": chunk_progress(stream_temp_dir)})
\ No newline at end of file
@@ -0,0 +1,124 @@
+import asyncio
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from . import tally
+
+
+def audience_key(stream_id):
+    return f"survey_audience:{stream_id}"
+
+
+def join_audience(stream_id):
+    # Sockets that die without disconnecting are never subtracted, so the
+    # counter expires SURVEY_AUDIENCE_TIMEOUT after the last viewer joined
+    key = audience_key(stream_id)
+    timeout = settings.SURVEY_AUDIENCE_TIMEOUT
+    cache.add(key, 0, timeout)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Expired between add and incr
+        cache.add(key, 1, timeout)
+    cache.touch(key, timeout)
+
+
+def leave_audience(stream_id):
+    try:
+        cache.decr(audience_key(stream_id))
+    except ValueError:
+        pass
+
+
+def get_audience(stream_id):
+    return max(cache.get(audience_key(stream_id), 0), 0)
+
+
+def tick_interval(audience):
+    """Seconds between result frames for a survey with `audience` connected viewers."""
+    interval = 0
+    for min_audience, seconds in sorted(settings.SURVEY_BROADCAST_TICKS):
+        if audience >= min_audience:
+            interval = seconds
+    return interval
+
+
+class ResultsCoalescer:
+    """
+    Merges every vote received within a tick into a single survey_update frame
+    per survey group. The tick grows with the audience size, and a vote that
+    arrives while a frame is being sent schedules one more tick, so the last
+    frame always reflects the final counters.
+    """
+
+    def __init__(self):
+        self.pending = {}
+
+    def request(self, channel_layer, stream_id, survey_id):
+        group_name = f"survey_{stream_id}"
+        state = self.pending.get(group_name)
+        if state is not None:
+            state["dirty"] = True
+            state["survey_id"] = survey_id
+            return
+
+        state = {"dirty": True, "survey_id": survey_id}
+        self.pending[group_name] = state
+        # The loop only keeps a weak reference to its tasks, a collected one
+        # would leave the group marked pending and never broadcast again
+        state["task"] = asyncio.get_running_loop().create_task(
+            self.run(channel_layer, stream_id, group_name, state)
+        )
+
+    async def run(self, channel_layer, stream_id, group_name, state):
+        try:
+            while state["dirty"]:
+                audience = await database_sync_to_async(get_audience)(stream_id)
+                await asyncio.sleep(tick_interval(audience))
+
+                state["dirty"] = False
+                results = await database_sync_to_async(tally.get_results)(state["survey_id"])
+                await channel_layer.group_send(
+                    group_name,
+                    {
+                        "type": "survey_update_message",
+                        "results": results,
+                    },
+                )
+        except Exception as e:
+            print(f"[ERROR] Could not broadcast results to {group_name}: {e}")
+        finally:
+            del self.pending[group_name]
+
+
+class TallyReconciler:
+    """
+    Reconciles the counters of the surveys voted on in this process when the
+    cache is local memory, where the reconcile_survey task cannot reach them.
+    One task per survey waits until voting has been quiet for
+    SURVEY_RECONCILE_DELAY, so live surveys are corrected too.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def request(self, survey_id):
+        if tally.shared_cache() or survey_id in self.tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self.run(survey_id))
+        # The loop only keeps a weak reference to its tasks
+        self.tasks[survey_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(survey_id, None))
+
+    async def run(self, survey_id):
+        wait = settings.SURVEY_RECONCILE_DELAY
+        try:
+            while wait:
+                await asyncio.sleep(wait)
+                wait = await database_sync_to_async(tally.reconcile_if_quiet)(survey_id)
+        except Exception as e:
+            print(f"[ERROR] Could not reconcile the tally of survey {survey_id}: {e}")
+
+
+results_coalescer = ResultsCoalescer()
+tally_reconciler = TallyReconciler()
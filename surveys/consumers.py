@@ -1,10 +1,16 @@
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
-from .models import Survey, Option, Vote
+from .models import Survey, Option
+from .tasks import queue_reconcile, record_vote
+from . import tally
+from .broadcast import join_audience, leave_audience, results_coalescer, tally_reconciler
 from streamings.models import Streaming
 
+logger = logging.getLogger(__name__)
+
 
 class SurveyConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -17,6 +23,7 @@ class SurveyConsumer(AsyncWebsocketConsumer):
 
         await self.channel_layer.group_add(self.survey_group_name, self.channel_name)
         await self.accept()
+        await database_sync_to_async(join_audience)(self.stream_id)
 
         print(f"[INFO] Client {self.channel_name} connected to {self.survey_group_name}")
 
@@ -27,6 +34,7 @@ class SurveyConsumer(AsyncWebsocketConsumer):
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.survey_group_name, self.channel_name)
+        await database_sync_to_async(leave_audience)(self.stream_id)
         print(f"[INFO] Client {self.channel_name} disconnected from {self.survey_group_name}")
 
     async def receive(self, text_data):
@@ -69,33 +77,38 @@ class SurveyConsumer(AsyncWebsocketConsumer):
         )
 
     async def handle_vote(self, data):
-        option_id = data.get("option_id")
-        if not option_id or not self.user.is_authenticated:
+        try:
+            option_id = int(data.get("option_id"))
+        except (TypeError, ValueError):
             return
-
-        option = await database_sync_to_async(Option.objects.select_related("survey").get)(id=option_id)
-        survey = option.survey
-
-        # Validar que la encuesta esté activa
-        if not survey.is_active:
+        if not self.user.is_authenticated:
             return
 
-        # Eliminar voto anterior del usuario (si existía)
-        await database_sync_to_async(Vote.objects.filter(user=self.user, option__survey=survey).delete)()
-
-        # Crear nuevo voto
-        await database_sync_to_async(Vote.objects.create)(option=option, user=self.user)
+        # Validar que la opción pertenezca a la encuesta activa
+        active = await self.get_cached_active_survey()
+        if not active or option_id not in active["options"]:
+            return
 
-        # Obtener resultados actualizados
-        results = await self.get_survey_results(survey)
+        # Aplicar el voto como +1/-1 sobre los contadores
+        try:
+            changed = await self.apply_vote(active["id"], option_id)
+        except tally.VoteInProgress as e:
+            logger.warning("Vote rejected: %s", e)
+            await self.send(
+                text_data=json.dumps({
+                    "type": "survey_error",
+                    "option_id": option_id,
+                    "message": "Your previous vote is still being counted, please vote again.",
+                })
+            )
+            return
+        if not changed:
+            return
 
-        await self.channel_layer.group_send(
-            self.survey_group_name,
-            {
-                "type": "survey_update_message",
-                "results": results,
-            },
-        )
+        # Los votos de un mismo intervalo se envían en un solo mensaje
+        results_coalescer.request(self.channel_layer, self.stream_id, active["id"])
+        # Los contadores en memoria local se reconcilian en este proceso
+        tally_reconciler.request(active["id"])
 
     async def send_active_survey(self, survey):
         options = await self.get_options_dict(survey)
@@ -143,29 +156,32 @@ class SurveyConsumer(AsyncWebsocketConsumer):
         )
         for text in options_texts[:5]:
             Option.objects.create(survey=survey, text=text)
+        # A vote in between may have cached "no active survey"
+        tally.clear_active_survey(self.stream_id)
         return survey
 
     @database_sync_to_async
     def deactivate_existing_surveys(self):
-        Survey.objects.filter(stream_id=self.stream_id, is_active=True).update(is_active=False)
+        surveys = Survey.objects.filter(stream_id=self.stream_id, is_active=True)
+        survey_ids = list(surveys.values_list("id", flat=True))
+        surveys.update(is_active=False)
+        tally.clear_active_survey(self.stream_id)
+        for survey_id in survey_ids:
+            queue_reconcile(survey_id)
 
     @database_sync_to_async
     def get_options_dict(self, survey):
         return [{"id": opt.id, "text": opt.text} for opt in survey.options.all()]
 
     @database_sync_to_async
-    def get_survey_results(self, survey, show_votes=False):
-        results = []
-        total = Vote.objects.filter(option__survey=survey).count()
-        for opt in survey.options.all():
-            count = opt.votes.count()
-            percent = (count / total) * 100 if total > 0 else 0
-            result = {
-                "option_id": opt.id,
-                "percentage": percent,
-                "votes": count
-            }
-            if show_votes:
-                result["votes"] = count
-            results.append(result)
-        return results
+    def get_cached_active_survey(self):
+        return tally.get_active_survey(self.stream_id)
+
+    @database_sync_to_async
+    def apply_vote(self, survey_id, option_id):
+        changed = tally.apply_vote(survey_id, self.user.id, option_id)
+        if changed:
+            # The Vote table is updated in the background
+            record_vote.delay(survey_id, self.user.id, option_id)
+            queue_reconcile(survey_id)
+        return changed
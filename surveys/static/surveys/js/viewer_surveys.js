@@ -64,6 +64,16 @@ document.addEventListener("DOMContentLoaded", () => {
       });
     }
 
+    if (data.type === "survey_error") {
+      // The vote was not counted, the user can cast it again
+      console.warn("[WARNING] Vote not counted:", data.message);
+      votedOptionIds.delete(data.option_id);
+      surveyOptions
+        .querySelectorAll(".vote-btn")
+        .forEach((btn) => (btn.disabled = false));
+      alert(data.message);
+    }
+
     if (data.type === "survey_update") {
       data.results.forEach((result) => {
         const optionId = result.option_id;
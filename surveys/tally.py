@@ -0,0 +1,195 @@
+"""
+Vote tallies kept in Django's cache (local memory, or Redis when configured)
+so a vote is a couple of O(1) counter updates instead of a full recount.
+The Vote table stays the durable log: votes are written to it asynchronously
+and reconcile_tally() rebuilds the counters from it once voting has been
+quiet for SURVEY_RECONCILE_DELAY, so every pending write has landed.
+"""
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from .models import Option, Survey, Vote
+
+# Seconds before the lock of a vote expires, should its process die holding it
+VOTER_LOCK_TIMEOUT = 10
+
+
+class VoteInProgress(Exception):
+    """Another vote of the same user is being applied, this one was not counted."""
+
+
+def active_survey_key(stream_id):
+    return f"survey_active:{stream_id}"
+
+
+def options_key(survey_id):
+    return f"survey_options:{survey_id}"
+
+
+def count_key(survey_id, option_id):
+    return f"survey_count:{survey_id}:{option_id}"
+
+
+def voter_key(survey_id, user_id):
+    return f"survey_voter:{survey_id}:{user_id}"
+
+
+def voter_lock_key(survey_id, user_id):
+    return f"survey_voter_lock:{survey_id}:{user_id}"
+
+
+def last_vote_key(survey_id):
+    return f"survey_last_vote:{survey_id}"
+
+
+def reconcile_queued_key(survey_id):
+    return f"survey_reconcile_queued:{survey_id}"
+
+
+def shared_cache():
+    """Whether every process sees the same counters (e.g. Redis), not one copy each."""
+    backend = settings.CACHES["default"]["BACKEND"]
+    return not backend.endswith(("LocMemCache", "DummyCache"))
+
+
+def get_active_survey(stream_id):
+    """Returns {"id", "options"} for the active survey of a stream, or None."""
+    active = cache.get(active_survey_key(stream_id))
+    if active is not None:
+        return active or None
+
+    survey = Survey.objects.filter(stream_id=stream_id, is_active=True).first()
+    if survey is None:
+        # Kept briefly, a survey started in another process shows up quickly
+        cache.set(active_survey_key(stream_id), {}, settings.SURVEY_NO_ACTIVE_TIMEOUT)
+        return None
+    active = {"id": survey.id, "options": load_tally(survey.id)}
+    cache.set(active_survey_key(stream_id), active, settings.SURVEY_TALLY_TIMEOUT)
+    return active
+
+
+def clear_active_survey(stream_id):
+    cache.delete(active_survey_key(stream_id))
+
+
+def load_tally(survey_id):
+    """
+    Seeds the counters of a survey from the database if they are not cached yet.
+    Returns the option ids of the survey.
+    """
+    option_ids = cache.get(options_key(survey_id))
+    if option_ids is not None:
+        return option_ids
+    return reconcile_tally(survey_id)
+
+
+def reconcile_tally(survey_id):
+    """Rebuilds the counters of a survey from the Vote table."""
+    counts = list(
+        Option.objects.filter(survey_id=survey_id)
+        .order_by("id")
+        .annotate(total=Count("votes"))
+        .values_list("id", "total")
+    )
+    voters = Vote.objects.filter(option__survey_id=survey_id).values_list("user_id", "option_id")
+
+    values = {count_key(survey_id, option_id): total for option_id, total in counts}
+    values.update({voter_key(survey_id, user_id): option_id for user_id, option_id in voters})
+    cache.set_many(values, settings.SURVEY_TALLY_TIMEOUT)
+
+    option_ids = [option_id for option_id, _ in counts]
+    cache.set(options_key(survey_id), option_ids, settings.SURVEY_TALLY_TIMEOUT)
+    return option_ids
+
+
+def add_to_count(survey_id, option_id, delta):
+    key = count_key(survey_id, option_id)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # The counter was evicted, it is rebuilt on the next reconciliation
+        cache.add(key, max(delta, 0), settings.SURVEY_TALLY_TIMEOUT)
+
+
+@contextmanager
+def voter_lock(survey_id, user_id):
+    """
+    Held while a vote of the user is applied. A single cache.add, it never
+    waits: votes run on the consumer's shared sync thread, where waiting
+    would stall every other database call of the ASGI worker.
+    """
+    key = voter_lock_key(survey_id, user_id)
+    if not cache.add(key, True, VOTER_LOCK_TIMEOUT):
+        raise VoteInProgress(f"A vote of user {user_id} in survey {survey_id} is being applied.")
+    try:
+        yield
+    finally:
+        cache.delete(key)
+
+
+def apply_vote(survey_id, user_id, option_id):
+    """
+    Moves the vote of a user to `option_id` as +1/-1 deltas.
+    Returns False if the user had already voted for that option. Votes of
+    the same user are applied one at a time, so two of them cannot both
+    read the same previous option and count twice: the later one raises
+    VoteInProgress and the user has to vote again.
+    """
+    key = voter_key(survey_id, user_id)
+    with voter_lock(survey_id, user_id):
+        previous = cache.get(key)
+        if previous == option_id:
+            return False
+
+        cache.set(key, option_id, settings.SURVEY_TALLY_TIMEOUT)
+        if previous is not None:
+            add_to_count(survey_id, previous, -1)
+        add_to_count(survey_id, option_id, 1)
+    cache.set(last_vote_key(survey_id), time.time(), settings.SURVEY_TALLY_TIMEOUT)
+    return True
+
+
+def reconcile_wait(survey_id):
+    """Seconds until voting on a survey has been quiet for SURVEY_RECONCILE_DELAY."""
+    last_vote = cache.get(last_vote_key(survey_id))
+    if last_vote is None:
+        return 0
+    return max(0, last_vote + settings.SURVEY_RECONCILE_DELAY - time.time())
+
+
+def claim_reconcile(survey_id):
+    """True for the first caller until release_reconcile(), so one reconciliation is queued at a time."""
+    return cache.add(reconcile_queued_key(survey_id), True, settings.SURVEY_TALLY_TIMEOUT)
+
+
+def release_reconcile(survey_id):
+    cache.delete(reconcile_queued_key(survey_id))
+
+
+def reconcile_if_quiet(survey_id):
+    """
+    Rebuilds the counters unless a vote was applied less than
+    SURVEY_RECONCILE_DELAY ago (its write may not have landed yet). Returns
+    the seconds to wait before trying again, 0 once reconciled.
+    """
+    wait = reconcile_wait(survey_id)
+    if wait == 0:
+        reconcile_tally(survey_id)
+    return wait
+
+
+def get_results(survey_id):
+    option_ids = load_tally(survey_id)
+    counts = cache.get_many([count_key(survey_id, option_id) for option_id in option_ids])
+    votes = [max(counts.get(count_key(survey_id, option_id), 0), 0) for option_id in option_ids]
+    total = sum(votes)
+    return [
+        {
+            "option_id": option_id,
+            "percentage": (count / total) * 100 if total > 0 else 0,
+            "votes": count,
+        }
+        for option_id, count in zip(option_ids, votes)
+    ]
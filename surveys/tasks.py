@@ -0,0 +1,42 @@
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from surveys.models import Vote
+from surveys import tally
+
+
+@shared_task
+def record_vote(survey_id, user_id, option_id):
+    """Writes a vote already applied to the cached tally to the Vote table."""
+    with transaction.atomic():
+        Vote.objects.filter(user_id=user_id, option__survey_id=survey_id).exclude(
+            option_id=option_id
+        ).delete()
+        Vote.objects.get_or_create(user_id=user_id, option_id=option_id)
+
+
+@shared_task(bind=True, max_retries=None)
+def reconcile_survey(self, survey_id):
+    """
+    Rebuilds the cached tally of a survey from the Vote table once voting has
+    been quiet long enough for every vote write to land. Only useful with a
+    shared cache, a worker's local memory cache is not the one votes go to.
+    """
+    wait = tally.reconcile_if_quiet(survey_id)
+    if wait:
+        raise self.retry(countdown=wait)
+    tally.release_reconcile(survey_id)
+    print(f"[INFO] Tally of survey {survey_id} reconciled with the database.")
+
+
+def queue_reconcile(survey_id):
+    """
+    Queues the reconciliation of a survey when its counters live in a shared
+    cache. Returns False when they live in this process, which then has to
+    reconcile them itself (see surveys.broadcast.tally_reconciler).
+    """
+    if not tally.shared_cache():
+        return False
+    if tally.claim_reconcile(survey_id):
+        reconcile_survey.apply_async((survey_id,), countdown=settings.SURVEY_RECONCILE_DELAY)
+    return True
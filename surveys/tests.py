@@ -1,3 +1,185 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import TestCase, override_settings
+from streamings.models import Streaming
+from users.models import CustomUser
+from . import tally
+from .broadcast import ResultsCoalescer, get_audience, join_audience, leave_audience, tick_interval
+from .models import Option, Survey, Vote
+from .routing import websocket_urlpatterns
+from .tasks import queue_reconcile
 
-# Create your tests here.
+
+class TallyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username="viewer", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.user, is_live=True
+        )
+        cls.survey = Survey.objects.create(stream=cls.stream, question="Which?", created_by=cls.user)
+        cls.yes = Option.objects.create(survey=cls.survey, text="Yes")
+        cls.no = Option.objects.create(survey=cls.survey, text="No")
+
+    def setUp(self):
+        cache.clear()
+        # Seeded by get_active_survey before the first vote
+        tally.load_tally(self.survey.id)
+
+    def votes(self):
+        return {result["option_id"]: result["votes"] for result in tally.get_results(self.survey.id)}
+
+    def test_vote_moves_between_options(self):
+        self.assertTrue(tally.apply_vote(self.survey.id, self.user.id, self.yes.id))
+        self.assertFalse(tally.apply_vote(self.survey.id, self.user.id, self.yes.id))
+        self.assertTrue(tally.apply_vote(self.survey.id, self.user.id, self.no.id))
+
+        self.assertEqual(self.votes(), {self.yes.id: 0, self.no.id: 1})
+
+    def test_concurrent_votes_of_one_user_count_once(self):
+        options = [self.yes.id, self.no.id] * 8
+        barrier = threading.Barrier(len(options))
+
+        cache_get = LocMemCache.get
+
+        def slow_get(self, key, *args, **kwargs):
+            value = cache_get(self, key, *args, **kwargs)
+            if key.startswith("survey_voter:"):
+                # Lets the other votes read the same previous option
+                time.sleep(0.01)
+            return value
+
+        rejected = []
+
+        def vote(option_id):
+            barrier.wait()
+            try:
+                tally.apply_vote(self.survey.id, self.user.id, option_id)
+            except tally.VoteInProgress:
+                rejected.append(option_id)
+
+        threads = [threading.Thread(target=vote, args=(option_id,)) for option_id in options]
+        # Each thread has its own cache connection, so the class is patched
+        with mock.patch.object(LocMemCache, "get", slow_get):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(sum(self.votes().values()), 1)
+        self.assertTrue(rejected)
+
+    def test_contended_vote_fails_fast(self):
+        with tally.voter_lock(self.survey.id, self.user.id):
+            started = time.monotonic()
+            with self.assertRaises(tally.VoteInProgress):
+                tally.apply_vote(self.survey.id, self.user.id, self.yes.id)
+            self.assertLess(time.monotonic() - started, 0.1)
+        self.assertTrue(tally.apply_vote(self.survey.id, self.user.id, self.yes.id))
+
+    def test_missing_survey_is_only_cached_briefly(self):
+        other = Streaming.objects.create(title="Other", description="Live", host=self.user)
+
+        with self.settings(SURVEY_NO_ACTIVE_TIMEOUT=0):
+            self.assertIsNone(tally.get_active_survey(other.id))
+            survey = Survey.objects.create(stream=other, question="Now?", created_by=self.user)
+            self.assertEqual(tally.get_active_survey(other.id)["id"], survey.id)
+
+    def test_reconcile_waits_until_voting_is_quiet(self):
+        tally.apply_vote(self.survey.id, self.user.id, self.yes.id)
+
+        self.assertGreater(tally.reconcile_if_quiet(self.survey.id), 0)
+        self.assertEqual(self.votes()[self.yes.id], 1)
+
+        # The vote write landed and voting went quiet
+        Vote.objects.create(user=self.user, option=self.no)
+        cache.set(tally.last_vote_key(self.survey.id), time.time() - 60)
+        self.assertEqual(tally.reconcile_if_quiet(self.survey.id), 0)
+        self.assertEqual(self.votes(), {self.yes.id: 0, self.no.id: 1})
+
+    def test_one_reconciliation_is_queued_with_a_shared_cache(self):
+        with mock.patch("surveys.tasks.reconcile_survey.apply_async") as reconcile:
+            self.assertFalse(queue_reconcile(self.survey.id))
+            with mock.patch("surveys.tally.shared_cache", return_value=True):
+                self.assertTrue(queue_reconcile(self.survey.id))
+                self.assertTrue(queue_reconcile(self.survey.id))
+
+        self.assertEqual(reconcile.call_count, 1)
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class SurveyConsumerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username="viewer", password="secret")
+        cls.stream = Streaming.objects.create(
+            title="Stream", description="Live", host=cls.user, is_live=True
+        )
+        cls.survey = Survey.objects.create(stream=cls.stream, question="Which?", created_by=cls.user)
+        cls.yes = Option.objects.create(survey=cls.survey, text="Yes")
+        Option.objects.create(survey=cls.survey, text="No")
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_contended_vote_is_reported_to_the_voter(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f"/ws/surveys/{self.stream.id}/"
+        )
+        communicator.scope["user"] = self.user
+        await communicator.connect()
+        self.assertEqual((await communicator.receive_json_from())["type"], "survey_start")
+
+        cache.add(tally.voter_lock_key(self.survey.id, self.user.id), True)
+        await communicator.send_json_to({"type": "survey_update", "option_id": self.yes.id})
+        error = await communicator.receive_json_from()
+        self.assertEqual((error["type"], error["option_id"]), ("survey_error", self.yes.id))
+        await communicator.disconnect()
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_audience_counts_viewers_and_expires(self):
+        with self.settings(SURVEY_AUDIENCE_TIMEOUT=60):
+            join_audience(1)
+            join_audience(1)
+            leave_audience(1)
+            self.assertEqual(get_audience(1), 1)
+
+            # A viewer whose socket died is never subtracted
+            later = time.time() + 61
+            with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+                self.assertEqual(get_audience(1), 0)
+
+    def test_tick_grows_with_audience(self):
+        with self.settings(SURVEY_BROADCAST_TICKS=[(0, 0.1), (100, 0.5)]):
+            self.assertEqual(tick_interval(0), 0.1)
+            self.assertEqual(tick_interval(99), 0.1)
+            self.assertEqual(tick_interval(100), 0.5)
+
+    @mock.patch("surveys.broadcast.tally.get_results", return_value=[])
+    def test_votes_within_a_tick_send_one_frame(self, get_results):
+        coalescer = ResultsCoalescer()
+        channel_layer = mock.Mock(group_send=mock.AsyncMock())
+
+        async def vote_three_times():
+            for _ in range(3):
+                coalescer.request(channel_layer, 1, 7)
+            task = coalescer.pending["survey_1"]["task"]
+            await asyncio.wait_for(task, timeout=5)
+
+        with self.settings(SURVEY_BROADCAST_TICKS=[(0, 0)]):
+            async_to_sync(vote_three_times)()
+
+        channel_layer.group_send.assert_awaited_once()
+        get_results.assert_called_once_with(7)
+        self.assertEqual(coalescer.pending, {})
@@ -2,6 +2,8 @@ from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from .models import Survey
+from .tasks import queue_reconcile
+from . import tally
 from streamings.models import Streaming
 
 
@@ -15,4 +17,7 @@ def end_survey(request, survey_id):
 
     survey.is_active = False
     survey.save()
+    tally.clear_active_survey(survey.stream_id)
+    # The counters are rebuilt once pending vote writes have landed
+    queue_reconcile(survey.id)
     return JsonResponse({'message': 'Survey ended successfully'}, status=200)
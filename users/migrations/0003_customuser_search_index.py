@@ -0,0 +1,72 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE users_customuser_fts USING fts5(
+        username, content='users_customuser', content_rowid='id', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER users_customuser_fts_insert AFTER INSERT ON users_customuser BEGIN
+        INSERT INTO users_customuser_fts(rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    """
+    CREATE TRIGGER users_customuser_fts_delete AFTER DELETE ON users_customuser BEGIN
+        INSERT INTO users_customuser_fts(users_customuser_fts, rowid, username)
+        VALUES ('delete', old.id, old.username);
+    END
+    """,
+    """
+    CREATE TRIGGER users_customuser_fts_update AFTER UPDATE OF username ON users_customuser BEGIN
+        INSERT INTO users_customuser_fts(users_customuser_fts, rowid, username)
+        VALUES ('delete', old.id, old.username);
+        INSERT INTO users_customuser_fts(rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    "INSERT INTO users_customuser_fts(users_customuser_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS users_customuser_fts_insert",
+    "DROP TRIGGER IF EXISTS users_customuser_fts_delete",
+    "DROP TRIGGER IF EXISTS users_customuser_fts_update",
+    "DROP TABLE IF EXISTS users_customuser_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Matches the UPPER(...) LIKE UPPER(...) that Django emits for icontains
+    """
+    CREATE INDEX IF NOT EXISTS users_customuser_username_trgm
+    ON users_customuser USING gin ((UPPER(username::text)) gin_trgm_ops)
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS users_customuser_username_trgm",
+]
+
+
+def run_for_vendor(sqlite, postgresql):
+    def run(apps, schema_editor):
+        statements = {"sqlite": sqlite, "postgresql": postgresql}.get(
+            schema_editor.connection.vendor, []
+        )
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_customuser_followers'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor(SQLITE_FORWARD, POSTGRES_FORWARD),
+            run_for_vendor(SQLITE_BACKWARD, POSTGRES_BACKWARD),
+        ),
+    ]